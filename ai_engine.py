@@ -5,6 +5,7 @@ Krishi-Mitra AI - AI Engine Module
 This module handles:
 1. Crop Disease Detection using MobileNetV2 (TFLite)
 2. Fusion Logic: Cross-referencing AI diagnosis with weather data
+3. A process-wide pool of warm interpreters shared by app.py and server.py
 
 Author: Krishi-Mitra Team
 """
@@ -13,11 +14,55 @@ Author: Krishi-Mitra Team
 import numpy as np
 from PIL import Image
 import os
+import hashlib
+import io
+import json
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 
 # ============================================================
 # CONFIGURATION
 # ============================================================
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "models", "crop_disease.tflite")
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "models")
+MODEL_PATH = os.path.join(MODEL_DIR, "crop_disease.tflite")
+
+# Quantized artifacts written by converter_model.py sit next to the float model
+# as crop_disease_<variant>.tflite. AI_MODEL_VARIANT picks which one to serve.
+MODEL_VARIANTS = ("float32", "dynamic", "float16", "int8")
+MODEL_VARIANT = os.getenv("AI_MODEL_VARIANT", "float32")
+
+# Interpreter pool tuning (override via environment)
+# NUM_THREADS: CPU threads each interpreter may use for a single invoke
+# POOL_SIZE: max warm interpreters per process (one per concurrent worker thread)
+NUM_THREADS = int(os.getenv("TFLITE_NUM_THREADS", "2"))
+POOL_SIZE = int(os.getenv("TFLITE_POOL_SIZE", "4"))
+# POOL_RETRY_SECONDS: after a failed model load, wait this long before trying again
+POOL_RETRY_SECONDS = float(os.getenv("TFLITE_POOL_RETRY", "30"))
+# POOL_WAIT_SECONDS: longest a caller waits for an interpreter when all are checked out
+POOL_WAIT_SECONDS = float(os.getenv("TFLITE_POOL_WAIT", "30"))
+# MAX_BATCH_SIZE: images per invoke in predict_disease_batch (bounds tensor memory)
+MAX_BATCH_SIZE = int(os.getenv("TFLITE_MAX_BATCH", "32"))
+# FAST_PREPROCESS: JPEG draft decoding + normalizing straight into the input tensor
+FAST_PREPROCESS = os.getenv("AI_FAST_PREPROCESS", "1") == "1"
+
+# Inference runtime: "auto" prefers the lightweight tflite-runtime, then ONNX
+# Runtime (needs a crop_disease.onnx next to the .tflite), then full TensorFlow.
+# Set AI_RUNTIME to one of RUNTIME_BACKENDS to force a backend.
+RUNTIME_BACKENDS = ("tflite_runtime", "onnxruntime", "tensorflow")
+RUNTIME = os.getenv("AI_RUNTIME", "auto")
+
+# Crop-specific models: registry file mapping crops to small specialised
+# models, and the memory budget for crop models kept loaded at once
+MODEL_REGISTRY_PATH = os.getenv("MODEL_REGISTRY_PATH", os.path.join(MODEL_DIR, "registry.json"))
+MODEL_MEMORY_CAP_MB = float(os.getenv("MODEL_MEMORY_CAP_MB", "256"))
+
+# Seconds between checks of the model directory for a new model version
+# (0 disables hot-swapping)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "10"))
 
 # Disease classes (Update based on your trained model)
 # COPY AND PASTE THIS FULL LIST INTO ai_engine.py
@@ -67,25 +112,688 @@ DISEASE_CLASSES = [
 # CORE FUNCTIONS
 # ============================================================
 
-def load_tflite_model():
+# Fallback warnings already printed (the model watcher resolves the path on every poll)
+_variant_warnings = set()
+
+
+def _warn_variant_once(message: str):
+    if message not in _variant_warnings:
+        _variant_warnings.add(message)
+        print(message)
+
+
+def get_model_path(variant: str = None) -> str:
+    """
+    Resolve the model file for a quantization variant.
+    Falls back to the float32 model when the variant has not been exported.
+    """
+    variant = variant or MODEL_VARIANT
+    if variant == "float32":
+        return MODEL_PATH
+    if variant not in MODEL_VARIANTS:
+        _warn_variant_once(f"[AI Engine] Unknown model variant '{variant}', using float32")
+        return MODEL_PATH
+    path = os.path.join(MODEL_DIR, f"crop_disease_{variant}.tflite")
+    if not os.path.exists(path):
+        _warn_variant_once(f"[AI Engine] {variant} model not found at {path}, using float32")
+        return MODEL_PATH
+    return path
+
+
+_stats_lock = threading.Lock()
+_ENGINE_STATS = {
+    "load_count": 0,
+    "load_ms_total": 0.0,
+    "load_ms_last": 0.0,
+    "inference_count": 0,
+    "inference_ms_total": 0.0,
+    "inference_ms_last": 0.0,
+    "runtime": None,
+    "runtime_import_ms": {},
+}
+
+
+def _record_timing(kind: str, elapsed_ms: float):
+    """Accumulate a load/inference timing sample into the engine stats."""
+    with _stats_lock:
+        _ENGINE_STATS[f"{kind}_count"] += 1
+        _ENGINE_STATS[f"{kind}_ms_total"] += elapsed_ms
+        _ENGINE_STATS[f"{kind}_ms_last"] = elapsed_ms
+
+
+_model_bytes_cache = {}
+
+
+def _read_model_bytes(model_path: str) -> bytes:
+    """Read a model file once per process and keep its bytes in memory."""
+    if model_path not in _model_bytes_cache:
+        with open(model_path, "rb") as f:
+            _model_bytes_cache[model_path] = f.read()
+    return _model_bytes_cache[model_path]
+
+
+class _OnnxInterpreter:
+    """
+    Adapter exposing the subset of the tf.lite.Interpreter API used by this
+    module on top of an ONNX Runtime session, so the pool, batching and
+    fast-preprocessing paths work unchanged. Expects a float NHWC model
+    (e.g. exported with tf2onnx from the same Keras model).
+    """
+
+    def __init__(self, model_content: bytes = None, num_threads: int = None, model_path: str = None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self._session = ort.InferenceSession(
+            model_content or model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        model_input = self._session.get_inputs()[0]
+        model_output = self._session.get_outputs()[0]
+        self._input_name = model_input.name
+        self._output_name = model_output.name
+        self._num_classes = model_output.shape[-1]
+        self._input = np.zeros([d if isinstance(d, int) else 1 for d in model_input.shape], dtype=np.float32)
+        self._output = None
+
+    def allocate_tensors(self):
+        pass
+
+    def get_input_details(self):
+        return [{"index": 0, "name": self._input_name, "shape": np.array(self._input.shape),
+                 "dtype": np.float32, "quantization": (0.0, 0)}]
+
+    def get_output_details(self):
+        return [{"index": 1, "name": self._output_name, "shape": np.array([self._input.shape[0], self._num_classes]),
+                 "dtype": np.float32, "quantization": (0.0, 0)}]
+
+    def resize_tensor_input(self, index, shape, strict=False):
+        self._input = np.zeros(shape, dtype=np.float32)
+
+    def set_tensor(self, index, value):
+        self._input[...] = value
+
+    def tensor(self, index):
+        return lambda: self._input
+
+    def invoke(self):
+        self._output = self._session.run([self._output_name], {self._input_name: self._input})[0]
+
+    def get_tensor(self, index):
+        return self._output.copy()
+
+
+def _import_runtime(backend: str):
+    """Return the interpreter class for a backend, or None if not installed."""
+    try:
+        if backend == "tflite_runtime":
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                # tflite-runtime's successor package
+                from ai_edge_litert.interpreter import Interpreter
+            return Interpreter
+        if backend == "onnxruntime":
+            import onnxruntime  # noqa: F401
+            return _OnnxInterpreter
+        if backend == "tensorflow":
+            import tensorflow as tf
+            return tf.lite.Interpreter
+    except ImportError:
+        return None
+    return None
+
+
+def _onnx_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".onnx"
+
+
+_runtime_cache = {}
+_runtime_lock = threading.Lock()
+
+
+def get_runtime(model_path: str = MODEL_PATH, backend: str = None):
+    """
+    Resolve the inference backend for a model.
+
+    Returns (backend_name, interpreter_class), or (None, None) if no runtime
+    is installed. The import cost of each backend is paid once per process
+    and recorded in get_engine_stats().
+    """
+    backend = backend or RUNTIME
+    candidates = RUNTIME_BACKENDS if backend == "auto" else (backend,)
+    for name in candidates:
+        if name == "onnxruntime" and backend == "auto" and not os.path.exists(_onnx_path(model_path)):
+            continue
+        with _runtime_lock:
+            if name not in _runtime_cache:
+                start = time.perf_counter()
+                _runtime_cache[name] = _import_runtime(name)
+                if _runtime_cache[name] is not None:
+                    import_ms = (time.perf_counter() - start) * 1000
+                    with _stats_lock:
+                        _ENGINE_STATS["runtime_import_ms"][name] = import_ms
+                    print(f"[AI Engine] Using {name} runtime (import {import_ms:.0f} ms)")
+        if _runtime_cache[name] is not None:
+            return name, _runtime_cache[name]
+    return None, None
+
+
+def load_tflite_model(model_path: str = MODEL_PATH, num_threads: int = NUM_THREADS, backend: str = None,
+                      model_content: bytes = None):
     """
     Load the TFLite model for on-device inference.
-    Returns the interpreter or None if model not found.
+    Returns a new interpreter or None if model not found.
+
+    The backend comes from get_runtime() (tflite-runtime, ONNX Runtime or
+    TensorFlow). The model file is read from disk only once; later calls
+    build the interpreter from the cached bytes, or from `model_content`
+    when given (a pinned TFLite model version). Prefer borrow_interpreter()
+    for inference so interpreters are reused instead of rebuilt per request.
     """
     try:
-        import tensorflow as tf
-        if os.path.exists(MODEL_PATH):
-            interpreter = tf.lite.Interpreter(model_path=MODEL_PATH)
+        runtime, interpreter_class = get_runtime(model_path, backend)
+        if interpreter_class is None:
+            print("[AI Engine] No inference runtime installed (tflite-runtime, onnxruntime or tensorflow)")
+            return None
+        if runtime == "onnxruntime":
+            model_path = _onnx_path(model_path)
+            model_content = None
+        if model_content is not None or os.path.exists(model_path):
+            start = time.perf_counter()
+            interpreter = interpreter_class(
+                model_content=model_content or _read_model_bytes(model_path),
+                num_threads=num_threads
+            )
             interpreter.allocate_tensors()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            _record_timing("load", elapsed_ms)
+            with _stats_lock:
+                _ENGINE_STATS["runtime"] = runtime
+            print(f"[AI Engine] Loaded {runtime} interpreter in {elapsed_ms:.1f} ms ({num_threads} threads)")
             return interpreter
         else:
-            print(f"[AI Engine] Model not found at {MODEL_PATH}")
+            print(f"[AI Engine] Model not found at {model_path}")
             return None
     except Exception as e:
         print(f"[AI Engine] Error loading model: {e}")
         return None
 
 
+class _InterpreterPool:
+    """
+    Bounded, thread-safe pool of warm interpreters for one model file.
+
+    TFLite interpreters are not safe to invoke concurrently, so each worker
+    thread checks one out exclusively, and returns it when done. Up to
+    `size` interpreters are created lazily; extra callers wait (up to
+    POOL_WAIT_SECONDS) for one to become idle. A failed load (e.g. a model
+    file mid-copy) makes the pool unavailable for POOL_RETRY_SECONDS and
+    wakes the waiters, who then get None; after that the next acquire
+    tries again.
+    """
+
+    def __init__(self, model_path: str, classes: list = None, size: int = POOL_SIZE,
+                 num_threads: int = NUM_THREADS, model_content: bytes = None):
+        self.model_path = model_path
+        self.model_content = model_content
+        self.classes = list(classes or DISEASE_CLASSES)
+        self.size = max(1, size)
+        self.num_threads = num_threads
+        self.load_failures = 0
+        self._closed = False
+        self._retry_at = 0.0
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._cond = threading.Condition()
+
+    @property
+    def available(self) -> bool:
+        """False once closed, and while backing off after a failed load."""
+        return not self._closed and time.time() >= self._retry_at
+
+    def acquire(self, timeout: float = None):
+        """
+        Check out an interpreter, or None if the model cannot be loaded or
+        none became idle within timeout (default POOL_WAIT_SECONDS).
+        """
+        deadline = time.time() + (POOL_WAIT_SECONDS if timeout is None else timeout)
+        with self._cond:
+            while True:
+                if not self.available:
+                    return None
+                try:
+                    return self._idle.get_nowait()
+                except queue.Empty:
+                    pass
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    print(f"[AI Engine] No interpreter free after {POOL_WAIT_SECONDS if timeout is None else timeout:g}s")
+                    return None
+                self._cond.wait(remaining)
+
+        # Load outside the lock so other callers can still take idle interpreters
+        interpreter = load_tflite_model(self.model_path, self.num_threads, model_content=self.model_content)
+        with self._cond:
+            if interpreter is None:
+                self._created -= 1
+                self.load_failures += 1
+                self._retry_at = time.time() + POOL_RETRY_SECONDS
+                self._cond.notify_all()
+            else:
+                self._retry_at = 0.0
+        if interpreter is None:
+            print(f"[AI Engine] Could not load {self.model_path}; retrying in {POOL_RETRY_SECONDS:g}s")
+        return interpreter
+
+    def release(self, interpreter):
+        """Return a checked-out interpreter to the pool."""
+        if interpreter is not None:
+            with self._cond:
+                self._idle.put(interpreter)
+                self._cond.notify()
+
+    @property
+    def in_use(self) -> int:
+        return self._created - self._idle.qsize()
+
+    def memory_estimate(self) -> int:
+        """
+        Rough resident cost in bytes: the shared model bytes plus about one
+        model's worth of weights/arena per interpreter.
+        """
+        try:
+            model_size = os.path.getsize(self.model_path)
+        except OSError:
+            return 0
+        return model_size * (1 + self._created)
+
+    def close(self):
+        """
+        Drop idle interpreters and the cached model bytes (used on eviction
+        and hot-swap). Interpreters still checked out are released normally
+        and freed once their callers finish.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+        self.model_content = None
+        _model_bytes_cache.pop(self.model_path, None)
+
+    def stats(self) -> dict:
+        return {
+            "model_path": self.model_path,
+            "available": self.available,
+            "load_failures": self.load_failures,
+            "size": self.size,
+            "created": self._created,
+            "idle": self._idle.qsize(),
+            "num_threads": self.num_threads,
+            "num_classes": len(self.classes),
+            "memory_mb": self.memory_estimate() / 1e6,
+        }
+
+
+_pool = None
+_pool_init_lock = threading.Lock()
+
+
+def get_interpreter_pool() -> _InterpreterPool:
+    """Return the process-wide interpreter pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_init_lock:
+            if _pool is None:
+                model_path = get_model_path()
+                metadata = load_model_metadata(model_path) or {}
+                _pool = _InterpreterPool(model_path, metadata.get("classes"))
+                _set_active_model(model_path, metadata)
+    return _pool
+
+
+# ============================================================
+# MODEL METADATA AND HOT-SWAP
+# ============================================================
+# converter_model.py writes a JSON sidecar next to every model
+# (crop_disease.tflite -> crop_disease.json) holding the model version,
+# class order, input size, normalization and quantization params, plus a
+# sha256 of the model bytes so a half-copied pair is never loaded.
+#
+# A watcher thread polls the model directory. When the model file or its
+# sidecar changes, the new version is loaded into a fresh pool and warmed
+# up, then swapped in; requests already holding an interpreter from the
+# old pool finish on it.
+
+METADATA_SCHEMA_VERSION = 1
+
+# Preprocessing this module implements (preprocess_image*: RGB / 255)
+SUPPORTED_NORMALIZATION = {"scale": 1 / 255.0, "offset": 0.0}
+
+_MODEL_STATE = {
+    "path": None,
+    "version": None,
+    "sha256": None,
+    "loaded_at": None,
+    "swaps": 0,
+    "last_swap": None,
+    "last_swap_error": None,
+}
+_model_signature = None
+_swap_lock = threading.Lock()
+_watcher = None
+
+
+def metadata_path_for(model_path: str) -> str:
+    """crop_disease_int8.tflite -> crop_disease_int8.json"""
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def load_model_metadata(model_path: str):
+    """Read a model's metadata sidecar; None if missing or unreadable."""
+    path = metadata_path_for(model_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[AI Engine] Error reading model metadata {path}: {e}")
+        return None
+
+
+def _file_signature(model_path: str) -> tuple:
+    """(mtime, size) of the model and its sidecar; changes on any rewrite."""
+    signature = []
+    for path in (model_path, metadata_path_for(model_path)):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _set_active_model(model_path: str, metadata: dict):
+    global _model_signature
+    _model_signature = _file_signature(model_path)
+    with _stats_lock:
+        _MODEL_STATE.update(
+            path=model_path,
+            version=metadata.get("version"),
+            sha256=metadata.get("sha256"),
+            loaded_at=time.time(),
+        )
+    normalization = metadata.get("normalization")
+    if normalization and not _normalization_supported(normalization):
+        print(f"[AI Engine] Warning: model expects normalization {normalization}, "
+              f"preprocessing uses {SUPPORTED_NORMALIZATION}")
+
+
+def _normalization_supported(normalization: dict) -> bool:
+    return all(abs(float(normalization.get(key, value)) - value) < 1e-6
+               for key, value in SUPPORTED_NORMALIZATION.items())
+
+
+def _reject_swap(model_path: str, reason: str) -> bool:
+    with _stats_lock:
+        _MODEL_STATE["last_swap_error"] = reason
+    print(f"[AI Engine] Not swapping in {model_path}: {reason}")
+    return False
+
+
+def check_for_model_update() -> bool:
+    """
+    Swap in a new model version if the model file or its sidecar changed.
+    Returns True if a new version is now serving.
+    """
+    global _pool, _model_signature
+    with _swap_lock:
+        get_interpreter_pool()
+        model_path = get_model_path()
+        signature = _file_signature(model_path)
+        if signature == _model_signature or signature[0] is None:
+            return False
+
+        with open(model_path, "rb") as f:
+            content = f.read()
+        metadata = load_model_metadata(model_path) or {}
+        digest = hashlib.sha256(content).hexdigest()
+        if metadata.get("sha256") and metadata["sha256"] != digest:
+            # Model and sidecar are mid-copy; try again on the next poll
+            print(f"[AI Engine] {model_path} does not match its metadata yet, waiting")
+            return False
+
+        # Do not retry the same broken files on every poll
+        _model_signature = signature
+        normalization = metadata.get("normalization")
+        if normalization and not _normalization_supported(normalization):
+            return _reject_swap(model_path, f"unsupported normalization {normalization}")
+
+        new_pool = _InterpreterPool(model_path, metadata.get("classes"), model_content=content)
+        interpreter = new_pool.acquire()
+        if interpreter is None:
+            return _reject_swap(model_path, "model failed to load")
+        num_outputs = int(_output_roles(interpreter)[0]["shape"][-1])
+        new_pool.release(interpreter)
+        if num_outputs != len(new_pool.classes):
+            return _reject_swap(model_path, f"{num_outputs} outputs for {len(new_pool.classes)} classes")
+
+        register_fusion_classes(new_pool.classes)
+        with _pool_init_lock:
+            old_pool, _pool = _pool, new_pool
+        old_pool.close()
+        _set_active_model(model_path, metadata)
+        with _stats_lock:
+            _MODEL_STATE["swaps"] += 1
+            _MODEL_STATE["last_swap"] = time.time()
+            _MODEL_STATE["last_swap_error"] = None
+        print(f"[AI Engine] Hot-swapped model {model_path} (version {metadata.get('version', 'unversioned')})")
+        return True
+
+
+def _check_registry_update():
+    """Drop crop models when registry.json changes so they reload lazily."""
+    global _registry, _registry_signature
+    try:
+        signature = os.stat(MODEL_REGISTRY_PATH).st_mtime_ns
+    except OSError:
+        signature = None
+    if signature == _registry_signature:
+        return
+    with _registry_lock:
+        if _registry_signature is not None or _registry is not None:
+            for pool in _crop_pools.values():
+                pool.close()
+            _crop_pools.clear()
+            _registry = None
+            print("[AI Engine] Model registry changed, crop models will reload")
+        _registry_signature = signature
+
+
+def _watch_models(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            check_for_model_update()
+            _check_registry_update()
+        except Exception as e:
+            print(f"[AI Engine] Model watcher error: {e}")
+
+
+def start_model_watcher(interval: float = None) -> bool:
+    """Start the background model-directory watcher (once per process)."""
+    global _watcher
+    interval = MODEL_WATCH_INTERVAL if interval is None else interval
+    if interval <= 0:
+        return False
+    with _swap_lock:
+        if _watcher is None:
+            _check_registry_update()
+            _watcher = threading.Thread(target=_watch_models, args=(interval,),
+                                        name="model-watcher", daemon=True)
+            _watcher.start()
+    return True
+
+
+# ============================================================
+# CROP-SPECIFIC MODEL REGISTRY
+# ============================================================
+# registry.json maps crops to specialised models; each entry needs a model
+# file (relative to MODEL_DIR) and its class order, e.g.
+#
+#   {
+#     "cotton":    {"model": "cotton.tflite", "classes": [...], "aliases": ["kapas"]},
+#     "groundnut": {"model": "groundnut.tflite", "classes": [...], "aliases": ["mugfali"]},
+#     "cumin":     {"model": "cumin.tflite", "classes": [...], "aliases": ["jeera", "jeeru"]}
+#   }
+#
+# Crop models load on first use and are evicted least-recently-used once
+# their estimated memory exceeds MODEL_MEMORY_CAP_MB. Crops without an
+# entry (or whose model fails to load) use the generic model.
+
+_registry = None
+_registry_signature = None
+_crop_pools = OrderedDict()
+_registry_lock = threading.Lock()
+
+
+def normalize_crop_name(crop: str) -> str:
+    """'Groundnut (HPS)' -> 'groundnut', 'Cumin (Jeera)' -> 'cumin'."""
+    return re.sub(r"\(.*?\)", "", crop or "").strip().lower()
+
+
+def load_model_registry(path: str = None) -> dict:
+    """Read registry.json into {crop name or alias: spec}; empty if missing."""
+    path = path or MODEL_REGISTRY_PATH
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except Exception as e:
+        print(f"[AI Engine] Error reading model registry: {e}")
+        return {}
+
+    registry = {}
+    for crop, spec in entries.items():
+        spec = dict(spec, crop=normalize_crop_name(crop))
+        spec["path"] = os.path.join(os.path.dirname(path), spec["model"])
+        for name in [crop] + spec.get("aliases", []):
+            registry[normalize_crop_name(name)] = spec
+    return registry
+
+
+def _evict_crop_models(keep: str):
+    """Close least-recently-used idle crop pools until under the memory cap."""
+    cap = MODEL_MEMORY_CAP_MB * 1e6
+    total = sum(pool.memory_estimate() for pool in _crop_pools.values())
+    for key in list(_crop_pools):
+        if total <= cap:
+            break
+        pool = _crop_pools[key]
+        if key == keep or pool.in_use:
+            continue
+        total -= pool.memory_estimate()
+        pool.close()
+        del _crop_pools[key]
+        print(f"[AI Engine] Evicted crop model '{key}' (memory cap {MODEL_MEMORY_CAP_MB:.0f} MB)")
+
+
+def get_crop_pool(crop: str = None) -> _InterpreterPool:
+    """
+    Interpreter pool for a crop's specialised model, loading it lazily.
+    Falls back to the generic pool when the crop has no registered model.
+    """
+    global _registry
+    key = normalize_crop_name(crop)
+    if not key:
+        return get_interpreter_pool()
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = load_model_registry()
+        spec = _registry.get(key)
+        if spec is None:
+            return get_interpreter_pool()
+
+        key = spec["crop"]
+        pool = _crop_pools.get(key)
+        if pool is not None:
+            _crop_pools.move_to_end(key)
+        else:
+            pool = _InterpreterPool(spec["path"], spec.get("classes"))
+            _crop_pools[key] = pool
+            register_fusion_classes(pool.classes)
+        _evict_crop_models(keep=key)
+    return pool
+
+
+@contextmanager
+def borrow_model(crop: str = None):
+    """
+    Context manager yielding (interpreter, classes) for a crop's model, or
+    the generic model if the crop has none or it cannot be loaded. The
+    interpreter is None when no model is available at all.
+    """
+    pool = get_crop_pool(crop)
+    interpreter = pool.acquire()
+    if interpreter is None and pool is not get_interpreter_pool():
+        pool = get_interpreter_pool()
+        interpreter = pool.acquire()
+    try:
+        yield interpreter, pool.classes
+    finally:
+        pool.release(interpreter)
+
+
+@contextmanager
+def borrow_interpreter():
+    """
+    Context manager yielding a pooled interpreter for the generic model (or
+    None if the model is unavailable). The interpreter is exclusive to the
+    caller until exit.
+    """
+    with borrow_model() as (interpreter, _):
+        yield interpreter
+
+
+def warm_up_model() -> bool:
+    """
+    Load the model once at process startup so the first diagnosis does not
+    pay the TensorFlow import and allocate_tensors() cost.
+    Also starts the model watcher so new model versions are hot-swapped.
+    Safe to call repeatedly; returns True if a real model is loaded.
+    """
+    start_model_watcher()
+    with borrow_interpreter() as interpreter:
+        return interpreter is not None
+
+
+def get_engine_stats() -> dict:
+    """Return model load / inference timings and interpreter pool state."""
+    with _stats_lock:
+        stats = dict(_ENGINE_STATS)
+        stats["runtime_import_ms"] = dict(_ENGINE_STATS["runtime_import_ms"])
+    for kind in ("load", "inference"):
+        count = stats[f"{kind}_count"]
+        stats[f"{kind}_ms_avg"] = stats[f"{kind}_ms_total"] / count if count else 0.0
+    stats["pool"] = get_interpreter_pool().stats()
+    with _stats_lock:
+        stats["model"] = dict(_MODEL_STATE)
+    with _registry_lock:
+        stats["crop_models"] = {key: pool.stats() for key, pool in _crop_pools.items()}
+    stats["crop_models_memory_mb"] = sum(p["memory_mb"] for p in stats["crop_models"].values())
+    return stats
+
+
 def preprocess_image(image: Image.Image, target_size=(224, 224)):
     """
     Preprocess image for MobileNetV2 inference.
@@ -100,178 +808,924 @@ def preprocess_image(image: Image.Image, target_size=(224, 224)):
     return img_array
 
 
-def predict_disease(image: Image.Image) -> dict:
+def preprocess_images_batch(images: list, target_size=(224, 224)) -> np.ndarray:
     """
-    Run crop disease prediction on the given image.
-    
+    Batched counterpart of preprocess_image().
+    - Resize every image to 224x224
+    - Write the uint8 pixels straight into one preallocated float32 batch
+    - Normalize the whole batch to [0, 1] in a single in-place multiply
+
+    Returns an array of shape (N, 224, 224, 3).
+    """
+    width, height = target_size
+    batch = np.empty((len(images), height, width, 3), dtype=np.float32)
+    for i, image in enumerate(images):
+        batch[i] = np.asarray(image.convert("RGB").resize(target_size))
+    batch *= np.float32(1.0 / 255.0)
+    return batch
+
+
+def _draft_view(image: Image.Image, size) -> Image.Image:
+    """
+    The photo set up for a reduced-scale JPEG decode (draft mode), on a
+    second handle opened from the same file or bytes. draft() changes the
+    image it is called on, and callers go on to use their full-resolution
+    photo (localization, the vision upload). Images that are not unloaded
+    JPEGs are returned unchanged.
+    """
+    fp = getattr(image, "fp", None)
+    if image.format != "JPEG" or fp is None:
+        return image
+    try:
+        if image.filename:
+            source = image.filename
+        else:
+            position = fp.tell()
+            fp.seek(0)
+            source = io.BytesIO(fp.read())
+            fp.seek(position)
+        view = Image.open(source)
+        view.draft("RGB", size)
+        return view
+    except Exception:
+        return image
+
+
+def _decode_resized(image: Image.Image, target_size) -> np.ndarray:
+    """
+    Decode an image straight to a (H, W, 3) uint8 array at the model size.
+    JPEGs are decoded at reduced scale (draft mode) when the photo is much
+    larger than target_size; the caller's image is not modified.
+    """
+    image = _draft_view(image, target_size)
+    image = image.convert("RGB")
+    if image.size != target_size:
+        image = image.resize(target_size)
+    return np.asarray(image)
+
+
+def preprocess_image_fast(image: Image.Image, out: np.ndarray = None, target_size=(224, 224)) -> np.ndarray:
+    """
+    Fast preprocessing path for large camera photos.
+    - Ask the JPEG decoder for a reduced-scale decode (draft mode, on a
+      separate handle so `image` itself is left at full resolution), so a
+      12 MP photo is decoded at 1/2, 1/4 or 1/8 size instead of in full
+    - Resize the (already small) image to the model size
+    - Normalize uint8 -> float32 [0, 1] in one pass, written into `out`
+
     Args:
-        image: PIL Image object
-        
+        image: PIL Image, ideally freshly opened (draft only applies before load)
+        out: optional (H, W, 3) float32 buffer to fill, e.g. a view of the
+             interpreter's input tensor; its shape overrides target_size
+
     Returns:
-        dict: {
-            "disease": str,
-            "confidence": float (0-100),
-            "all_predictions": list of (class, confidence) tuples
-        }
+        `out` if given, else a new (1, H, W, 3) array like preprocess_image()
+    """
+    if out is not None:
+        target_size = (out.shape[1], out.shape[0])
+    pixels = _decode_resized(image, target_size)
+
+    if out is None:
+        batch = np.empty((1, target_size[1], target_size[0], 3), dtype=np.float32)
+        np.multiply(pixels, np.float32(1.0 / 255.0), out=batch[0])
+        return batch
+    np.multiply(pixels, np.float32(1.0 / 255.0), out=out)
+    return out
+
+
+def _quantize(values: np.ndarray, detail: dict, out: np.ndarray = None) -> np.ndarray:
+    """Map [0, 1] float inputs onto an integer input tensor's quantized scale."""
+    scale, zero_point = detail['quantization']
+    info = np.iinfo(detail['dtype'])
+    q = np.rint(values / scale + zero_point)
+    np.clip(q, info.min, info.max, out=q)
+    if out is None:
+        return q.astype(detail['dtype'])
+    out[...] = q
+    return out
+
+
+def _dequantize(values: np.ndarray, detail: dict) -> np.ndarray:
+    """Convert integer output scores (full-int8 models) back to float."""
+    scale, zero_point = detail['quantization']
+    return (values.astype(np.float32) - zero_point) * np.float32(scale)
+
+
+def _mock_prediction() -> dict:
+    """Demo prediction returned when no model is available."""
+    return {
+        "disease": "Heat Stress",
+        "confidence": 94.2,
+        "all_predictions": [
+            ("Heat Stress", 94.2),
+            ("Nutrient Deficiency", 3.1),
+            ("Healthy", 2.7)
+        ],
+        "is_mock": True
+    }
+
+
+def _prepare_input(interpreter, batch_size: int) -> int:
+    """
+    Resize the interpreter's input tensor when the batch size changes.
+    Returns the input tensor index.
     """
-    interpreter = load_tflite_model()
-    
-    if interpreter is None:
-        # Fallback: Return mock prediction for demo
-        return {
-            "disease": "Heat Stress",
-            "confidence": 94.2,
-            "all_predictions": [
-                ("Heat Stress", 94.2),
-                ("Nutrient Deficiency", 3.1),
-                ("Healthy", 2.7)
-            ],
-            "is_mock": True
-        }
-    
-    # Preprocess image
-    input_data = preprocess_image(image)
-    
-    # Get input/output tensor details
     input_details = interpreter.get_input_details()
+    if int(input_details[0]['shape'][0]) != batch_size:
+        shape = list(input_details[0]['shape'])
+        shape[0] = batch_size
+        interpreter.resize_tensor_input(input_details[0]['index'], shape)
+        interpreter.allocate_tensors()
+    return input_details[0]['index']
+
+
+def _output_roles(interpreter) -> tuple:
+    """
+    (scores detail, embedding detail or None). Models exported with
+    converter_model.py --embedding have a second output carrying the
+    penultimate-layer features; the classifier head is the narrower one.
+    """
     output_details = interpreter.get_output_details()
-    
-    # Run inference
-    interpreter.set_tensor(input_details[0]['index'], input_data)
+    if len(output_details) == 1:
+        return output_details[0], None
+    ordered = sorted(output_details, key=lambda detail: int(detail['shape'][-1]))
+    return ordered[0], ordered[-1]
+
+
+def _read_output(interpreter, detail: dict) -> np.ndarray:
+    values = interpreter.get_tensor(detail['index'])
+    if detail['dtype'] != np.float32:
+        values = _dequantize(values, detail)
+    return values
+
+
+def _invoke(interpreter) -> np.ndarray:
+    """Invoke the interpreter and return the (N, num_classes) output scores."""
+    scores_detail, _ = _output_roles(interpreter)
+    start = time.perf_counter()
     interpreter.invoke()
-    
-    # Get predictions
-    predictions = interpreter.get_tensor(output_details[0]['index'])[0]
-    
-    # Get top predictions
-    top_indices = np.argsort(predictions)[::-1][:3]
-    all_predictions = [(DISEASE_CLASSES[i], float(predictions[i] * 100)) for i in top_indices]
-    
-    top_disease = DISEASE_CLASSES[top_indices[0]]
-    top_confidence = float(predictions[top_indices[0]] * 100)
-    
+    predictions = interpreter.get_tensor(scores_detail['index'])
+    _record_timing("inference", (time.perf_counter() - start) * 1000)
+    if scores_detail['dtype'] != np.float32:
+        predictions = _dequantize(predictions, scores_detail)
+    return predictions
+
+
+def _run_inference(interpreter, input_data: np.ndarray) -> np.ndarray:
+    """Run one invoke for a preprocessed (N, H, W, 3) batch."""
+    input_index = _prepare_input(interpreter, input_data.shape[0])
+    input_detail = interpreter.get_input_details()[0]
+    if input_detail['dtype'] != np.float32:
+        input_data = _quantize(input_data, input_detail)
+    interpreter.set_tensor(input_index, input_data)
+    return _invoke(interpreter)
+
+
+def _run_inference_fast(interpreter, images: list) -> np.ndarray:
+    """
+    Run one invoke for raw PIL images, decoding and normalizing each one
+    directly into the interpreter's input tensor (no intermediate batch).
+    """
+    input_index = _prepare_input(interpreter, len(images))
+    input_detail = interpreter.get_input_details()[0]
+    quantized = input_detail['dtype'] != np.float32
+    # interpreter.tensor() returns a callable; only hold the view briefly,
+    # since invoke() refuses to run while numpy views of its buffers exist.
+    input_tensor = interpreter.tensor(input_index)
+    for i, image in enumerate(images):
+        if quantized:
+            height, width = input_detail['shape'][1:3]
+            pixels = _decode_resized(image, (int(width), int(height)))
+            _quantize(pixels * np.float32(1.0 / 255.0), input_detail, out=input_tensor()[i])
+        else:
+            preprocess_image_fast(image, out=input_tensor()[i])
+    return _invoke(interpreter)
+
+
+def _top_k(predictions: np.ndarray, k: int = 3):
+    """
+    Vectorized top-k over every row of a (N, num_classes) score matrix.
+    Uses argpartition to find the k best per row, then sorts only those k.
+
+    Returns (indices, scores), both of shape (N, k), best first.
+    """
+    k = min(k, predictions.shape[1])
+    top = np.argpartition(predictions, -k, axis=1)[:, -k:]
+    top_scores = np.take_along_axis(predictions, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return top, np.take_along_axis(top_scores, order, axis=1)
+
+
+def _format_prediction(indices: np.ndarray, scores: np.ndarray, classes: list = None) -> dict:
+    """Build the predict_disease() result dict from one row of top-k output."""
+    classes = classes or DISEASE_CLASSES
+    all_predictions = [(classes[i], float(p * 100)) for i, p in zip(indices, scores)]
     return {
-        "disease": top_disease,
-        "confidence": top_confidence,
+        "disease": all_predictions[0][0],
+        "confidence": all_predictions[0][1],
         "all_predictions": all_predictions,
         "is_mock": False
     }
 
 
-def get_fusion_advice(diagnosis: dict, weather_data: dict) -> dict:
+def predict_disease(image: Image.Image, fast: bool = None, crop: str = None) -> dict:
     """
-    Fusion Logic: Cross-reference AI diagnosis with weather conditions
-    to provide enhanced, context-aware treatment advice.
-    
-    This is the "secret sauce" that differentiates our solution!
+    Run crop disease prediction on the given image.
     
     Args:
-        diagnosis: Output from predict_disease()
-        weather_data: {temp, humidity, description}
+        image: PIL Image object
+        fast: use preprocess_image_fast() (defaults to FAST_PREPROCESS)
+        crop: farmer's crop; uses its specialised model when registered
         
     Returns:
         dict: {
-            "enhanced_confidence": float,
-            "fusion_factor": str,
-            "treatment_advice": list of str,
-            "urgency": str (High/Medium/Low)
+            "disease": str,
+            "confidence": float (0-100),
+            "all_predictions": list of (class, confidence) tuples,
+            "inference_ms": float (preprocess + invoke time, real model only)
         }
     """
-    disease = diagnosis.get("disease", "Unknown")
-    confidence = diagnosis.get("confidence", 0)
-    temp = weather_data.get("temp", 30)
-    humidity = weather_data.get("humidity", 60)
-    
-    # Default values
-    enhanced_confidence = confidence
-    fusion_factor = "Standard Analysis"
-    treatment_advice = []
-    urgency = "Medium"
-    
-    # ============================================================
-    # FUSION RULES: Weather + Disease Cross-Reference
-    # ============================================================
-    
-    if disease == "Heat Stress":
-        if temp > 35:
-            enhanced_confidence = min(confidence + 10, 99.9)
-            fusion_factor = f"High temperature ({temp}°C) confirms heat stress diagnosis"
-            treatment_advice = [
-                "Apply organic mulch to retain soil moisture",
-                "Increase irrigation frequency to twice daily during peak hours",
-                "Consider shade nets for vulnerable crops"
-            ]
-            urgency = "High"
+    with borrow_model(crop) as (interpreter, classes):
+        if interpreter is None:
+            # Fallback: Return mock prediction for demo
+            return _mock_prediction()
+
+        # Preprocess image and run inference
+        if fast is None:
+            fast = FAST_PREPROCESS
+        start = time.perf_counter()
+        if fast:
+            predictions = _run_inference_fast(interpreter, [image])
         else:
-            fusion_factor = f"Moderate temperature ({temp}°C) - may be early stage"
-            treatment_advice = [
-                "Monitor closely for next 48 hours",
-                "Ensure adequate water availability"
-            ]
-            urgency = "Medium"
-            
-    elif disease in ["Powdery Mildew", "Fungal Infection"]:
-        if humidity > 70:
-            enhanced_confidence = min(confidence + 15, 99.9)
-            fusion_factor = f"High humidity ({humidity}%) accelerates fungal spread"
-            treatment_advice = [
-                "Apply fungicide immediately (Neem-based recommended)",
-                "Improve air circulation around plants",
-                "Avoid overhead watering"
-            ]
-            urgency = "High"
+            predictions = _run_inference(interpreter, preprocess_image(image))
+        inference_ms = (time.perf_counter() - start) * 1000
+
+    # Get top predictions
+    top_indices, top_scores = _top_k(predictions[:1])
+    result = _format_prediction(top_indices[0], top_scores[0], classes)
+    result["inference_ms"] = inference_ms
+    return result
+
+
+def predict_proba_batch(images: list, fast: bool = None, crop: str = None):
+    """
+    Class probabilities for many images, run in batched invokes of up to
+    MAX_BATCH_SIZE images.
+
+    Returns (probs, classes): an (N, num_classes) array and the model's
+    class list, or (None, None) if no model is available.
+    """
+    with borrow_model(crop) as (interpreter, classes):
+        if interpreter is None:
+            return None, None
+
+        if fast is None:
+            fast = FAST_PREPROCESS
+        chunks = []
+        for offset in range(0, len(images), MAX_BATCH_SIZE):
+            chunk = images[offset:offset + MAX_BATCH_SIZE]
+            if fast:
+                chunks.append(_run_inference_fast(interpreter, chunk))
+            else:
+                chunks.append(_run_inference(interpreter, preprocess_images_batch(chunk)))
+    return np.concatenate(chunks, axis=0), classes
+
+
+def predict_disease_batch(images: list, top_k: int = 3, fast: bool = None, crop: str = None) -> list:
+    """
+    Run crop disease prediction on many images with batched invokes.
+
+    Images are stacked into one tensor and run in chunks of MAX_BATCH_SIZE,
+    so a large upload costs a handful of invokes instead of one per leaf.
+
+    Args:
+        images: list of PIL Image objects
+        top_k: number of ranked predictions per image
+        fast: decode/normalize straight into the input tensor (defaults to FAST_PREPROCESS)
+        crop: farmer's crop; uses its specialised model when registered
+
+    Returns:
+        list of dicts in the same format as predict_disease(), one per image
+    """
+    if not images:
+        return []
+
+    start = time.perf_counter()
+    predictions, classes = predict_proba_batch(images, fast, crop)
+    if predictions is None:
+        return [_mock_prediction() for _ in images]
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    top_indices, top_scores = _top_k(predictions, top_k)
+    results = [_format_prediction(idx, scores, classes) for idx, scores in zip(top_indices, top_scores)]
+    for result in results:
+        result["inference_ms"] = batch_ms / len(images)
+    return results
+
+
+def get_embedding_space() -> str:
+    """
+    Identifier of the active generic model's embedding space. Embeddings
+    from different model versions are not comparable, so indexes of past
+    cases are kept per space.
+    """
+    get_interpreter_pool()
+    with _stats_lock:
+        sha256, version = _MODEL_STATE["sha256"], _MODEL_STATE["version"]
+    if sha256:
+        return sha256[:12]
+    return f"v{version}" if version is not None else "default"
+
+
+def extract_embeddings(images: list, fast: bool = None):
+    """
+    Penultimate-layer embeddings of the generic model, L2-normalized so a
+    dot product is cosine similarity.
+
+    Returns an (N, dim) float32 array, or None if no model is loaded or the
+    model was exported without an embedding output.
+    """
+    if fast is None:
+        fast = FAST_PREPROCESS
+    with borrow_model() as (interpreter, _):
+        if interpreter is None:
+            return None
+        _, embedding_detail = _output_roles(interpreter)
+        if embedding_detail is None:
+            return None
+        chunks = []
+        for start in range(0, len(images), MAX_BATCH_SIZE):
+            chunk = images[start:start + MAX_BATCH_SIZE]
+            if fast:
+                _run_inference_fast(interpreter, chunk)
+            else:
+                _run_inference(interpreter, preprocess_images_batch(chunk))
+            chunks.append(_read_output(interpreter, embedding_detail).reshape(len(chunk), -1))
+
+    embeddings = np.concatenate(chunks, axis=0).astype(np.float32, copy=False)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def laplacian_variance(pixels: np.ndarray) -> float:
+    """
+    Sharpness score: variance of the 4-neighbour Laplacian of the grayscale
+    image. Blurry or motion-smeared frames score low.
+
+    Args:
+        pixels: (H, W) grayscale or (H, W, 3) RGB array
+    """
+    gray = pixels.astype(np.float32)
+    if gray.ndim == 3:
+        gray = gray @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    lap = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+           - 4.0 * gray[1:-1, 1:-1])
+    return float(lap.var())
+
+
+# ============================================================
+# LESION LOCALIZATION (sliding window)
+# ============================================================
+
+# Longest side the photo is decoded to before tiling (JPEG draft + thumbnail)
+LOCALIZE_MAX_SIDE = int(os.getenv("LOCALIZE_MAX_SIDE", "1024"))
+# Hard cap on tiles per photo (they all go through one invoke)
+LOCALIZE_MAX_TILES = int(os.getenv("LOCALIZE_MAX_TILES", "25"))
+# Target wall-clock budget for a localization call
+LOCALIZE_BUDGET_MS = float(os.getenv("LOCALIZE_BUDGET_MS", "800"))
+
+# Running estimate of per-tile inference cost, used to size the tile grid
+_tile_ms_estimate = None
+
+
+def _tile_grid(width: int, height: int, tile: int, max_tiles: int):
+    """
+    Pick an nx x ny grid of square tiles covering the image with at most
+    max_tiles tiles; the stride adapts so tiles span the full image.
+    Returns (xs, ys) tile origins.
+    """
+    nx = max(1, int(np.ceil(width / tile)))
+    ny = max(1, int(np.ceil(height / tile)))
+    # Add overlap (one extra row/column) only while it fits the tile cap
+    while (nx + 1) * (ny + 1) <= max_tiles and (nx < 2 * width / tile or ny < 2 * height / tile):
+        nx, ny = nx + 1, ny + 1
+    while nx * ny > max_tiles:
+        if nx >= ny and nx > 1:
+            nx -= 1
+        elif ny > 1:
+            ny -= 1
         else:
-            treatment_advice = [
-                "Apply preventive fungicide spray",
-                "Monitor humidity levels"
-            ]
-            urgency = "Medium"
-            
-    elif disease == "Bacterial Blight":
-        treatment_advice = [
+            break
+    xs = np.linspace(0, max(width - tile, 0), nx).round().astype(int)
+    ys = np.linspace(0, max(height - tile, 0), ny).round().astype(int)
+    return xs, ys
+
+
+def _non_max_suppression(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float, limit: int) -> list:
+    """Greedy NMS over (N, 4) [x0, y0, x1, y1] boxes; returns kept indices."""
+    order = np.argsort(-scores)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size and len(keep) < limit:
+        i = order[0]
+        keep.append(int(i))
+        x0 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        y0 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        x1 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        y1 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[1:][iou < iou_threshold]
+    return keep
+
+
+def localize_disease(image: Image.Image, tile_fraction: float = 0.4, max_tiles: int = None,
+                     budget_ms: float = None, top_boxes: int = 3, min_score: float = 0.5,
+                     crop: str = None) -> dict:
+    """
+    Coarse lesion localization by running overlapping tiles of the leaf
+    through the classifier as one batch.
+
+    Each tile's "disease score" is the probability mass on non-healthy
+    classes. Tile count is capped (max_tiles, and whatever fits in
+    budget_ms given the measured per-tile cost) and the stride adapts to
+    the photo size, so full-resolution photos stay within budget on CPU.
+
+    Args:
+        image: PIL Image (freshly opened JPEGs decode at reduced scale)
+        tile_fraction: tile side as a fraction of the shorter image side
+        max_tiles: cap on tiles (defaults to LOCALIZE_MAX_TILES)
+        budget_ms: latency budget (defaults to LOCALIZE_BUDGET_MS)
+        top_boxes: max boxes to return after non-max suppression
+        min_score: minimum disease score for a box
+        crop: farmer's crop; uses its specialised model when registered
+
+    Returns:
+        dict: {
+            "heatmap": (ny, nx) list of disease scores per tile,
+            "boxes": list of {"box": [x0, y0, x1, y1] in original pixels,
+                              "score": float, "disease": str},
+            "tiles": int,
+            "image_size": [width, height] of the original image,
+            "elapsed_ms": float,
+            "is_mock": bool
+        }
+        Box coordinates are relative to the original image size.
+    """
+    global _tile_ms_estimate
+    start = time.perf_counter()
+    max_tiles = max_tiles or LOCALIZE_MAX_TILES
+    budget_ms = budget_ms or LOCALIZE_BUDGET_MS
+    if _tile_ms_estimate:
+        max_tiles = max(1, min(max_tiles, int(budget_ms / _tile_ms_estimate)))
+
+    original_size = image.size
+    image = _draft_view(image, (LOCALIZE_MAX_SIDE, LOCALIZE_MAX_SIDE))
+    image = image.convert("RGB")
+    image.thumbnail((LOCALIZE_MAX_SIDE, LOCALIZE_MAX_SIDE))
+    width, height = image.size
+    scale_x, scale_y = original_size[0] / width, original_size[1] / height
+
+    tile = max(32, int(min(width, height) * tile_fraction))
+    xs, ys = _tile_grid(width, height, tile, max_tiles)
+    origins = [(x, y) for y in ys for x in xs]
+    tiles = [image.crop((x, y, x + tile, y + tile)) for x, y in origins]
+
+    with borrow_model(crop) as (interpreter, classes):
+        if interpreter is None:
+            return {"heatmap": [], "boxes": [], "tiles": 0, "image_size": list(original_size),
+                    "elapsed_ms": 0.0, "is_mock": True}
+        infer_start = time.perf_counter()
+        predictions = _run_inference(interpreter, preprocess_images_batch(tiles))
+        tile_ms = (time.perf_counter() - infer_start) * 1000 / len(tiles)
+
+    _tile_ms_estimate = tile_ms if _tile_ms_estimate is None else 0.8 * _tile_ms_estimate + 0.2 * tile_ms
+
+    predictions = predictions[:, :len(classes)]
+    healthy = np.array([c.lower().endswith("healthy") for c in classes])
+    scores = predictions[:, ~healthy].sum(axis=1)
+    diseased = np.where(healthy, -1.0, predictions)
+    labels = np.argmax(diseased, axis=1)
+
+    boxes = np.array([[x, y, x + tile, y + tile] for x, y in origins], dtype=np.float32)
+    keep = _non_max_suppression(boxes, scores, iou_threshold=0.3, limit=top_boxes)
+    results = []
+    for i in keep:
+        if scores[i] < min_score:
+            continue
+        x0, y0, x1, y1 = boxes[i]
+        results.append({
+            "box": [int(x0 * scale_x), int(y0 * scale_y),
+                    int(min(x1, width) * scale_x), int(min(y1, height) * scale_y)],
+            "score": float(scores[i]),
+            "disease": classes[labels[i]],
+        })
+
+    return {
+        "heatmap": scores.reshape(len(ys), len(xs)).round(4).tolist(),
+        "boxes": results,
+        "tiles": len(tiles),
+        "image_size": list(original_size),
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+        "is_mock": False
+    }
+
+
+# ============================================================
+# FUSION RULES: Weather + Disease Cross-Reference
+# ============================================================
+# Each disease class maps to a weather risk profile. A profile describes
+# the temperature window and humidity direction that favour the problem,
+# how much a favourable forecast raises urgency, and the treatment advice.
+#
+#   t_lo/t_hi:  temperature window (°C) where spread is fastest
+#   t_tol:      °C outside the window at which the temperature fit drops to 0
+#   rh:         humidity threshold (%); rh_dir +1 = wetter is worse,
+#               -1 = drier is worse, 0 = humidity does not matter
+#   base:       risk floor once the problem is present, regardless of weather
+#   boost:      confidence boost (points) when the weather confirms it
+#   urgency:    (favourable, unfavourable) urgency level, 0 Low, 1 Medium, 2 High
+#   trigger:    optional ("temp" | "humidity", value): the weather is
+#               favourable when the reading is above value (the original
+#               single-reading rules); otherwise when the fit is >= 0.5
+#
+# Risk (confidence x weather fit) ranks forecast hours; the urgency shown
+# to the farmer comes from the tiers, as in the original if-chain.
+
+URGENCY_LEVELS = ("Low", "Medium", "High")
+
+_TRIGGER_VARIABLES = {None: 0, "temp": 1, "humidity": 2}
+
+FUSION_PROFILES = {
+    "fungal_cool_wet": {
+        "t_lo": 10, "t_hi": 24, "t_tol": 8, "rh": 80, "rh_dir": 1, "base": 0.35, "boost": 15, "urgency": (2, 1),
+        "favourable": "Cool ({temp}°C), humid ({humidity}%) weather favours rapid fungal spread",
+        "unfavourable": "Current weather ({temp}°C, {humidity}%) slows fungal spread",
+        "treatment": [
+            "Apply a protective fungicide (Mancozeb or copper oxychloride) before the next humid spell",
+            "Remove and destroy infected leaves",
+            "Avoid overhead watering and improve air circulation"
+        ],
+    },
+    "fungal_warm_wet": {
+        "t_lo": 20, "t_hi": 30, "t_tol": 8, "rh": 75, "rh_dir": 1, "base": 0.35, "boost": 15, "urgency": (2, 1),
+        "favourable": "Warm ({temp}°C), humid ({humidity}%) weather accelerates fungal leaf spots",
+        "unfavourable": "Current weather ({temp}°C, {humidity}%) is less favourable for fungal spread",
+        "treatment": [
+            "Apply fungicide immediately (Neem-based or Mancozeb)",
+            "Remove lower infected leaves and keep foliage dry",
+            "Rotate crops next season to break the disease cycle"
+        ],
+    },
+    "powdery_mildew": {
+        "t_lo": 18, "t_hi": 30, "t_tol": 8, "rh": 60, "rh_dir": 1, "base": 0.3, "boost": 15, "urgency": (2, 1),
+        "favourable": "Moderate humidity ({humidity}%) at {temp}°C favours powdery mildew",
+        "unfavourable": "Current weather ({temp}°C, {humidity}%) limits powdery mildew",
+        "treatment": [
+            "Spray wettable sulphur or Neem oil",
+            "Improve air circulation around plants",
+            "Avoid excess nitrogen fertilizer"
+        ],
+    },
+    "bacterial": {
+        "t_lo": 24, "t_hi": 32, "t_tol": 8, "rh": 80, "rh_dir": 1, "base": 0.45, "boost": 10, "urgency": (2, 2),
+        "favourable": "Warm ({temp}°C), wet ({humidity}%) weather spreads bacterial infection",
+        "unfavourable": "Current weather ({temp}°C, {humidity}%) slows bacterial spread",
+        "treatment": [
             "Remove and destroy infected plant parts",
             "Apply copper-based bactericide",
             "Avoid working with plants when wet"
-        ]
-        urgency = "High"
-        
-    elif disease == "Aphids Infestation":
-        treatment_advice = [
+        ],
+    },
+    "viral": {
+        "t_lo": 25, "t_hi": 35, "t_tol": 10, "rh": 0, "rh_dir": 0, "base": 0.6, "boost": 5, "urgency": (2, 2),
+        "favourable": "Warm weather ({temp}°C) increases insect vectors spreading the virus",
+        "unfavourable": "Cooler weather ({temp}°C) reduces vector activity, but infected plants cannot recover",
+        "treatment": [
+            "Uproot and destroy infected plants to stop spread",
+            "Control whitefly/aphid vectors (yellow sticky traps, Neem oil)",
+            "Use virus-resistant varieties next season"
+        ],
+    },
+    "mites": {
+        "t_lo": 27, "t_hi": 38, "t_tol": 8, "rh": 50, "rh_dir": -1, "base": 0.35, "boost": 10, "urgency": (2, 1),
+        "favourable": "Hot ({temp}°C), dry ({humidity}%) weather favours spider mite outbreaks",
+        "unfavourable": "Current humidity ({humidity}%) suppresses mite populations",
+        "treatment": [
+            "Spray water on leaf undersides to dislodge mites",
+            "Apply Neem oil or a recommended miticide",
+            "Remove heavily infested leaves"
+        ],
+    },
+    # Profiles below serve the non-PlantVillage labels and keep the
+    # thresholds, text and urgency of the original rules
+    "heat_stress": {
+        "t_lo": 35, "t_hi": 50, "t_tol": 5, "rh": 0, "rh_dir": 0, "base": 0.3, "boost": 10, "urgency": (2, 1),
+        "trigger": ("temp", 35),
+        "favourable": "High temperature ({temp}°C) confirms heat stress diagnosis",
+        "unfavourable": "Moderate temperature ({temp}°C) - may be early stage",
+        "treatment": [
+            "Apply organic mulch to retain soil moisture",
+            "Increase irrigation frequency to twice daily during peak hours",
+            "Consider shade nets for vulnerable crops"
+        ],
+        "treatment_unfavourable": [
+            "Monitor closely for next 48 hours",
+            "Ensure adequate water availability"
+        ],
+    },
+    "fungal_humid": {
+        "t_lo": 18, "t_hi": 30, "t_tol": 8, "rh": 70, "rh_dir": 1, "base": 0.35, "boost": 15, "urgency": (2, 1),
+        "trigger": ("humidity", 70),
+        "favourable": "High humidity ({humidity}%) accelerates fungal spread",
+        "unfavourable": "Standard Analysis",
+        "treatment": [
+            "Apply fungicide immediately (Neem-based recommended)",
+            "Improve air circulation around plants",
+            "Avoid overhead watering"
+        ],
+        "treatment_unfavourable": [
+            "Apply preventive fungicide spray",
+            "Monitor humidity levels"
+        ],
+    },
+    "bacterial_blight": {
+        "t_lo": 24, "t_hi": 32, "t_tol": 8, "rh": 80, "rh_dir": 1, "base": 0.45, "boost": 0, "urgency": (2, 2),
+        "favourable": "Standard Analysis",
+        "unfavourable": "Standard Analysis",
+        "treatment": [
+            "Remove and destroy infected plant parts",
+            "Apply copper-based bactericide",
+            "Avoid working with plants when wet"
+        ],
+    },
+    "aphids": {
+        "t_lo": 18, "t_hi": 30, "t_tol": 8, "rh": 0, "rh_dir": 0, "base": 0.35, "boost": 0, "urgency": (1, 1),
+        "favourable": "Standard Analysis",
+        "unfavourable": "Standard Analysis",
+        "treatment": [
             "Apply Neem oil spray (1:100 dilution)",
             "Introduce natural predators like ladybugs",
             "Use yellow sticky traps for monitoring"
-        ]
-        urgency = "Medium"
-        
-    elif disease == "Nutrient Deficiency":
-        treatment_advice = [
+        ],
+    },
+    "nutrient": {
+        "t_lo": -50, "t_hi": 60, "t_tol": 1, "rh": 0, "rh_dir": 0, "base": 0.2, "boost": 0, "urgency": (0, 0),
+        "favourable": "Standard Analysis",
+        "unfavourable": "Standard Analysis",
+        "treatment": [
             "Conduct soil test to identify specific deficiency",
             "Apply balanced NPK fertilizer",
             "Consider foliar spray for quick absorption"
-        ]
-        urgency = "Low"
-        
-    elif disease == "Healthy":
-        treatment_advice = [
+        ],
+    },
+    "healthy": {
+        "t_lo": -50, "t_hi": 60, "t_tol": 1, "rh": 0, "rh_dir": 0, "base": 0.0, "boost": 0, "urgency": (0, 0),
+        "favourable": "No issues detected",
+        "unfavourable": "No issues detected",
+        "treatment": [
             "Continue current care routine",
             "Monitor for any changes",
             "Maintain proper irrigation schedule"
-        ]
-        urgency = "Low"
-        fusion_factor = "No issues detected"
-        
-    else:
-        treatment_advice = [
+        ],
+    },
+    "unknown": {
+        "t_lo": -50, "t_hi": 60, "t_tol": 1, "rh": 0, "rh_dir": 0, "base": 0.4, "boost": 0, "urgency": (1, 1),
+        "favourable": "Standard Analysis",
+        "unfavourable": "Standard Analysis",
+        "treatment": [
             "Consult local agricultural expert",
             "Take additional photos from different angles",
             "Monitor crop for 48 hours"
-        ]
+        ],
+    },
+}
+
+# Keyword -> profile for the (lower-cased) condition part of a PlantVillage
+# class name; first match wins, so more specific keywords come first
+_PROFILE_KEYWORDS = [
+    ("healthy", "healthy"),
+    ("powdery_mildew", "powdery_mildew"),
+    ("late_blight", "fungal_cool_wet"),
+    ("apple_scab", "fungal_cool_wet"),
+    ("rust", "fungal_cool_wet"),
+    ("bacterial_spot", "bacterial"),
+    ("virus", "viral"),
+    ("haunglongbing", "viral"),
+    ("spider_mites", "mites"),
+    ("blight", "fungal_warm_wet"),
+    ("spot", "fungal_warm_wet"),
+    ("black_rot", "fungal_warm_wet"),
+    ("esca", "fungal_warm_wet"),
+    ("leaf_mold", "fungal_warm_wet"),
+    ("leaf_scorch", "fungal_warm_wet"),
+]
+
+# Non-PlantVillage labels (demo/mock predictions and older callers)
+_EXTRA_FUSION_CLASSES = {
+    "Heat Stress": "heat_stress",
+    "Powdery Mildew": "fungal_humid",
+    "Fungal Infection": "fungal_humid",
+    "Bacterial Blight": "bacterial_blight",
+    "Aphids Infestation": "aphids",
+    "Nutrient Deficiency": "nutrient",
+    "Healthy": "healthy",
+}
+
+
+def _profile_for_class(disease_class: str) -> str:
+    condition = (disease_class.partition("___")[2] or disease_class).lower()
+    for keyword, profile in _PROFILE_KEYWORDS:
+        if keyword in condition:
+            return profile
+    return "unknown"
+
+
+def compile_fusion_rules(classes: list = None) -> dict:
+    """
+    Compile the rule table into per-class NumPy arrays indexed by class id.
+
+    Class ids 0..len(classes)-1 follow `classes` (DISEASE_CLASSES by
+    default); the non-PlantVillage labels come after, and the last id is
+    the "unknown" fallback.
+    """
+    classes = list(classes or DISEASE_CLASSES)
+    names = classes + list(_EXTRA_FUSION_CLASSES) + ["Unknown"]
+    profiles = ([_profile_for_class(c) for c in classes] + list(_EXTRA_FUSION_CLASSES.values()) + ["unknown"])
+
+    def column(key):
+        return np.array([FUSION_PROFILES[p][key] for p in profiles], dtype=np.float32)
+
+    triggers = [FUSION_PROFILES[p].get("trigger") or (None, 0) for p in profiles]
+
+    return {
+        "names": names,
+        "index": {name: i for i, name in enumerate(names)},
+        "profiles": profiles,
+        "t_lo": column("t_lo"),
+        "t_hi": column("t_hi"),
+        "t_tol": column("t_tol"),
+        "rh": column("rh"),
+        "rh_dir": column("rh_dir"),
+        "base": column("base"),
+        "boost": column("boost"),
+        "urgency": column("urgency").astype(np.int8),  # (C, 2) favourable, unfavourable
+        "trigger_var": np.array([_TRIGGER_VARIABLES[var] for var, _ in triggers], dtype=np.int8),
+        "trigger_value": np.array([value for _, value in triggers], dtype=np.float32),
+    }
+
+
+FUSION_RULES = compile_fusion_rules()
+
+
+def register_fusion_classes(classes: list):
+    """
+    Add class names from another model (e.g. a crop-specific one) to the
+    rule table; their profiles are inferred from the class name keywords.
+    """
+    global FUSION_RULES
+    known = FUSION_RULES["index"]
+    new = [c for c in classes if c not in known]
+    if new:
+        base = FUSION_RULES["names"][:-len(_EXTRA_FUSION_CLASSES) - 1]
+        FUSION_RULES = compile_fusion_rules(base + new)
+
+
+def fusion_class_id(disease: str) -> int:
+    """Class id of a disease label in FUSION_RULES (unknown labels map to the fallback)."""
+    return FUSION_RULES["index"].get(disease, len(FUSION_RULES["names"]) - 1)
+
+
+def forecast_to_array(forecast: list) -> np.ndarray:
+    """Convert get_live_forecast()["forecast"] entries into an (hours, 2) [temp, humidity] array."""
+    return np.array([[f.get("temp", np.nan), f.get("humidity", np.nan)] for f in forecast], dtype=np.float32).reshape(-1, 2)
+
+
+def evaluate_fusion_rules(class_ids, confidences, forecast, current=None) -> dict:
+    """
+    Score many diagnoses against a weather forecast in one NumPy pass.
+
+    Args:
+        class_ids: (D,) class ids (fusion_class_id / predict_disease indices)
+        confidences: (D,) model confidence, 0-100
+        forecast: (H, 2) [temp °C, humidity %] shared by all diagnoses, or
+                  (D, H, 2) with one forecast per diagnosis (e.g. per field)
+        current: (temp, humidity) scored as a single hour when the forecast
+                 is empty (e.g. the forecast fetch failed); missing readings
+                 give a neutral risk and are never favourable
+
+    Returns:
+        dict: {
+            "risk": (D, H) float32 in [0, 1],
+            "urgency": (D, H) int8 index into URGENCY_LEVELS,
+            "favourable": (D, H) bool, weather favours the problem,
+            "fit": (D, H) float32 weather fit for each class in [0, 1],
+            "peak_hour": (D,) hour index of maximum risk,
+            "peak_urgency": (D,) int8 urgency at the peak
+        }
+    """
+    rules = FUSION_RULES
+    ids = np.asarray(class_ids, dtype=np.intp)
+    conf = np.clip(np.asarray(confidences, dtype=np.float32) / 100.0, 0.0, 1.0)[:, None]
+    forecast = np.asarray(forecast, dtype=np.float32)
+    if forecast.size == 0:
+        forecast = np.asarray([current if current is not None else (np.nan, np.nan)], dtype=np.float32)
+    temp, humidity = forecast[..., 0], forecast[..., 1]
+    if temp.ndim == 1:
+        temp, humidity = temp[None, :], humidity[None, :]
+
+    t_lo, t_hi, t_tol = rules["t_lo"][ids, None], rules["t_hi"][ids, None], rules["t_tol"][ids, None]
+    rh, rh_dir = rules["rh"][ids, None], rules["rh_dir"][ids, None]
+    base = rules["base"][ids, None]
+
+    # Temperature fit: 1 inside the window, falling linearly to 0 at t_tol outside it
+    outside = np.maximum(t_lo - temp, 0) + np.maximum(temp - t_hi, 0)
+    temp_fit = np.clip(1.0 - outside / t_tol, 0.0, 1.0)
+
+    # Humidity fit: how far past the threshold in the harmful direction
+    wet = np.clip((humidity - rh) / np.maximum(100.0 - rh, 1.0), 0.0, 1.0)
+    dry = np.clip((rh - humidity) / np.maximum(rh, 1.0), 0.0, 1.0)
+    humid_fit = np.where(rh_dir > 0, wet, np.where(rh_dir < 0, dry, 1.0))
+
+    # Missing readings ("--" from the weather API) give a neutral risk...
+    raw_fit = temp_fit * humid_fit
+    missing = np.isnan(raw_fit)
+    fit = np.nan_to_num(raw_fit, nan=0.5).astype(np.float32)
+    risk = (conf * (base + (1.0 - base) * fit)).astype(np.float32)
+
+    # Favourable weather: the profile's trigger reading above its value, else a fit of 0.5+
+    # ...but never count as favourable, so they get the profile's calmer tier
+    trigger_var, trigger_value = rules["trigger_var"][ids, None], rules["trigger_value"][ids, None]
+    favourable = np.where(trigger_var == 1, temp > trigger_value,
+                          np.where(trigger_var == 2, humidity > trigger_value, (fit >= 0.5) & ~missing))
+    tiers = rules["urgency"][ids]
+    urgency = np.where(favourable, tiers[:, :1], tiers[:, 1:]).astype(np.int8)
+
+    peak_hour = np.argmax(risk, axis=1)
+    return {
+        "risk": risk,
+        "urgency": urgency,
+        "favourable": favourable,
+        "fit": fit,
+        "peak_hour": peak_hour,
+        "peak_urgency": np.take_along_axis(urgency, peak_hour[:, None], axis=1)[:, 0],
+    }
+
+
+def _as_number(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def get_fusion_advice(diagnosis: dict, weather_data: dict) -> dict:
+    """
+    Fusion Logic: Cross-reference AI diagnosis with weather conditions
+    to provide enhanced, context-aware treatment advice.
+    
+    This is the "secret sauce" that differentiates our solution!
+    Single-snapshot wrapper over evaluate_fusion_rules().
     
+    Args:
+        diagnosis: Output from predict_disease()
+        weather_data: {temp, humidity, description}
+        
+    Returns:
+        dict: {
+            "enhanced_confidence": float,
+            "fusion_factor": str,
+            "treatment_advice": list of str,
+            "urgency": str (High/Medium/Low)
+        }
+    """
+    disease = diagnosis.get("disease", "Unknown")
+    confidence = _as_number(diagnosis.get("confidence", 0), 0.0)
+    # Absent readings default to typical values; unreadable ones ("--") stay
+    # unknown, so the advice is computed from the same values it shows
+    shown_temp = weather_data.get("temp", 30)
+    shown_humidity = weather_data.get("humidity", 60)
+    temp = _as_number(shown_temp, np.nan)
+    humidity = _as_number(shown_humidity, np.nan)
+
+    class_id = fusion_class_id(disease)
+    profile = FUSION_PROFILES[FUSION_RULES["profiles"][class_id]]
+    scores = evaluate_fusion_rules([class_id], [confidence], [[temp, humidity]])
+    fit = float(scores["fit"][0, 0])
+
+    favourable = bool(scores["favourable"][0, 0])
+    template = profile["favourable"] if favourable else profile["unfavourable"]
+    treatment = profile["treatment"] if favourable else profile.get("treatment_unfavourable", profile["treatment"])
+    # Threshold rules give their full boost, graded ones scale it by the fit
+    boost = profile["boost"] * (1.0 if profile.get("trigger") else fit)
+    enhanced_confidence = min(confidence + boost, 99.9) if favourable else confidence
+
     return {
         "enhanced_confidence": enhanced_confidence,
-        "fusion_factor": fusion_factor,
-        "treatment_advice": treatment_advice,
-        "urgency": urgency
+        "fusion_factor": template.format(temp=shown_temp, humidity=shown_humidity),
+        "treatment_advice": list(treatment),
+        "urgency": URGENCY_LEVELS[int(scores["urgency"][0, 0])]
     }
 
 
@@ -299,3 +1753,13 @@ def format_confidence(confidence: float) -> str:
         return f"{confidence:.1f}% (Moderate)"
     else:
         return f"{confidence:.1f}% (Low)"
+
+
+def format_disease_name(disease_class: str) -> str:
+    """Turn a PlantVillage class like 'Tomato___Early_blight' into 'Tomato - Early blight'."""
+    crop, _, condition = disease_class.partition("___")
+    if not condition:
+        return disease_class.replace("_", " ").strip()
+    crop = crop.replace("_", " ").replace(",", "").strip()
+    condition = condition.replace("_", " ").strip()
+    return f"{crop} - {condition[:1].upper()}{condition[1:]}"
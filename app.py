@@ -12,13 +12,14 @@ from folium import plugins
 
 
 # Core Backend Imports
-from ai_engine import get_severity_color, format_confidence
+from ai_engine import get_severity_color, format_confidence, warm_up_model, localize_disease, extract_embeddings, get_embedding_space
 from bhashini_layer import get_translations, translate_dynamic, speak_gujarati, speak_english, text_to_speech, translate_to_english
 from utils.backend_utils import get_weather, get_mandi_prices
 from utils.components import footer_buttons
 from utils.farm_db import update_user_crop
 # Advanced AI & Data Backend Imports
-from gemini_engine import chat_with_krishi_mitra, analyze_crop_image, transcribe_audio, get_ai_fusion_advice, generate_title_from_message
+from gemini_engine import stream_chat_with_krishi_mitra, analyze_crop_image, transcribe_audio, get_ai_fusion_advice, generate_title_from_message
+from diagnosis_engine import diagnose_crop_image
 from data_utils import (
     get_live_weather, get_live_soil, get_live_forecast, get_live_field_data, calculate_arbitrage,
     get_mandi_trends, get_gps_from_city, get_all_cities, get_all_crops, get_smart_crop_match,
@@ -28,6 +29,7 @@ from data_utils import (
 )
 from utils.auth_db import login_user, register_user, update_password, generate_otp, verify_otp, check_email_exists, update_user_notifications, update_user_preferences, update_user_profile
 from utils.farm_db import init_farm_db, get_farm, save_farm, save_history_record, get_history_records, get_user_crops, save_user_crop, delete_user_crop
+from utils.case_index import add_case, find_similar_cases
 from utils.email_utils import send_otp_email, send_alert_notification
 from utils.sms_utils import send_sms_otp
 from utils.pdf_gen import generate_farm_report
@@ -39,6 +41,13 @@ try:
 except Exception:
     pass
 
+# Warm the on-device disease model once per process (no-op on reruns)
+@st.cache_resource(show_spinner=False)
+def _warm_disease_model():
+    return warm_up_model()
+
+_warm_disease_model()
+
 # ==========================================
 # 1. HIGH-END UI CONFIGURATION
 # ==========================================
@@ -1678,6 +1687,14 @@ with tab_dash:
 
 with tab_diag:
     st.markdown(f"### {t.get('ai_pathologist', '🔍 AI Plant Pathologist')}")
+
+    def diagnosis_embedding():
+        """(space, embedding) of the last diagnosed photo, extracted on first use; None without an embedding model."""
+        if st.session_state.get('diagnosis_embedding') is None and st.session_state.get('diagnosis_image'):
+            import io
+            embeddings = extract_embeddings([Image.open(io.BytesIO(st.session_state['diagnosis_image']))])
+            st.session_state['diagnosis_embedding'] = (get_embedding_space(), embeddings[0]) if embeddings is not None else False
+        return st.session_state.get('diagnosis_embedding') or None
     
     # Using the 1.5 : 1 ratio we discussed for a larger image
     diag_col_l, diag_col_r = st.columns([1.5, 1])
@@ -1703,12 +1720,20 @@ with tab_diag:
                     # Reset previous results
                     if 'diagnosis' in st.session_state: del st.session_state['diagnosis']
                     if 'fusion_advice' in st.session_state: del st.session_state['fusion_advice']
+                    if 'localization' in st.session_state: del st.session_state['localization']
+                    if 'similar_cases' in st.session_state: del st.session_state['similar_cases']
+                    st.session_state['diagnosis_image'] = None
+                    st.session_state['diagnosis_embedding'] = None
             else:
                 # If the uploader is empty, ensure the session state is also cleared
                 st.session_state.uploaded_image = None
                 st.session_state.last_uploaded_file_id = None
                 if 'diagnosis' in st.session_state: del st.session_state['diagnosis']
                 if 'fusion_advice' in st.session_state: del st.session_state['fusion_advice']
+                if 'localization' in st.session_state: del st.session_state['localization']
+                if 'similar_cases' in st.session_state: del st.session_state['similar_cases']
+                st.session_state['diagnosis_image'] = None
+                st.session_state['diagnosis_embedding'] = None
 
             # 2. IMAGE PREVIEW & BUTTON (Inside the same box)
             if st.session_state.get('uploaded_image'):
@@ -1733,48 +1758,75 @@ with tab_diag:
                     with st.spinner(t.get('ai_analysis', '🔬 Running AI Analysis...')):
                         image_data = st.session_state.uploaded_image
                         
-                        # Use Gemini/OpenRouter API for image analysis
-                        img_bytes = image_data.getvalue()
-                        ctx = {"crop_history": st.session_state.crop_history}
-                        gemini_result = analyze_crop_image(img_bytes, st.session_state.language, ctx)
-                        
-                        # Convert Gemini result to expected format
-                        # Parse confidence from string to numeric
-                        conf_str = gemini_result.get('confidence', 'Medium')
-                        conf_map = {"Very High": 95, "High": 85, "Medium": 70, "Low": 50}
-                        conf_numeric = conf_map.get(conf_str, 75)
-                        
-                        diagnosis = {
-                            "disease": gemini_result.get('disease', 'Unknown'),
-                            "confidence": conf_numeric,
-                            "severity": gemini_result.get('severity', 'Medium'),
-                            "all_predictions": [(gemini_result.get('disease', 'Unknown'), conf_numeric)],
-                            "is_mock": False,
-                            "gemini_raw": gemini_result  # Store full result
-                        }
-                        
                         # Get weather fusion from live data
                         if coords:
                             weather_fusion = get_live_weather(coords["lat"], coords["lon"])
                         else:
                             weather_fusion = {"temp": 30, "humidity": 60}
+
+                        # On-device model first, Gemini/OpenRouter vision only on low confidence
+                        img_bytes = image_data.getvalue()
+                        ctx = {"crop_history": st.session_state.crop_history}
+                        user_crop = (st.session_state.get('user_profile') or {}).get('preferred_crop')
+                        gemini_result = diagnose_crop_image(img_bytes, st.session_state.language, ctx, weather_fusion,
+                                                            crop=user_crop)
+                        if gemini_result.get('retake'):
+                            # Quality gate: no model or vision call was made, ask for a better photo
+                            st.session_state['retake_messages'] = gemini_result.get('retake_messages', [])
+                        else:
+                            st.session_state['retake_messages'] = []
+                            is_local = gemini_result.get('source') == 'local'
                         
-                        # Enhanced fusion with Gemini analysis
-                        treatment = gemini_result.get('treatment', [])
-                        prevention = gemini_result.get('prevention', [])
+                            # Convert Gemini result to expected format
+                            # Parse confidence from string to numeric
+                            conf_str = gemini_result.get('confidence', 'Medium')
+                            conf_map = {"Very High": 95, "High": 85, "Medium": 70, "Low": 50}
+                            conf_numeric = gemini_result.get('confidence_score', conf_map.get(conf_str, 75))
                         
-                        fusion_advice = {
-                            "enhanced_confidence": conf_numeric,
-                            "fusion_factor": f"AI Analysis via Gemini Vision",
-                            "treatment_advice": treatment,
-                            "urgency": "High" if gemini_result.get('severity') in ['Severe', 'Critical'] else "Medium",
-                            "prevention": prevention
-                        }
+                            diagnosis = {
+                                "disease": gemini_result.get('disease', 'Unknown'),
+                                "confidence": conf_numeric,
+                                "severity": gemini_result.get('severity', 'Medium'),
+                                "all_predictions": gemini_result['local_prediction']['all_predictions'] if is_local else [(gemini_result.get('disease', 'Unknown'), conf_numeric)],
+                                "is_mock": False,
+                                "gemini_raw": None if is_local else gemini_result  # Store full result
+                            }
+                        
+                            # Enhanced fusion with Gemini analysis
+                            treatment = gemini_result.get('treatment', [])
+                            prevention = gemini_result.get('prevention', [])
                         
-                        st.session_state['diagnosis'] = diagnosis
-                        st.session_state['fusion_advice'] = fusion_advice
+                            fusion_advice = {
+                                "enhanced_confidence": conf_numeric,
+                                "fusion_factor": "On-device TFLite Model" if is_local else "AI Analysis via Gemini Vision",
+                                "treatment_advice": treatment,
+                                "urgency": gemini_result.get('urgency') or ("High" if gemini_result.get('severity') in ['Severe', 'Critical'] else "Medium"),
+                                "prevention": prevention
+                            }
+                        
+                            st.session_state['diagnosis'] = diagnosis
+                            st.session_state['fusion_advice'] = fusion_advice
+
+                            # Coarse lesion boxes for the diagnosis preview: only for a fresh
+                            # on-device answer that found a problem (cache hits and vision-model
+                            # answers have no local prediction to localise)
+                            st.session_state['localization'] = None
+                            local_disease = (gemini_result.get('local_prediction') or {}).get('disease', '')
+                            if is_local and not gemini_result.get('cached') and not local_disease.lower().endswith('healthy'):
+                                import io
+                                localization = localize_disease(Image.open(io.BytesIO(img_bytes)), crop=user_crop)
+                                st.session_state['localization'] = None if localization['is_mock'] else localization
+
+                            # Embedding for similar-case search is computed on demand
+                            st.session_state['diagnosis_image'] = img_bytes
+                            st.session_state['diagnosis_embedding'] = None
+                            st.session_state['similar_cases'] = None
                             
-                    st.success(t.get('analysis_complete', 'Analysis Complete!'))
+                    if st.session_state.get('retake_messages'):
+                        for msg in st.session_state['retake_messages']:
+                            st.warning(f"📷 {translate_dynamic(msg, st.session_state.language)}")
+                    else:
+                        st.success(t.get('analysis_complete', 'Analysis Complete!'))
         
     with diag_col_r:
         st.markdown(f"### {t.get('diagnosis_result', 'Diagnosis Result')}")
@@ -1889,6 +1941,26 @@ with tab_diag:
                 if st.session_state.get('generated_audio'):
                     st.audio(st.session_state.generated_audio, format='audio/mpeg')
 
+                # Similar confirmed cases nearby (embedding + search only when asked for)
+                similar_cases = st.session_state.get('similar_cases')
+                if similar_cases is None and st.session_state.get('diagnosis_image'):
+                    if st.button(t.get('find_similar_cases', '🔎 Find Similar Past Cases Nearby'), use_container_width=True, key="find_similar_cases"):
+                        embedding = diagnosis_embedding()
+                        st.session_state['similar_cases'] = find_similar_cases(
+                            embedding[0], embedding[1], k=3,
+                            lat=coords.get("lat") if coords else None,
+                            lon=coords.get("lon") if coords else None) if embedding else []
+                        similar_cases = st.session_state['similar_cases']
+                        if not similar_cases:
+                            st.caption(t.get('no_similar_cases', 'No similar confirmed cases nearby yet.'))
+                if similar_cases:
+                    st.markdown(f"**{t.get('similar_cases', '🔎 Similar Past Cases Nearby')}:**")
+                    for case in similar_cases:
+                        case_disease = translate_dynamic(case.get('disease') or 'Unknown', st.session_state.language)
+                        case_crop = translate_dynamic(case.get('crop') or '', st.session_state.language)
+                        st.markdown(f"- {case.get('record_date') or ''} · {case_crop} · {case_disease} "
+                                    f"({case['similarity'] * 100:.0f}% {t.get('similar', 'similar')})")
+
                 # --- Bridge to History ---
                 if is_logged_in:
                     st.markdown("---")
@@ -1903,9 +1975,18 @@ with tab_diag:
                             "disease": d.get('disease', 'Unknown'),
                             "pesticide": ", ".join(f.get('treatment_advice', [])[:2]), # Save first few treatments
                             "unusual": f"AI diagnosis: {f.get('urgency', 'Medium')} severity.",
-                            "duration": "Diagnosed via AI"
+                            "duration": "Diagnosed via AI",
+                            "lat": coords.get("lat") if coords else None,
+                            "lon": coords.get("lon") if coords else None
                         }
                         if save_history_record(st.session_state.user_profile['id'], st.session_state.user_profile['email'], hist_entry):
+                            # Confirmed case: make it findable for similar-case search
+                            embedding = diagnosis_embedding()
+                            if embedding:
+                                space, vector = embedding
+                                add_case(space, vector, dict(hist_entry, user_id=st.session_state.user_profile['id']))
+                            st.session_state['diagnosis_image'] = None
+                            st.session_state['diagnosis_embedding'] = None
                             st.toast(t.get('history_saved', 'History Logged!'), icon="✅")
                             st.rerun()
                         else:
@@ -2322,12 +2403,22 @@ with tab_chat:
                     
                     with chat_container:
                         with st.chat_message("assistant"):
-                            st.markdown(f'<span style="color:#9CA3AF; font-size:0.8rem;">{t.get("ai_typing", "Krishi-Mitra is thinking...")}</span>', unsafe_allow_html=True)
+                            typing_note = st.empty()
+                            typing_note.markdown(f'<span style="color:#9CA3AF; font-size:0.8rem;">{t.get("ai_typing", "Krishi-Mitra is thinking...")}</span>', unsafe_allow_html=True)
+                            target_crop = st.session_state.user_profile.get("preferred_crop", "Groundnut") if is_logged_in else "Groundnut"
+                            context = {"city": selected_city, "crop": target_crop, "temp": 30, "crop_history": st.session_state.get('crop_history', [])}
+
+                            def reply_chunks():
+                                # Render tokens as they arrive; drop the typing note at the first one
+                                for i, chunk in enumerate(stream_chat_with_krishi_mitra(user_msg, st.session_state.language, context)):
+                                    if i == 0:
+                                        typing_note.empty()
+                                    yield chunk
+
+                            reply = st.write_stream(reply_chunks())
+                            if not isinstance(reply, str):
+                                reply = "".join(str(part) for part in reply)
                             with st.spinner(""):
-                                target_crop = st.session_state.user_profile.get("preferred_crop", "Groundnut") if is_logged_in else "Groundnut"
-                                context = {"city": selected_city, "crop": target_crop, "temp": 30, "crop_history": st.session_state.get('crop_history', [])}
-                                reply = chat_with_krishi_mitra(user_msg, st.session_state.language, context)
-                                st.write(reply)
                                 if st.session_state.get('voice_interaction'):
                                     from bhashini_layer import text_to_speech
                                     audio_bytes = text_to_speech(reply, st.session_state.language)
@@ -2336,6 +2427,8 @@ with tab_chat:
                     st.session_state.chat_messages.append({"role": "assistant", "content": reply})
                     if is_logged_in and st.session_state.current_chat_session_id:
                         save_message(st.session_state.current_chat_session_id, "assistant", reply)
+                        # Pick up the AI title written in the background
+                        st.session_state.chat_history_list = get_user_chat_sessions(user_email)
                     st.session_state.voice_interaction = False
                     st.rerun()
 
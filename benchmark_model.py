@@ -0,0 +1,261 @@
+"""
+Krishi-Mitra AI - Disease Model Evaluation & Throughput Benchmark
+==================================================================
+
+Runs a labelled image folder (one sub-folder per class, named like the
+model's classes, e.g. PlantVillage "Tomato___Early_blight") through the
+disease model and reports, per model variant:
+
+- top-1 / top-3 accuracy
+- single-image p50 / p95 latency (preprocessing + invoke)
+- images per second at several batch sizes and thread counts
+- peak RSS
+
+"served" is the full predict_disease() path (interpreter pool, fast
+preprocessing); the other targets are the exported quantization
+variants run directly. Each target runs in its own subprocess so RSS
+numbers are not polluted by the others.
+
+Usage:
+    python benchmark_model.py --data-dir data/plantvillage_val
+    python benchmark_model.py --data-dir data/val --variants served float32 int8 \\
+        --batch-sizes 1 8 32 --threads 1 2 4 --json bench_v7.json --baseline bench_v6.json
+
+Author: Krishi-Mitra Team
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmark_runtime import peak_rss_mb
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+TARGETS = ("served", "float32", "dynamic", "float16", "int8")
+
+
+def load_labelled_images(data_dir: str, classes: list, per_class: int = None):
+    """
+    Decode every image under data_dir/<class name>/ into memory.
+    Returns (images, labels); folders that are not model classes are skipped.
+    """
+    from PIL import Image
+
+    index = {name: i for i, name in enumerate(classes)}
+    images, labels, skipped = [], [], []
+    for folder in sorted(os.listdir(data_dir)):
+        folder_path = os.path.join(data_dir, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        if folder not in index:
+            skipped.append(folder)
+            continue
+        names = sorted(n for n in os.listdir(folder_path) if n.lower().endswith(IMAGE_EXTENSIONS))
+        for name in names[:per_class] if per_class else names:
+            with Image.open(os.path.join(folder_path, name)) as img:
+                img.load()
+                images.append(img)
+            labels.append(index[folder])
+    if skipped:
+        print(f"⚠️ Skipped {len(skipped)} folders that are not model classes: {skipped[:5]}", file=sys.stderr)
+    return images, labels
+
+
+def _accuracy(top_indices, labels) -> dict:
+    import numpy as np
+    labels = np.asarray(labels)[:, None]
+    return {
+        "top1": float(np.mean(top_indices[:, 0:1] == labels)),
+        "top3": float(np.mean((top_indices[:, :3] == labels).any(axis=1))),
+    }
+
+
+def _percentiles(latencies: list) -> dict:
+    import numpy as np
+    return {
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+    }
+
+
+def _run_batches(ai_engine, interpreter, images: list, batch_size: int):
+    for i in range(0, len(images), batch_size):
+        chunk = images[i:i + batch_size]
+        if ai_engine.FAST_PREPROCESS:
+            ai_engine._run_inference_fast(interpreter, chunk)
+        else:
+            ai_engine._run_inference(interpreter, ai_engine.preprocess_images_batch(chunk))
+
+
+def run_served(data_dir: str, per_class: int) -> dict:
+    """Accuracy and latency of predict_disease() on the active model."""
+    import numpy as np
+    import ai_engine
+
+    with ai_engine.borrow_model() as (interpreter, classes):
+        if interpreter is None:
+            return {"error": "model could not be loaded"}
+    images, labels = load_labelled_images(data_dir, classes, per_class)
+    if not images:
+        return {"error": "no labelled images found"}
+
+    ai_engine.predict_disease(images[0])
+    index = {name: i for i, name in enumerate(classes)}
+    latencies, top = [], []
+    for img in images:
+        start = time.perf_counter()
+        result = ai_engine.predict_disease(img)
+        latencies.append((time.perf_counter() - start) * 1000)
+        top.append([index.get(name, -1) for name, _ in result["all_predictions"]])
+
+    model = ai_engine.get_engine_stats()["model"]
+    return dict(
+        _accuracy(np.array(top), labels),
+        **_percentiles(latencies),
+        images=len(images),
+        model_path=model["path"],
+        model_version=model["version"],
+    )
+
+
+def run_variant(variant: str, data_dir: str, per_class: int, batch_sizes: list, threads: list) -> dict:
+    """Accuracy, latency and batched throughput of one exported model variant."""
+    import numpy as np
+    import ai_engine
+
+    model_path = ai_engine.get_model_path(variant)
+    if variant != "float32" and model_path == ai_engine.MODEL_PATH:
+        return {"error": "variant not exported"}
+    metadata = ai_engine.load_model_metadata(model_path) or {}
+    classes = metadata.get("classes") or ai_engine.DISEASE_CLASSES
+
+    interpreter = ai_engine.load_tflite_model(model_path, threads[0])
+    if interpreter is None:
+        return {"error": "model could not be loaded"}
+    images, labels = load_labelled_images(data_dir, classes, per_class)
+    if not images:
+        return {"error": "no labelled images found"}
+
+    # Single-image latency and accuracy (one warm-up invoke first)
+    _run_batches(ai_engine, interpreter, images[:1], 1)
+    latencies, scores = [], []
+    for img in images:
+        start = time.perf_counter()
+        if ai_engine.FAST_PREPROCESS:
+            predictions = ai_engine._run_inference_fast(interpreter, [img])
+        else:
+            predictions = ai_engine._run_inference(interpreter, ai_engine.preprocess_images_batch([img]))
+        latencies.append((time.perf_counter() - start) * 1000)
+        scores.append(predictions[0, :len(classes)])
+    top_indices, _ = ai_engine._top_k(np.stack(scores), 3)
+
+    # Throughput for every thread count x batch size
+    throughput = {}
+    for num_threads in threads:
+        if num_threads != threads[0]:
+            interpreter = ai_engine.load_tflite_model(model_path, num_threads)
+        per_batch = {}
+        for batch_size in batch_sizes:
+            _run_batches(ai_engine, interpreter, images[:batch_size], batch_size)
+            start = time.perf_counter()
+            _run_batches(ai_engine, interpreter, images, batch_size)
+            elapsed = time.perf_counter() - start
+            per_batch[str(batch_size)] = len(images) / elapsed if elapsed else 0.0
+        throughput[str(num_threads)] = per_batch
+
+    return dict(
+        _accuracy(top_indices, labels),
+        **_percentiles(latencies),
+        images=len(images),
+        model_path=model_path,
+        model_version=metadata.get("version"),
+        size_bytes=os.path.getsize(model_path),
+        throughput_ips=throughput,
+    )
+
+
+def compare(results: list, baseline_path: str):
+    """Print accuracy / latency deltas against an earlier results file."""
+    with open(baseline_path) as f:
+        baseline = {r["target"]: r for r in json.load(f)["results"] if "error" not in r}
+    print(f"\nΔ vs {baseline_path}:")
+    for r in results:
+        old = baseline.get(r["target"])
+        if old is None or "error" in r:
+            continue
+        print(f"  {r['target']:8s} top-1 {100 * (r['top1'] - old['top1']):+5.1f} pts  "
+              f"top-3 {100 * (r['top3'] - old['top3']):+5.1f} pts  "
+              f"p50 {r['latency_ms_p50'] - old['latency_ms_p50']:+6.1f} ms  "
+              f"(version {old.get('model_version')} -> {r.get('model_version')})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate disease-model accuracy, latency and throughput.")
+    parser.add_argument("--data-dir", required=True, help="Labelled images: one sub-folder per class")
+    parser.add_argument("--variants", nargs="+", default=["served", "float32", "dynamic", "float16", "int8"],
+                        choices=TARGETS, help="'served' = predict_disease(); others = exported model variants")
+    parser.add_argument("--per-class", type=int, default=None, help="Cap images per class")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--json", default="benchmark_results.json", help="Results file")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.child == "served":
+            result = run_served(args.data_dir, args.per_class)
+        else:
+            result = run_variant(args.child, args.data_dir, args.per_class, args.batch_sizes, args.threads)
+        result["rss_peak_mb"] = peak_rss_mb()
+        print(json.dumps(result))
+        return
+
+    results = []
+    for target in args.variants:
+        print(f"⏱️ Benchmarking {target}...")
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", target, "--data-dir", args.data_dir,
+               "--batch-sizes", *map(str, args.batch_sizes), "--threads", *map(str, args.threads)]
+        if args.per_class:
+            cmd += ["--per-class", str(args.per_class)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+        if proc.returncode != 0 or not lines:
+            results.append({"target": target, "error": proc.stderr.strip().splitlines()[-1:] or "failed"})
+            continue
+        results.append(dict(json.loads(lines[-1]), target=target))
+
+    print(f"\n{'target':8s} {'images':>6s} {'top-1':>6s} {'top-3':>6s} {'p50':>8s} {'p95':>8s} {'RSS':>7s}  throughput (img/s)")
+    for r in results:
+        if "error" in r:
+            print(f"{r['target']:8s} {r['error']}")
+            continue
+        best = ""
+        if "throughput_ips" in r:
+            threads, per_batch = max(r["throughput_ips"].items(), key=lambda kv: max(kv[1].values()))
+            batch, ips = max(per_batch.items(), key=lambda kv: kv[1])
+            best = f"best {ips:.1f} @ batch {batch}, {threads} threads"
+        print(f"{r['target']:8s} {r['images']:6d} {r['top1'] * 100:5.1f}% {r['top3'] * 100:5.1f}% "
+              f"{r['latency_ms_p50']:6.1f}ms {r['latency_ms_p95']:6.1f}ms {r['rss_peak_mb']:5.0f}MB  {best}")
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "data_dir": args.data_dir,
+        "batch_sizes": args.batch_sizes,
+        "threads": args.threads,
+        "results": results,
+    }
+    with open(args.json, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📊 Results saved to {args.json}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
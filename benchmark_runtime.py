@@ -0,0 +1,136 @@
+"""
+Krishi-Mitra AI - Inference Runtime Benchmark
+==============================================
+
+Measures what each ai_engine backend costs a fresh worker process:
+import time, model load time, first / warm inference latency and RSS.
+
+Each backend runs in its own subprocess so imports are cold and memory
+numbers are not polluted by the other backends.
+
+Usage:
+    python benchmark_runtime.py
+    python benchmark_runtime.py --backends tflite_runtime tensorflow --runs 50 --json runtime_bench.json
+
+Author: Krishi-Mitra Team
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux /proc, else peak RSS)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_child(backend: str, runs: int, num_threads: int) -> dict:
+    """Benchmark one backend inside this (fresh) process."""
+    import numpy as np
+
+    result = {"backend": backend, "rss_start_mb": current_rss_mb()}
+
+    import ai_engine
+    start = time.perf_counter()
+    name, interpreter_class = ai_engine.get_runtime(ai_engine.get_model_path(), backend)
+    result["import_ms"] = (time.perf_counter() - start) * 1000
+    if interpreter_class is None:
+        result["error"] = "not installed"
+        return result
+    result["rss_after_import_mb"] = current_rss_mb()
+
+    start = time.perf_counter()
+    interpreter = ai_engine.load_tflite_model(ai_engine.get_model_path(), num_threads, backend)
+    result["load_ms"] = (time.perf_counter() - start) * 1000
+    if interpreter is None:
+        result["error"] = "model could not be loaded"
+        return result
+
+    shape = [int(d) for d in interpreter.get_input_details()[0]["shape"]]
+    shape[0] = 1
+    batch = np.random.rand(*shape).astype(np.float32)
+
+    start = time.perf_counter()
+    ai_engine._run_inference(interpreter, batch)
+    result["first_inference_ms"] = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        ai_engine._run_inference(interpreter, batch)
+        latencies.append((time.perf_counter() - start) * 1000)
+    result["inference_ms_p50"] = float(np.percentile(latencies, 50))
+    result["inference_ms_p95"] = float(np.percentile(latencies, 95))
+    result["rss_end_mb"] = current_rss_mb()
+    result["rss_peak_mb"] = peak_rss_mb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ai_engine inference runtimes (startup time and RSS).")
+    parser.add_argument("--backends", nargs="+", default=None,
+                        help="Backends to compare (default: all of ai_engine.RUNTIME_BACKENDS)")
+    parser.add_argument("--runs", type=int, default=20, help="Warm inference runs per backend")
+    parser.add_argument("--num-threads", type=int, default=None)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        import ai_engine
+        num_threads = args.num_threads or ai_engine.NUM_THREADS
+        print(json.dumps(run_child(args.child, args.runs, num_threads)))
+        return
+
+    backends = args.backends
+    if not backends:
+        # Avoid importing ai_engine (and numpy) in the parent process
+        backends = ["tflite_runtime", "onnxruntime", "tensorflow"]
+
+    results = []
+    for backend in backends:
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", backend, "--runs", str(args.runs)]
+        if args.num_threads:
+            cmd += ["--num-threads", str(args.num_threads)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+        if proc.returncode != 0 or not lines:
+            results.append({"backend": backend, "error": proc.stderr.strip().splitlines()[-1:] or "failed"})
+            continue
+        results.append(json.loads(lines[-1]))
+
+    print(f"{'backend':16s} {'import':>9s} {'load':>9s} {'first':>9s} {'p50':>8s} {'RSS':>8s}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:16s} {r['error']}")
+            continue
+        print(f"{r['backend']:16s} {r['import_ms']:7.0f}ms {r['load_ms']:7.1f}ms "
+              f"{r['first_inference_ms']:7.1f}ms {r['inference_ms_p50']:6.1f}ms {r['rss_peak_mb']:6.0f}MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n📊 Results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
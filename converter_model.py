@@ -1,29 +1,299 @@
-import tensorflow as tf
+"""
+Krishi-Mitra AI - Keras -> TFLite Model Converter
+==================================================
+
+Converts the trained Keras model into TFLite artifacts for ai_engine.py.
+
+Modes:
+- float32: plain conversion (crop_disease.tflite)
+- dynamic: dynamic-range quantization, int8 weights / float activations
+- float16: float16 weights
+- int8:    full-integer quantization calibrated on a folder of leaf images
+           (uint8 input/output, ~4x smaller than float32)
+
+Every non-float model is compared against the float32 model and a JSON
+report is written with size, single-image latency, batched throughput
+and top-1 agreement.
+
+Each model is written atomically together with a versioned metadata
+sidecar (crop_disease.tflite -> crop_disease.json) holding class order,
+input size, normalization and quantization params. Running servers pick
+up the new version without a restart (see ai_engine.check_for_model_update).
+
+Usage:
+    python converter_model.py                                  # float32 only
+    python converter_model.py --modes dynamic float16 int8 --calib-dir data/leaves
+    python converter_model.py --classes data/train                  # class order from training folders
+    python converter_model.py --embedding                           # also output penultimate-layer features
+    AI_MODEL_VARIANT=int8 streamlit run app.py                 # serve the int8 model
+
+Author: Krishi-Mitra Team
+"""
+
+import argparse
+import hashlib
+import json
 import os
+import time
+from datetime import datetime
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+import ai_engine
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def list_images(folder: str, limit: int = None) -> list:
+    """Recursively collect image paths from a folder (sorted, optionally capped)."""
+    paths = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+
+def make_representative_dataset(image_paths: list):
+    """Calibration generator for int8: yields inputs preprocessed like ai_engine."""
+    def generator():
+        for path in image_paths:
+            with Image.open(path) as img:
+                yield [ai_engine.preprocess_image(img)]
+    return generator
+
+
+def convert(model, mode: str, calib_paths: list = None) -> bytes:
+    """Convert a Keras model to TFLite bytes for the given quantization mode."""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if mode == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif mode == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == "int8":
+        if not calib_paths:
+            raise ValueError("int8 mode needs --calib-dir with representative leaf images")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = make_representative_dataset(calib_paths)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+
+    return converter.convert()
+
+
+def output_path_for(mode: str, output_dir: str) -> str:
+    """float32 keeps the historical file name; others get a _<mode> suffix."""
+    if mode == "float32":
+        return os.path.join(output_dir, "crop_disease.tflite")
+    return os.path.join(output_dir, f"crop_disease_{mode}.tflite")
+
+
+def load_class_names(source: str = None) -> list:
+    """
+    Class order the model was trained with: a JSON list file, or a training
+    folder whose sub-folders are the classes (Keras sorts them alphabetically).
+    Falls back to ai_engine.DISEASE_CLASSES.
+    """
+    if not source:
+        return list(ai_engine.DISEASE_CLASSES)
+    if os.path.isdir(source):
+        return sorted(name for name in os.listdir(source) if os.path.isdir(os.path.join(source, name)))
+    with open(source) as f:
+        return json.load(f)
+
+
+def with_embedding_output(model):
+    """
+    Add the penultimate layer as a second output so ai_engine can extract
+    image embeddings for similar-case search from the same invoke.
+    """
+    features = model.layers[-2].output
+    if int(features.shape[-1]) <= int(model.output.shape[-1]):
+        print("⚠️ Embedding is not wider than the classifier head; ai_engine tells the outputs apart by width")
+    return tf.keras.Model(model.inputs, [model.output, features])
+
+
+def _atomic_write(path: str, data: bytes):
+    """Write via a temp file + rename so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_metadata(model, tflite_model: bytes, mode: str, out_path: str, classes: list) -> dict:
+    """Versioned sidecar describing how to feed and read the converted model."""
+    interpreter = tf.lite.Interpreter(model_content=tflite_model)
+    input_detail = interpreter.get_input_details()[0]
+    output_detail, embedding_detail = ai_engine._output_roles(interpreter)
+    num_outputs = int(output_detail["shape"][-1])
+    if num_outputs != len(classes):
+        print(f"⚠️ Model has {num_outputs} outputs but {len(classes)} class names were given")
+
+    previous = ai_engine.load_model_metadata(out_path) or {}
+    return {
+        "schema": ai_engine.METADATA_SCHEMA_VERSION,
+        "version": int(previous.get("version", 0)) + 1,
+        "model": os.path.basename(out_path),
+        "variant": mode,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "sha256": hashlib.sha256(tflite_model).hexdigest(),
+        "classes": classes,
+        "input_size": [int(d) for d in model.input_shape[1:3]],
+        "embedding_dim": int(embedding_detail["shape"][-1]) if embedding_detail is not None else None,
+        "normalization": dict(ai_engine.SUPPORTED_NORMALIZATION, color="RGB"),
+        "quantization": {
+            "input": {"dtype": input_detail["dtype"].__name__,
+                      "scale": float(input_detail["quantization"][0]),
+                      "zero_point": int(input_detail["quantization"][1])},
+            "output": {"dtype": output_detail["dtype"].__name__,
+                       "scale": float(output_detail["quantization"][0]),
+                       "zero_point": int(output_detail["quantization"][1])},
+        },
+    }
+
+
+def evaluate(model_path: str, images: list, batch_size: int, num_threads: int) -> dict:
+    """Measure single-image latency, batched throughput and top-1 predictions."""
+    interpreter = ai_engine.load_tflite_model(model_path, num_threads)
+
+    # Single-image latency (one warm-up invoke first)
+    ai_engine._run_inference(interpreter, ai_engine.preprocess_images_batch(images[:1]))
+    latencies = []
+    top1 = []
+    for img in images:
+        batch = ai_engine.preprocess_images_batch([img])
+        start = time.perf_counter()
+        scores = ai_engine._run_inference(interpreter, batch)
+        latencies.append((time.perf_counter() - start) * 1000)
+        top1.append(int(np.argmax(scores[0])))
+
+    # Batched throughput
+    batches = [ai_engine.preprocess_images_batch(images[i:i + batch_size])
+               for i in range(0, len(images), batch_size)]
+    ai_engine._run_inference(interpreter, batches[0])
+    start = time.perf_counter()
+    for batch in batches:
+        ai_engine._run_inference(interpreter, batch)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "size_bytes": os.path.getsize(model_path),
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+        "batch_size": batch_size,
+        "throughput_ips": len(images) / elapsed if elapsed else 0.0,
+        "top1": top1,
+    }
+
+
+def build_report(paths: dict, eval_paths: list, batch_size: int, num_threads: int) -> dict:
+    """Compare every exported variant against the float32 model."""
+    images = []
+    for path in eval_paths:
+        with Image.open(path) as img:
+            images.append(img.convert("RGB"))
+
+    results = {mode: evaluate(path, images, batch_size, num_threads) for mode, path in paths.items()}
+    reference = results.get("float32")
+
+    report = {"eval_images": len(images), "num_threads": num_threads, "models": {}}
+    for mode, res in results.items():
+        top1 = res.pop("top1")
+        entry = dict(res, path=paths[mode])
+        if reference:
+            entry["size_ratio"] = res["size_bytes"] / reference["size_bytes"]
+            entry["top1_agreement"] = float(np.mean(np.array(top1) == np.array(reference["top1"])))
+        report["models"][mode] = entry
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the Keras disease model to (quantized) TFLite.")
+    parser.add_argument("--model", default="best_disease_model.h5", help="Keras .h5 model (or plant_disease_model.h5)")
+    parser.add_argument("--output-dir", default=ai_engine.MODEL_DIR)
+    parser.add_argument("--modes", nargs="+", default=["float32"], choices=ai_engine.MODEL_VARIANTS)
+    parser.add_argument("--classes", help="Class order: JSON list file or training folder (default: ai_engine.DISEASE_CLASSES)")
+    parser.add_argument("--embedding", action="store_true", help="Also export the penultimate-layer embedding output")
+    parser.add_argument("--calib-dir", help="Folder of representative leaf images (required for int8)")
+    parser.add_argument("--calib-samples", type=int, default=200)
+    parser.add_argument("--eval-dir", help="Images for the comparison report (defaults to --calib-dir)")
+    parser.add_argument("--eval-samples", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--num-threads", type=int, default=ai_engine.NUM_THREADS)
+    parser.add_argument("--report", default=None, help="Report path (default: <output-dir>/quantization_report.json)")
+    args = parser.parse_args()
+
+    # 1. Load your best model
+    print(f"🔄 Loading {args.model}...")
+    model = tf.keras.models.load_model(args.model)
+    if args.embedding:
+        model = with_embedding_output(model)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    calib_paths = list_images(args.calib_dir, args.calib_samples) if args.calib_dir else None
+    classes = load_class_names(args.classes)
+
+    # 2. Convert to TFLite (always keep a float32 reference for the report)
+    modes = list(dict.fromkeys(["float32"] + args.modes))
+    paths = {}
+    for mode in modes:
+        out_path = output_path_for(mode, args.output_dir)
+        if mode == "float32" and "float32" not in args.modes and os.path.exists(out_path):
+            paths[mode] = out_path
+            continue
+        print(f"⚙️ Converting ({mode})...")
+        tflite_model = convert(model, mode, calib_paths)
+
+        # 3. Save the TFLite file, then its metadata (the sidecar's sha256
+        #    lets running servers tell a complete pair from a half-written one)
+        metadata = build_metadata(model, tflite_model, mode, out_path, classes)
+        _atomic_write(out_path, tflite_model)
+        _atomic_write(ai_engine.metadata_path_for(out_path), json.dumps(metadata, indent=2).encode())
+        paths[mode] = out_path
+        print(f"✅ Success! Saved as {out_path} ({len(tflite_model) / 1e6:.2f} MB, version {metadata['version']})")
+
+    # 4. Latency / accuracy report against the float32 model
+    eval_dir = args.eval_dir or args.calib_dir
+    if eval_dir and len(paths) > 1:
+        eval_paths = list_images(eval_dir, args.eval_samples)
+        if eval_paths:
+            report = build_report(paths, eval_paths, args.batch_size, args.num_threads)
+            report_path = args.report or os.path.join(args.output_dir, "quantization_report.json")
+            with open(report_path, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"\n📊 Report ({report['eval_images']} images) saved to {report_path}")
+            for mode, entry in report["models"].items():
+                print(f"  {mode:8s} {entry['size_bytes'] / 1e6:7.2f} MB  "
+                      f"p50 {entry['latency_ms_p50']:6.1f} ms  "
+                      f"{entry['throughput_ips']:7.1f} img/s @ batch {entry['batch_size']}  "
+                      f"top-1 agree {entry.get('top1_agreement', 1.0) * 100:5.1f}%")
+    elif len(paths) > 1:
+        print("\n⚠️ Pass --eval-dir (or --calib-dir) to generate the comparison report.")
+
+    # 5. CRITICAL: Try to find the class order
+    # (This works if you used ImageDataGenerator)
+    if args.classes:
+        print(f"\n✅ Class order ({len(classes)} classes) recorded in the model metadata.")
+    else:
+        print("\n⚠️ No --classes given; metadata uses ai_engine.DISEASE_CLASSES. CHECK IT AGAINST THIS ORDER:")
+        print("---------------------------------------------------")
+        # Usually, Keras doesn't save class names inside the h5.
+        # BUT, standard practice is ALPHABETICAL.
+        # If you know the folder names you trained on, list them alphabetically here:
+        print("If you trained using folders, the model uses ALPHABETICAL order.")
+        print("Example: ['Aphids...', 'Bacterial...', 'Fungal...', 'Healthy...']")
+        print("Re-run with --classes <training folder> to record the real order in the model metadata.")
+        print("---------------------------------------------------")
+    if len(paths) > 1:
+        print("Serve a quantized model with AI_MODEL_VARIANT=<dynamic|float16|int8>.")
+
 
-# 1. Load your best model
-model_path = "best_disease_model.h5" # Or plant_disease_model.h5
-print(f"🔄 Loading {model_path}...")
-model = tf.keras.models.load_model(model_path)
-
-# 2. Convert to TFLite (The "Lite" version for the App)
-converter = tf.lite.TFLiteConverter.from_keras_model(model)
-tflite_model = converter.convert()
-
-# 3. Save the TFLite file
-output_path = "crop_disease.tflite"
-with open(output_path, 'wb') as f:
-    f.write(tflite_model)
-print(f"✅ Success! Saved as {output_path}")
-
-# 4. CRITICAL: Try to find the class order
-# (This works if you used ImageDataGenerator)
-print("\n⚠️ CHECK YOUR ai_engine.py LIST AGAINST THIS ORDER:")
-print("---------------------------------------------------")
-# Usually, Keras doesn't save class names inside the h5.
-# BUT, standard practice is ALPHABETICAL.
-# If you know the folder names you trained on, list them alphabetically here:
-print("If you trained using folders, the model uses ALPHABETICAL order.")
-print("Example: ['Aphids...', 'Bacterial...', 'Fungal...', 'Healthy...']")
-print("You MUST update DISEASE_CLASSES in ai_engine.py to match this alphabetical order.")
-print("---------------------------------------------------")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
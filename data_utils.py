@@ -4,6 +4,7 @@ Krishi-Mitra AI - Data Utilities Module
 Optimized for Speed:
 1. Mandi logic now filters closest cities BEFORE making API calls.
 2. Caching enabled for static datasets.
+3. Identical concurrent upstream requests share one call (single-flight).
 """
 
 import streamlit as st
@@ -13,6 +14,7 @@ import difflib
 import random
 from math import radians, sin, cos, sqrt, atan2
 from dotenv import load_dotenv
+from utils.single_flight import coalesce
 
 load_dotenv()
 
@@ -194,6 +196,7 @@ def calculate_linear_distance(lat1, lon1, lat2, lon2):
     c = 2 * atan2(sqrt(a), sqrt(1-a))
     return R * c
 
+@coalesce("openrouteservice")
 def get_real_road_distance(lat1, lon1, lat2, lon2):
     """Calculate driving distance using OpenRouteService."""
     if not OPENROUTE_API_KEY: return None
@@ -206,6 +209,7 @@ def get_real_road_distance(lat1, lon1, lat2, lon2):
     except: return None
     return None
 
+@coalesce("data_gov_in")
 def get_gov_mandi_price(crop, district):
     """Fetch real prices from data.gov.in"""
     if not MANDI_API_KEY: return None
@@ -318,6 +322,7 @@ def calculate_arbitrage(crop: str, user_lat: float, user_lon: float, quantity: f
 # ============================================================
 
 @st.cache_data(ttl=60, show_spinner=False)
+@coalesce("weather")
 def get_live_weather(lat: float, lon: float) -> dict:
     # PRIORITY 1: Open-Meteo (High Accuracy for Humidity in Gujarat/India)
     # Uses ECMWF & GFS models which are often more precise for coastal regions
@@ -373,6 +378,7 @@ def get_live_weather(lat: float, lon: float) -> dict:
     return {"temp": "--", "humidity": "--", "description": "--", "wind_speed": "--", "api_source": "None"}
 
 @st.cache_data(ttl=60, show_spinner=False)
+@coalesce("open_meteo_soil")
 def get_live_soil(lat: float, lon: float) -> dict:
     try:
         # Open-Meteo is free and fast
@@ -418,6 +424,7 @@ def get_gps_from_city(city_name):
 def get_all_cities(): return sorted(GUJARAT_CITIES.keys())
 def get_all_crops(): return sorted(GUJARAT_CROPS.keys())
 
+@coalesce("esri_tiles")
 def get_satellite_image(lat, lon, zoom=10):
     """
     Fetch satellite/aerial imagery using ESRI World Imagery API.
@@ -523,6 +530,7 @@ def get_smart_crop_match(text):
 def get_crops_by_category(category):
     return [crop for crop, data in GUJARAT_CROPS.items() if data.get("category") == category]
 
+@coalesce("positionstack")
 def get_city_from_positionstack(lat, lon):
     """Reverse geocoding using Positionstack."""
     if not POSITIONSTACK_API_KEY: return None
@@ -543,6 +551,7 @@ def get_city_from_positionstack(lat, lon):
         print(f"Positionstack error: {e}")
     return None
 
+@coalesce("nominatim")
 def get_city_from_nominatim(lat, lon):
     """
     Reverse geocoding using OpenStreetMap (Nominatim).
@@ -607,6 +616,7 @@ def get_nearest_city(lat, lon):
 # WEATHER FORECAST
 # ============================================================
 
+@coalesce("openweather_forecast")
 def get_live_forecast(lat: float, lon: float, days: int = 7) -> dict:
     """Get weather forecast for specified number of days"""
     if not WEATHER_API_KEY:
@@ -0,0 +1,679 @@
+"""
+Krishi-Mitra AI - Diagnosis Pipeline
+=====================================
+
+Single entry point for leaf diagnosis used by app.py and server.py.
+
+Modes (DIAGNOSIS_MODE):
+- cascade: run the on-device TFLite model first and answer immediately when
+           its confidence clears the per-class threshold; escalate to the
+           OpenRouter vision model only otherwise (default)
+- local:   on-device model only (falls back to the LLM if no model exists)
+- llm:     always use analyze_crop_image (previous behaviour)
+
+Repeated or near-identical photos are answered from a perceptual-hash
+cache (utils/diagnosis_cache.py) before either model runs. Blurry,
+badly exposed or leaf-less photos are turned back with a retake request
+by a NumPy quality gate before any model or remote call. Accepted photos
+are cropped to the leaf (largest plant-coloured region) so both the
+local model and the vision upload see less soil and sky.
+
+diagnose_crop_video() does the same for short field clips, aggregating
+the on-device model over many frames.
+
+Author: Krishi-Mitra Team
+"""
+
+import heapq
+import io
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from ai_engine import (
+    predict_disease, predict_proba_batch, get_fusion_advice, format_disease_name,
+    laplacian_variance
+)
+from gemini_engine import analyze_crop_image
+from utils.diagnosis_cache import hash_image_bytes, get_cached_diagnosis, cache_diagnosis, get_cache_stats
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+DIAGNOSIS_MODE = os.getenv("DIAGNOSIS_MODE", "cascade")
+
+# Perceptual-hash cache in front of both the local model and the LLM
+DIAGNOSIS_CACHE_ENABLED = os.getenv("DIAGNOSIS_CACHE", "1") == "1"
+
+# Local confidence (0-100) needed to skip the LLM call
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "85"))
+
+# Per-class overrides, e.g. CASCADE_CLASS_THRESHOLDS='{"Tomato___Late_blight": 92}'
+CASCADE_CLASS_THRESHOLDS = json.loads(os.getenv("CASCADE_CLASS_THRESHOLDS", "{}"))
+
+# Video diagnosis: frames sampled per second, longest clip section read,
+# decoded frame size, sharpest frames kept for the model, blur cut-off
+# (Laplacian variance) and how many frames go to the vision LLM
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "2"))
+VIDEO_MAX_SECONDS = float(os.getenv("VIDEO_MAX_SECONDS", "30"))
+VIDEO_FRAME_SIZE = int(os.getenv("VIDEO_FRAME_SIZE", "448"))
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "24"))
+VIDEO_MIN_SHARPNESS = float(os.getenv("VIDEO_MIN_SHARPNESS", "30"))
+VIDEO_LLM_FRAMES = int(os.getenv("VIDEO_LLM_FRAMES", "3"))
+
+# Photo quality gate: analysis size, minimum sharpness (Laplacian
+# variance), largest share of crushed-black or blown-out pixels, and the
+# minimum share of plant-coloured pixels
+QUALITY_GATE_ENABLED = os.getenv("QUALITY_GATE", "1") == "1"
+QUALITY_SIZE = int(os.getenv("QUALITY_SIZE", "256"))
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "40"))
+QUALITY_MAX_CLIPPED = float(os.getenv("QUALITY_MAX_CLIPPED", "0.4"))
+QUALITY_MIN_LEAF_RATIO = float(os.getenv("QUALITY_MIN_LEAF_RATIO", "0.08"))
+
+# Leaf region-of-interest crop: margin around the leaf (fraction of its
+# box), smallest leaf region worth cropping to, area share above which the
+# crop is not worth it, and the JPEG quality of the cropped upload
+LEAF_ROI_ENABLED = os.getenv("LEAF_ROI", "1") == "1"
+ROI_MARGIN = float(os.getenv("ROI_MARGIN", "0.08"))
+ROI_MIN_COMPONENT = float(os.getenv("ROI_MIN_COMPONENT", "0.02"))
+ROI_MAX_AREA = float(os.getenv("ROI_MAX_AREA", "0.85"))
+ROI_JPEG_QUALITY = int(os.getenv("ROI_JPEG_QUALITY", "90"))
+
+# ============================================================
+# PATH STATISTICS
+# ============================================================
+# local:     answered on-device
+# escalated: local model ran but was not confident enough -> LLM
+# llm:       LLM only (llm mode, no local model, or unreadable image)
+# cache:     same or near-identical photo answered from the diagnosis cache
+# video:     multi-frame clip diagnosis (local and escalated combined)
+# rejected:  turned back by the quality gate (retake requested)
+_stats_lock = threading.Lock()
+_PATH_STATS = {path: {"count": 0, "ms_total": 0.0}
+               for path in ("cache", "local", "escalated", "llm", "video", "rejected")}
+# Photos the quality gate rejected, by reason. remote_calls_saved counts the
+# rejections that would otherwise have reached the vision model: every one in
+# llm mode, and in cascade mode those the local model could not answer.
+_QUALITY_STATS = {"rejected": 0, "remote_calls_saved": 0, "blurry": 0, "dark": 0, "overexposed": 0, "no_leaf": 0}
+# Leaf ROI crops: how often applied and what they removed
+_ROI_STATS = {"cropped": 0, "skipped": 0, "pixels_in": 0, "pixels_out": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def _record_path(path: str, elapsed_ms: float):
+    with _stats_lock:
+        _PATH_STATS[path]["count"] += 1
+        _PATH_STATS[path]["ms_total"] += elapsed_ms
+
+
+def get_diagnosis_stats() -> dict:
+    """How often each diagnosis path was taken and its average latency."""
+    with _stats_lock:
+        stats = {path: dict(values) for path, values in _PATH_STATS.items()}
+    total = sum(values["count"] for values in stats.values())
+    for values in stats.values():
+        values["ms_avg"] = values["ms_total"] / values["count"] if values["count"] else 0.0
+        values["share"] = values["count"] / total if total else 0.0
+    with _stats_lock:
+        quality = dict(_QUALITY_STATS)
+        roi = dict(_ROI_STATS)
+    roi["bytes_saved"] = roi["bytes_in"] - roi["bytes_out"]
+    roi["pixel_share_kept"] = roi["pixels_out"] / roi["pixels_in"] if roi["pixels_in"] else 1.0
+    return {"mode": DIAGNOSIS_MODE, "total": total, "paths": stats, "cache": get_cache_stats(),
+            "quality_gate": quality, "leaf_roi": roi}
+
+
+# ============================================================
+# QUALITY GATE
+# ============================================================
+
+RETAKE_MESSAGES = {
+    "blurry": "The photo is blurry. Hold the phone steady and tap the leaf to focus.",
+    "dark": "The photo is too dark. Take it in daylight or with the leaf facing the light.",
+    "overexposed": "The photo is too bright. Avoid direct sun glare on the leaf.",
+    "no_leaf": "No leaf was found. Fill the frame with the affected leaf.",
+}
+
+
+def _downscaled_rgb(image: Image.Image) -> np.ndarray:
+    """(h, w, 3) float32 copy of the photo no larger than QUALITY_SIZE."""
+    if image.format == "JPEG":
+        image.draft("RGB", (QUALITY_SIZE, QUALITY_SIZE))
+    image = image.convert("RGB")
+    image.thumbnail((QUALITY_SIZE, QUALITY_SIZE))
+    return np.asarray(image, dtype=np.float32)
+
+
+def leaf_mask(rgb: np.ndarray) -> np.ndarray:
+    """Plant-coloured pixels: saturated yellow-green to green hues (HSV hue 35-170 deg)."""
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    high = rgb.max(axis=2)
+    chroma = high - rgb.min(axis=2)
+    saturation = chroma / np.maximum(high, 1.0)
+    hue = np.degrees(np.arctan2(np.sqrt(3.0) * (g - b), 2.0 * r - g - b)) % 360
+    return (hue >= 35) & (hue <= 170) & (saturation > 0.15) & (high > 40)
+
+
+def assess_image_quality(image: Image.Image) -> dict:
+    """
+    Cheap checks on a downscaled copy of the photo.
+
+    Returns:
+        {"ok": bool, "reasons": [...], "sharpness", "dark_fraction",
+         "bright_fraction", "leaf_ratio"}
+    """
+    rgb = _downscaled_rgb(image)
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    # Exposure: share of crushed / blown-out pixels
+    dark_fraction = float(np.mean(gray < 16))
+    bright_fraction = float(np.mean(gray > 240))
+
+    leaf_ratio = float(np.mean(leaf_mask(rgb)))
+
+    sharpness = laplacian_variance(gray)
+
+    reasons = []
+    if dark_fraction > QUALITY_MAX_CLIPPED:
+        reasons.append("dark")
+    if bright_fraction > QUALITY_MAX_CLIPPED:
+        reasons.append("overexposed")
+    # Clipped photos have little texture anyway; only judge focus when exposure is fine
+    if not reasons and sharpness < QUALITY_MIN_SHARPNESS:
+        reasons.append("blurry")
+    if leaf_ratio < QUALITY_MIN_LEAF_RATIO:
+        reasons.append("no_leaf")
+
+    return {
+        "ok": not reasons,
+        "reasons": reasons,
+        "sharpness": sharpness,
+        "dark_fraction": dark_fraction,
+        "bright_fraction": bright_fraction,
+        "leaf_ratio": leaf_ratio,
+    }
+
+
+# ============================================================
+# LEAF REGION OF INTEREST
+# ============================================================
+
+def _largest_component(mask: np.ndarray) -> np.ndarray:
+    """
+    Boolean mask of the largest 4-connected region. Labels spread by
+    neighbour-max propagation plus pointer jumping (label -> label of the
+    pixel it names), which converges in a handful of vectorized passes.
+    """
+    height, width = mask.shape
+    ids = np.arange(1, height * width + 1, dtype=np.int32).reshape(height, width)
+    labels = np.where(mask, ids, 0)
+    while True:
+        padded = np.pad(labels, 1)
+        spread = np.maximum.reduce([labels, padded[:-2, 1:-1], padded[2:, 1:-1],
+                                    padded[1:-1, :-2], padded[1:-1, 2:]])
+        spread = np.where(mask, spread, 0)
+        flat = spread.ravel()
+        jumped = np.where(flat > 0, flat[np.maximum(flat - 1, 0)], 0).reshape(height, width)
+        spread = np.maximum(spread, jumped)
+        if np.array_equal(spread, labels):
+            break
+        labels = spread
+    counts = np.bincount(labels.ravel())
+    counts[0] = 0
+    return labels == np.argmax(counts)
+
+
+def find_leaf_box(image: Image.Image):
+    """
+    Bounding box (left, top, right, bottom) of the main leaf in full-image
+    pixels, or None when no crop is worthwhile (no clear leaf region, or
+    the leaf already fills most of the frame).
+    """
+    width, height = image.size
+    rgb = _downscaled_rgb(image)
+    mask = leaf_mask(rgb)
+    # Close small gaps (lesions, veins) so one leaf stays one region
+    padded = np.pad(mask, 1)
+    mask = mask | padded[:-2, 1:-1] | padded[2:, 1:-1] | padded[1:-1, :-2] | padded[1:-1, 2:]
+
+    component = _largest_component(mask)
+    if component.mean() < ROI_MIN_COMPONENT:
+        return None
+    rows = np.flatnonzero(component.any(axis=1))
+    cols = np.flatnonzero(component.any(axis=0))
+
+    scale_y, scale_x = height / mask.shape[0], width / mask.shape[1]
+    top, bottom = rows[0] * scale_y, (rows[-1] + 1) * scale_y
+    left, right = cols[0] * scale_x, (cols[-1] + 1) * scale_x
+    margin_y, margin_x = (bottom - top) * ROI_MARGIN, (right - left) * ROI_MARGIN
+    box = (max(0, int(left - margin_x)), max(0, int(top - margin_y)),
+           min(width, int(np.ceil(right + margin_x))), min(height, int(np.ceil(bottom + margin_y))))
+    if (box[2] - box[0]) * (box[3] - box[1]) > ROI_MAX_AREA * width * height:
+        return None
+    return box
+
+
+def crop_upload_to_leaf(image_bytes: bytes):
+    """
+    Crop an uploaded photo to the leaf.
+
+    Returns (image, image_bytes): the cropped PIL image and its JPEG bytes,
+    or (None, original bytes) when the photo is left as is.
+    """
+    try:
+        box = find_leaf_box(Image.open(io.BytesIO(image_bytes)))
+    except Exception as e:
+        print(f"[Diagnosis] Leaf ROI failed: {e}")
+        box = None
+    if box is None:
+        with _stats_lock:
+            _ROI_STATS["skipped"] += 1
+        return None, image_bytes
+
+    image = Image.open(io.BytesIO(image_bytes))
+    full_pixels = image.size[0] * image.size[1]
+    cropped = image.convert("RGB").crop(box)
+    output = io.BytesIO()
+    cropped.save(output, format="JPEG", quality=ROI_JPEG_QUALITY)
+    cropped_bytes = output.getvalue()
+
+    crop_pixels = cropped.size[0] * cropped.size[1]
+    with _stats_lock:
+        _ROI_STATS["cropped"] += 1
+        _ROI_STATS["pixels_in"] += full_pixels
+        _ROI_STATS["pixels_out"] += crop_pixels
+        _ROI_STATS["bytes_in"] += len(image_bytes)
+        _ROI_STATS["bytes_out"] += len(cropped_bytes)
+    print(f"[Diagnosis] Leaf ROI: kept {crop_pixels / full_pixels:.0%} of pixels, "
+          f"{len(image_bytes) / 1024:.0f} KB -> {len(cropped_bytes) / 1024:.0f} KB")
+    return cropped, cropped_bytes
+
+
+def _retake_result(quality: dict) -> dict:
+    """Diagnosis-shaped response asking the farmer for a better photo."""
+    messages = [RETAKE_MESSAGES[reason] for reason in quality["reasons"]]
+    return {
+        "disease": "Retake photo: " + " ".join(messages),
+        "error": True,
+        "retake": True,
+        "retake_reasons": quality["reasons"],
+        "retake_messages": messages,
+        "quality": quality,
+        "source": "quality_gate",
+    }
+
+
+# ============================================================
+# CASCADE
+# ============================================================
+
+def get_class_threshold(disease_class: str) -> float:
+    """Confidence (0-100) the local model needs for this class to skip the LLM."""
+    return float(CASCADE_CLASS_THRESHOLDS.get(disease_class, CASCADE_THRESHOLD))
+
+
+def _confidence_label(confidence: float) -> str:
+    """Map a 0-100 score onto the labels the vision model returns."""
+    if confidence >= 90:
+        return "Very High"
+    elif confidence >= 80:
+        return "High"
+    elif confidence >= 60:
+        return "Medium"
+    return "Low"
+
+
+# Fusion urgency -> the severity / chlorophyll labels the vision model uses
+_URGENCY_SEVERITY = {"High": "Severe", "Medium": "Moderate", "Low": "Mild"}
+_URGENCY_CHLOROPHYLL = {"High": "Low", "Medium": "Moderate", "Low": "Moderate"}
+
+
+def _local_result(prediction: dict, weather_data: dict = None, language: str = "en") -> dict:
+    """
+    Convert a predict_disease() result into the analyze_crop_image() format.
+
+    Severity comes from the weather-fused urgency. For languages other than
+    English the name, fusion note and treatment are machine-translated;
+    "localized" is False if that failed and the text is still English.
+    """
+    healthy = prediction["disease"].lower().endswith("healthy")
+    advice = get_fusion_advice(prediction, weather_data or {})
+    result = {
+        "disease": format_disease_name(prediction["disease"]),
+        "confidence": _confidence_label(prediction["confidence"]),
+        "confidence_score": prediction["confidence"],
+        "severity": "N/A" if healthy else _URGENCY_SEVERITY[advice["urgency"]],
+        "urgency": advice["urgency"],
+        "chlorophyll": "Optimal" if healthy else _URGENCY_CHLOROPHYLL[advice["urgency"]],
+        "fusion_factor": advice["fusion_factor"],
+        "treatment": advice["treatment_advice"],
+        "prevention": "",
+        "error": False,
+        "source": "local",
+        "local_prediction": prediction,
+        "localized": True,
+    }
+    if language != "en":
+        result["localized"] = _translate_result(result, language)
+    return result
+
+
+def _translate_result(result: dict, language: str) -> bool:
+    """Translate the text fields of a local result in place with one request."""
+    from bhashini_layer import translate_text
+
+    english = [result["disease"], result["fusion_factor"]] + list(result["treatment"])
+    translated = translate_text("\n".join(english), dest=language, src="en")
+    lines = [line.strip() for line in (translated or "").split("\n")]
+    if translated == "\n".join(english) or len(lines) != len(english):
+        print(f"[Diagnosis] Could not translate local result to '{language}', answering in English")
+        return False
+    # Same shape as the vision model: "Name in <language> (English name)"
+    result["disease"] = f"{lines[0]} ({english[0]})"
+    result["fusion_factor"] = lines[1]
+    result["treatment"] = lines[2:]
+    return True
+
+
+def _would_escalate(image: Image.Image, crop: str = None) -> bool:
+    """
+    Whether the cascade would have sent this photo to the vision model.
+
+    Used to count remote calls saved by the quality gate in cascade mode:
+    True when the local model is unavailable or below its confidence
+    threshold for the photo.
+    """
+    try:
+        local = predict_disease(image, crop=crop)
+    except Exception as e:
+        print(f"[Diagnosis] Local model failed: {e}")
+        return True
+    if local is None or local.get("is_mock"):
+        return True
+    return local["confidence"] < get_class_threshold(local["disease"])
+
+
+def diagnose_crop_image(image_bytes: bytes, language: str = "en", context_data: dict = None,
+                        weather_data: dict = None, mode: str = None, use_cache: bool = True,
+                        crop: str = None, check_quality: bool = None) -> dict:
+    """
+    Diagnose a leaf photo, preferring the on-device model.
+
+    Args:
+        image_bytes: Raw uploaded image bytes
+        language: Response language ('en' or 'gu'); local answers are translated
+        context_data: Extra context for analyze_crop_image (crop history)
+        weather_data: {temp, humidity} used for local treatment advice
+        mode: Override DIAGNOSIS_MODE ('cascade', 'local' or 'llm')
+        use_cache: Look up / store the result in the perceptual-hash cache
+        crop: Farmer's crop, selects a crop-specific local model when registered
+        check_quality: Run the photo quality gate (defaults to QUALITY_GATE_ENABLED)
+
+    Returns:
+        dict in the analyze_crop_image() format plus:
+            "source": "local" or "llm"
+            "local_prediction": predict_disease() output when the model ran
+            "urgency": weather-fused urgency (local answers only)
+            "cached": True when served from the diagnosis cache
+            "retake": True when the quality gate rejected the photo, with
+                      "retake_reasons" / "retake_messages" (no model ran)
+    """
+    mode = mode or DIAGNOSIS_MODE
+    start = time.perf_counter()
+    local = None
+
+    phash = hash_image_bytes(image_bytes) if DIAGNOSIS_CACHE_ENABLED and use_cache else None
+    if phash is not None:
+        cached = get_cached_diagnosis(phash, language)
+        if cached is not None:
+            cached["cached"] = True
+            _record_path("cache", (time.perf_counter() - start) * 1000)
+            print(f"[Diagnosis] Cache hit: {cached.get('disease')}")
+            return cached
+
+    if QUALITY_GATE_ENABLED if check_quality is None else check_quality:
+        try:
+            photo = Image.open(io.BytesIO(image_bytes))
+            quality = assess_image_quality(photo)
+        except Exception as e:
+            print(f"[Diagnosis] Quality check failed: {e}")
+            quality = {"ok": True}
+        if not quality["ok"]:
+            saved = mode == "llm" or (mode == "cascade" and _would_escalate(photo, crop))
+            with _stats_lock:
+                _QUALITY_STATS["rejected"] += 1
+                for reason in quality["reasons"]:
+                    _QUALITY_STATS[reason] += 1
+                if saved:
+                    _QUALITY_STATS["remote_calls_saved"] += 1
+            _record_path("rejected", (time.perf_counter() - start) * 1000)
+            print(f"[Diagnosis] Quality gate rejected photo: {', '.join(quality['reasons'])} "
+                  f"(sharpness {quality['sharpness']:.0f}, leaf {quality['leaf_ratio']:.0%})")
+            return _retake_result(quality)
+
+    # Crop to the leaf once; both the local model and the upload use the crop
+    roi_image = None
+    if LEAF_ROI_ENABLED:
+        roi_image, image_bytes = crop_upload_to_leaf(image_bytes)
+
+    if mode in ("cascade", "local"):
+        try:
+            local = predict_disease(roi_image or Image.open(io.BytesIO(image_bytes)), crop=crop)
+        except Exception as e:
+            print(f"[Diagnosis] Local model failed: {e}")
+
+        if local is not None and not local.get("is_mock"):
+            threshold = get_class_threshold(local["disease"])
+            if mode == "local" or local["confidence"] >= threshold:
+                result = _local_result(local, weather_data, language)
+                _record_path("local", (time.perf_counter() - start) * 1000)
+                print(f"[Diagnosis] Local: {local['disease']} ({local['confidence']:.1f}%)")
+                # An untranslated answer is not cached under a non-English key
+                if phash is not None and result["localized"]:
+                    cache_diagnosis(phash, language, result)
+                return result
+            print(f"[Diagnosis] Local confidence {local['confidence']:.1f}% < {threshold:.0f}% for "
+                  f"{local['disease']}, escalating to vision model")
+
+    result = analyze_crop_image(image_bytes, language, context_data)
+    result["source"] = "llm"
+    escalated = local is not None and not local.get("is_mock")
+    if escalated:
+        result["local_prediction"] = local
+    _record_path("escalated" if escalated else "llm", (time.perf_counter() - start) * 1000)
+    if phash is not None and not result.get("error"):
+        cache_diagnosis(phash, language, result)
+    return result
+
+
+# ============================================================
+# VIDEO / MULTI-FRAME DIAGNOSIS
+# ============================================================
+
+def iter_video_frames(video_path: str, fps: float = None, size: int = None, max_seconds: float = None):
+    """
+    Stream frames from a video file as (size, size, 3) uint8 arrays.
+
+    ffmpeg samples `fps` frames per second, centre-crops them to a square
+    (so leaves keep their aspect ratio) and scales them before they reach
+    Python, so only one small frame is in memory at a time regardless of the
+    clip length or resolution.
+
+    Raises:
+        OSError: ffmpeg is not installed
+        RuntimeError: ffmpeg could not decode the file (no frames read)
+    """
+    fps = fps or VIDEO_SAMPLE_FPS
+    size = size or VIDEO_FRAME_SIZE
+    max_seconds = max_seconds or VIDEO_MAX_SECONDS
+    cmd = [
+        "ffmpeg", "-v", "error", "-t", str(max_seconds), "-i", video_path,
+        "-vf", f"fps={fps},crop='min(iw,ih)':'min(iw,ih)',scale={size}:{size}",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"
+    ]
+    frame_bytes = size * size * 3
+    # stderr goes to a file: a pipe nobody reads could fill up and stall ffmpeg
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        frames = 0
+        try:
+            while True:
+                buf = proc.stdout.read(frame_bytes)
+                if len(buf) < frame_bytes:
+                    break
+                frames += 1
+                yield np.frombuffer(buf, dtype=np.uint8).reshape(size, size, 3)
+            returncode = proc.wait()
+        finally:
+            proc.stdout.close()
+            proc.kill()
+            proc.wait()
+
+        if returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode("utf-8", "replace").strip()[-500:]
+            print(f"[Diagnosis] ffmpeg exited with {returncode} after {frames} frames: {message}")
+            if frames == 0:
+                raise RuntimeError(f"ffmpeg could not decode the video (exit {returncode})")
+
+
+def select_sharp_frames(frames, max_frames: int = None, min_sharpness: float = None) -> list:
+    """
+    Keep the sharpest `max_frames` frames above `min_sharpness` from a frame
+    stream, using a bounded heap so memory stays at max_frames frames.
+
+    Returns a list of (sharpness, frame_index, frame) sorted by frame_index.
+    """
+    max_frames = max_frames or VIDEO_MAX_FRAMES
+    min_sharpness = VIDEO_MIN_SHARPNESS if min_sharpness is None else min_sharpness
+    heap = []
+    for index, frame in enumerate(frames):
+        sharpness = laplacian_variance(frame[::2, ::2])
+        if sharpness < min_sharpness:
+            continue
+        item = (sharpness, index, frame)
+        if len(heap) < max_frames:
+            heapq.heappush(heap, item)
+        elif sharpness > heap[0][0]:
+            heapq.heapreplace(heap, item)
+    return sorted(heap, key=lambda item: item[1])
+
+
+def _contact_sheet(frames: list, quality: int = 85) -> bytes:
+    """Place a few frames side by side in one JPEG so the LLM sees them in one call."""
+    sheet = np.concatenate(frames, axis=1)
+    output = io.BytesIO()
+    Image.fromarray(sheet).save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+def diagnose_crop_video(video, language: str = "en", context_data: dict = None,
+                        weather_data: dict = None, mode: str = None, crop: str = None) -> dict:
+    """
+    Diagnose a short field clip instead of a single still.
+
+    Frames are streamed from ffmpeg, blurry frames are dropped and the
+    sharpest ones run through the on-device model in batched invokes.
+    Per-class probabilities are averaged across frames. In cascade mode
+    the aggregated result is returned when it clears the class threshold;
+    otherwise only the most informative few frames (sharp and showing
+    the most disease evidence) are sent to analyze_crop_image as a single
+    contact sheet.
+
+    Args:
+        video: path to a video file, or raw uploaded bytes
+        language, context_data, weather_data, mode, crop: as diagnose_crop_image()
+
+    Returns:
+        dict in the diagnose_crop_image() format plus "frames_sampled",
+        "frames_used" and "frame_agreement" (share of frames whose top-1
+        matches the aggregated class). Errors carry "error_code":
+        ffmpeg_missing, unreadable_video or no_sharp_frames.
+    """
+    mode = mode or DIAGNOSIS_MODE
+    start = time.perf_counter()
+
+    temp_path = None
+    if isinstance(video, (bytes, bytearray)):
+        # mp4/mov need a seekable input (moov atom), so spool uploads to disk
+        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp:
+            tmp.write(video)
+            temp_path = tmp.name
+        video = temp_path
+
+    try:
+        sampled = 0
+
+        def counted(frames):
+            nonlocal sampled
+            for frame in frames:
+                sampled += 1
+                yield frame
+
+        selected = select_sharp_frames(counted(iter_video_frames(video)))
+    except OSError as e:
+        print(f"[Diagnosis] Cannot run ffmpeg: {e}")
+        return {"disease": "Error: Video diagnosis is not available on this server (ffmpeg is not installed).",
+                "error": True, "error_code": "ffmpeg_missing", "frames_sampled": 0, "frames_used": 0}
+    except RuntimeError:
+        return {"disease": "Error: Could not read the video. Please upload an MP4 or MOV clip.",
+                "error": True, "error_code": "unreadable_video", "frames_sampled": 0, "frames_used": 0}
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+
+    if not selected:
+        _record_path("video", (time.perf_counter() - start) * 1000)
+        return {"disease": "Error: No sharp frames found in the video. Please record again holding the phone steady.",
+                "error": True, "error_code": "no_sharp_frames", "frames_sampled": sampled, "frames_used": 0}
+
+    sharpness = np.array([item[0] for item in selected], dtype=np.float32)
+    frames = [item[2] for item in selected]
+    stats = {"frames_sampled": sampled, "frames_used": len(frames)}
+
+    probs = None
+    if mode in ("cascade", "local"):
+        probs, classes = predict_proba_batch([Image.fromarray(f) for f in frames], fast=False, crop=crop)
+
+    if probs is not None:
+        probs = probs[:, :len(classes)]
+        mean_probs = probs.mean(axis=0)
+        best = int(np.argmax(mean_probs))
+        confidence = float(mean_probs[best] * 100)
+        stats["frame_agreement"] = float(np.mean(np.argmax(probs, axis=1) == best))
+
+        order = np.argsort(-mean_probs)[:3]
+        local = {
+            "disease": classes[best],
+            "confidence": confidence,
+            "all_predictions": [(classes[i], float(mean_probs[i] * 100)) for i in order],
+            "is_mock": False
+        }
+        if mode == "local" or confidence >= get_class_threshold(local["disease"]):
+            result = _local_result(local, weather_data, language)
+            result.update(stats)
+            _record_path("video", (time.perf_counter() - start) * 1000)
+            print(f"[Diagnosis] Video local: {local['disease']} ({confidence:.1f}%, {len(frames)} frames)")
+            return result
+
+        # Informative = sharp and carrying the most non-healthy evidence
+        healthy = np.array([c.lower().endswith("healthy") for c in classes])
+        informativeness = probs[:, ~healthy].sum(axis=1) * np.sqrt(sharpness / sharpness.max())
+    else:
+        local = None
+        informativeness = sharpness
+
+    top = sorted(np.argsort(-informativeness)[:VIDEO_LLM_FRAMES])
+    sheet = _contact_sheet([frames[i] for i in top])
+    result = analyze_crop_image(sheet, language, context_data)
+    result["source"] = "llm"
+    if local is not None:
+        result["local_prediction"] = local
+    result.update(stats)
+    _record_path("video", (time.perf_counter() - start) * 1000)
+    return result
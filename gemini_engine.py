@@ -4,9 +4,15 @@ Krishi-Mitra AI - OpenRouter Engine (Universal API)
 
 This module uses OpenRouter to access various AI models including Gemini.
 Features:
-1. Robust Retry Logic for "Model Busy" errors.
+1. Latency-aware routing across models / providers (llm_router), with
+   failover, hedged requests for slow models and circuit breakers.
 2. Standard OpenAI-compatible chat completion format.
 3. Multimodal support (Vision).
+4. Pooled keep-alive HTTPS connections shared by all sessions / threads.
+5. asyncio client (httpx) with a global concurrency cap and per-request
+   deadlines; the sync functions run on it through run_sync().
+6. Streaming chat replies (OpenRouter SSE), with time to first token logged.
+7. Identical concurrent requests share one upstream call (utils.single_flight).
 
 Author: Krishi-Mitra Team
 """
@@ -14,82 +20,387 @@ Author: Krishi-Mitra Team
 import os
 import base64
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import json
+import hashlib
 import io
+import threading
+import asyncio
+import concurrent.futures
 import speech_recognition as sr
 from dotenv import load_dotenv
-from PIL import Image
+import llm_router
+from utils.chat_cache import get_cached_reply, cache_reply
+from utils import single_flight
+from PIL import Image, features
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 load_dotenv(override=True)
 
 # Configuration
 API_KEY = os.getenv("OPENROUTER_API_KEY")
-BASE_URL = "https://openrouter.ai/api/v1/chat/completions"
 
-# Using a free/reliable model on OpenRouter
+# Default model on OpenRouter. Which model serves each call (chat, vision,
+# title) is decided by llm_router from its ROUTES and live latency / errors.
 MODEL_ID = "google/gemini-2.0-flash-001"
-# Fallback models if primary fails
-FALLBACK_MODELS = [
-    "google/gemini-2.0-flash-001",
-    "google/gemini-flash-1.5",
-    "anthropic/claude-3-haiku",
-    "anthropic/claude-3.5-sonnet"
-]
+
+# HTTP client: keep-alive pool size and connect / read timeouts (seconds)
+HTTP_POOL_SIZE = int(os.getenv("OPENROUTER_POOL_SIZE", "16"))
+CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("OPENROUTER_READ_TIMEOUT", "60"))
+
+# Async client: max LLM calls in flight per process and the overall
+# deadline (seconds, retries included) for one call
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "90"))
+
+# Vision uploads: longest side sent, target payload size (before base64)
+# and encoder (jpeg or webp)
+IMAGE_MAX_SIDE = int(os.getenv("VISION_IMAGE_MAX_SIDE", "1280"))
+IMAGE_BYTE_BUDGET = int(os.getenv("VISION_IMAGE_BYTES", "200000"))
+IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "jpeg").lower()
+IMAGE_QUALITY_RANGE = (40, 90)
 
 def is_gemini_available() -> bool:
     """Check if API key is present."""
     return bool(API_KEY)
 
-def _make_api_call(messages, model=MODEL_ID, retries=5):
-    """Helper to make API calls with retry logic for 'busy' models."""
-    if not API_KEY:
-        return {"error": "API Key missing. Set OPENROUTER_API_KEY in .env"}
+# ============================================================
+# POOLED HTTP CLIENT
+# ============================================================
+# One HTTPAdapter (urllib3 pool, thread-safe) is shared by every thread;
+# each thread gets its own lightweight Session on top of it, so Streamlit
+# sessions and Flask request threads reuse warm TLS connections without
+# sharing Session state.
+
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, pool_block=False, max_retries=0)
+_local = threading.local()
+_http_lock = threading.Lock()
+_HTTP_STATS = {"calls": 0, "errors": 0, "new_connections": 0, "reused": 0,
+               "ms_new_total": 0.0, "ms_reused_total": 0.0}
+
+def get_http_session() -> requests.Session:
+    """This thread's Session, backed by the shared connection pool."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", _adapter)
+        session.mount("http://", _adapter)
+        _local.session = session
+    return session
+
+def _connections_opened() -> int:
+    """New connections the shared pool has opened so far (all hosts)."""
+    try:
+        pools = _adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+    except Exception:
+        return 0
 
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:8501", # Required by OpenRouter
-        "X-Title": "Krishi-Mitra"
-    }
-    
+def _post(url: str, **kwargs) -> requests.Response:
+    """
+    POST through the pooled client, recording whether a new connection
+    (DNS + TCP + TLS handshake) was needed and how long the call took.
+    """
+    opened = _connections_opened()
+    start = time.perf_counter()
+    try:
+        response = get_http_session().post(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+    except Exception:
+        _record_http(error=True)
+        raise
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    # Approximate under concurrency: another thread may open one meanwhile
+    new_connection = _connections_opened() > opened
+    _record_http(elapsed_ms, new_connection)
+    print(f"[OpenRouter] {response.status_code} in {elapsed_ms:.0f} ms "
+          f"(headers after {response.elapsed.total_seconds() * 1000:.0f} ms, "
+          f"{'new connection' if new_connection else 'reused connection'})")
+    return response
+
+def _record_http(elapsed_ms: float = 0.0, new_connection: bool = False, error: bool = False):
+    """Count one request on a new or reused connection (sync and httpx clients alike)."""
+    with _http_lock:
+        if error:
+            _HTTP_STATS["errors"] += 1
+            return
+        _HTTP_STATS["calls"] += 1
+        if new_connection:
+            _HTTP_STATS["new_connections"] += 1
+            _HTTP_STATS["ms_new_total"] += elapsed_ms
+        else:
+            _HTTP_STATS["reused"] += 1
+            _HTTP_STATS["ms_reused_total"] += elapsed_ms
+
+def get_http_stats() -> dict:
+    """Calls on new vs reused connections and their average latency, plus async and streaming counters."""
+    with _http_lock:
+        stats = dict(_HTTP_STATS)
+        stream = dict(_STREAM_STATS)
+    stats["ms_new_avg"] = stats["ms_new_total"] / stats["new_connections"] if stats["new_connections"] else 0.0
+    stats["ms_reused_avg"] = stats["ms_reused_total"] / stats["reused"] if stats["reused"] else 0.0
+    stats["reuse_rate"] = stats["reused"] / stats["calls"] if stats["calls"] else 0.0
+    stats["async"] = dict(_ASYNC_STATS, client="httpx" if httpx is not None else "threads",
+                          max_concurrency=LLM_MAX_CONCURRENCY)
+    stream["ttft_ms_avg"] = stream["ttft_ms_total"] / stream["streams"] if stream["streams"] else 0.0
+    stream["total_ms_avg"] = stream["total_ms_total"] / stream["streams"] if stream["streams"] else 0.0
+    stats["stream"] = stream
+    return stats
+
+def _request_parts(messages, backend):
+    """(url, headers, payload) of a chat completion request, or None if the backend has no API key."""
+    target = llm_router.request_target(backend)
+    if target is None:
+        return None
+    url, headers, model = target
     payload = {
         "model": model,
         "messages": messages,
         "temperature": 0.7
     }
+    return url, headers, payload
+
+def _request_key(call_type, model, messages) -> str:
+    """Identity of a request for single-flight coalescing (same prompt, same route)."""
+    blob = json.dumps([call_type, model, messages], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def _make_api_call(messages, model=None, retries=5, call_type="chat"):
+    """Helper to make API calls on the best backend for call_type, failing over when one is busy or slow."""
+    return run_sync(_make_api_call_async(messages, model, retries, call_type=call_type))
+
+# ============================================================
+# ASYNC CLIENT
+# ============================================================
+# Async calls all run on one background event loop (the "LLM loop") that
+# owns the httpx.AsyncClient and the concurrency semaphore, so the cap is
+# process-wide whether the caller is a coroutine on another loop or sync
+# code going through run_sync(). A slow LLM call then waits on a socket
+# instead of holding a Streamlit / Flask thread. Without httpx each
+# attempt runs on the pooled sync client in a worker thread.
+
+_llm_loop = None
+_llm_thread = None
+_llm_loop_lock = threading.Lock()
+_llm_semaphore = None
+_llm_client = None
+_ASYNC_STATS = {"calls": 0, "in_flight": 0, "peak_in_flight": 0, "deadline_exceeded": 0, "cancelled": 0}
+
+def _get_llm_loop() -> asyncio.AbstractEventLoop:
+    """Start (once) the background event loop that runs LLM calls."""
+    global _llm_loop, _llm_thread
+    with _llm_loop_lock:
+        if _llm_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="llm-loop", daemon=True)
+            thread.start()
+            _llm_loop, _llm_thread = loop, thread
+        return _llm_loop
+
+def _llm_resources():
+    """Semaphore and httpx client (None without httpx), created on the LLM loop."""
+    global _llm_semaphore, _llm_client
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        if httpx is not None:
+            _llm_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY,
+                                    max_keepalive_connections=HTTP_POOL_SIZE),
+            )
+    return _llm_semaphore, _llm_client
+
+async def _on_llm_loop(coro):
+    """Await coro on the LLM loop; cancelling the caller cancels it there too."""
+    loop = _get_llm_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+def run_sync(coro, timeout: float = None):
+    """
+    Run a coroutine from sync code (Streamlit, Flask) on the LLM loop and
+    return its result. If timeout expires the coroutine is cancelled and
+    TimeoutError is raised.
+    """
+    loop = _get_llm_loop()
+    if threading.current_thread() is _llm_thread:
+        coro.close()
+        raise RuntimeError("run_sync() called on the LLM loop; await the coroutine instead")
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"LLM call did not finish within {timeout} seconds")
 
-    for i in range(retries):
+async def _make_api_call_async(messages, model=None, retries=5, deadline: float = None, call_type="chat"):
+    """
+    Run a chat completion on the backends llm_router ranks best for
+    call_type (model, if given, is tried first), with failover and hedging
+    (see _call_with_failover), bounded by a deadline (seconds, default
+    LLM_DEADLINE) covering every attempt. Returns the completion JSON or
+    an {"error": ...} dict. Cancelling the awaiting task aborts the
+    in-flight requests.
+    """
+    deadline = LLM_DEADLINE if deadline is None else deadline
+    return await _on_llm_loop(_call_with_deadline(messages, call_type, model, retries, deadline))
+
+async def _call_with_deadline(messages, call_type, model, retries, deadline):
+    _ASYNC_STATS["calls"] += 1
+    try:
+        # Identical concurrent requests share one upstream call
+        shared = single_flight.do_async("openrouter", _request_key(call_type, model, messages),
+                                        lambda: _call_with_failover(messages, call_type, model, retries))
+        return await asyncio.wait_for(shared, deadline)
+    except asyncio.TimeoutError:
+        _ASYNC_STATS["deadline_exceeded"] += 1
+        print(f"[OpenRouter] No response within the {deadline:g}s deadline")
+        return {"error": f"No response within {deadline:g} seconds. Please try again."}
+    except asyncio.CancelledError:
+        _ASYNC_STATS["cancelled"] += 1
+        raise
+
+async def _async_post(client, url: str, **kwargs):
+    """
+    POST through the httpx client, recording the same new vs reused
+    connection stats as _post(). httpcore's trace extension reports a
+    TCP connect only when the request had to open a new connection.
+    """
+    opened = []
+
+    async def trace(event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            opened.append(True)
+
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, extensions={"trace": trace}, **kwargs)
+    except Exception:
+        _record_http(error=True)
+        raise
+    _record_http((time.perf_counter() - start) * 1000, bool(opened))
+    return response
+
+async def _attempt(messages, call_type, backend):
+    """
+    One request to one backend. Returns (response dict, retryable); busy /
+    unreachable backends are retryable (worth failing over), other API
+    errors are not.
+    """
+    semaphore, client = _llm_resources()
+    url, headers, payload = _request_parts(messages, backend)
+    # Hold a slot only while a request is in flight, not during backoff
+    async with semaphore:
+        _ASYNC_STATS["in_flight"] += 1
+        _ASYNC_STATS["peak_in_flight"] = max(_ASYNC_STATS["peak_in_flight"], _ASYNC_STATS["in_flight"])
+        start = time.perf_counter()
         try:
-            response = requests.post(BASE_URL, headers=headers, json=payload, timeout=60)
-            
-            if response.status_code == 200:
-                return response.json()
-            
-            # Handle Rate Limits (429) and Server Overload (503)
-            if response.status_code in [429, 502, 503, 504]:
-                wait_time = 2 ** (i + 1) # Exponential backoff: 2s, 4s, 8s...
-                print(f"⚠️ Model busy (Status {response.status_code}). Retrying in {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-                
-            # Other errors
-            return {"error": f"API Error {response.status_code}: {response.text}"}
-            
+            if client is None:
+                response = await asyncio.to_thread(_post, url, headers=headers, json=payload)
+            else:
+                response = await _async_post(client, url, headers=headers, json=payload)
         except Exception as e:
-            print(f"Request failed: {e}")
-            if i == retries - 1:
-                return {"error": str(e)}
-            time.sleep(2)
-            
-    return {"error": "Max retries exceeded. Models are currently too busy."}
+            print(f"Request to {backend} failed: {e}")
+            llm_router.record_result(call_type, backend, ok=False)
+            return {"error": str(e)}, True
+        finally:
+            _ASYNC_STATS["in_flight"] -= 1
+
+    if response.status_code == 200:
+        result = response.json()
+        llm_router.record_result(call_type, backend, ok=True, latency=time.perf_counter() - start,
+                                 output_tokens=(result.get("usage") or {}).get("completion_tokens"))
+        return result, False
+    if response.status_code in [429, 502, 503, 504]:
+        print(f"⚠️ Model {backend} busy (Status {response.status_code})")
+        llm_router.record_result(call_type, backend, ok=False)
+        return {"error": f"Model busy (Status {response.status_code})"}, True
+    return {"error": f"API Error {response.status_code}: {response.text}"}, False
+
+# ============================================================
+# FAILOVER & HEDGING
+# ============================================================
+# A call starts on the backend llm_router ranks best. If it has not
+# answered by that backend's HEDGE_PERCENTILE latency, the same request
+# is also sent to the next-ranked backend; the first answer wins and the
+# other request is cancelled. A backend that fails outright is failed
+# over to immediately instead of being retried after a sleep; backends
+# that keep failing are skipped by the router's circuit breaker.
+
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Hedge delay (seconds) until a backend has HEDGE_MIN_SAMPLES latencies
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "8"))
+HEDGE_MIN_SAMPLES = 20
+
+def _hedge_delay(call_type: str, backend: str) -> float:
+    delay = llm_router.latency_percentile(call_type, backend, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    return HEDGE_DEFAULT_DELAY if delay is None else delay
+
+async def _call_with_failover(messages, call_type, model, retries):
+    """
+    Run one call down the router's ranking, hedging slow requests.
+    retries bounds the total number of requests sent; after every backend
+    has failed once, the next round starts after a short backoff.
+    """
+    queue = llm_router.rank(call_type, pinned=model)
+    if not queue:
+        return {"error": "API Key missing. Set OPENROUTER_API_KEY in .env"}
+
+    pending, hedged = {}, set()
+    last_error = {"error": "Max retries exceeded. Models are currently too busy."}
+    sent, rounds = 0, 0
+    try:
+        while True:
+            if not pending:
+                if sent >= retries:
+                    return last_error
+                if not queue:
+                    rounds += 1
+                    await asyncio.sleep(2 ** rounds)
+                    queue = llm_router.rank(call_type, pinned=model)
+                current = queue.pop(0)
+                pending[asyncio.ensure_future(_attempt(messages, call_type, current))] = current
+                sent += 1
+
+            # Wait for an answer, or until the newest request is slow enough to hedge
+            can_hedge = bool(queue) and sent < retries
+            newest = list(pending.values())[-1]
+            done, _ = await asyncio.wait(pending, timeout=_hedge_delay(call_type, newest) if can_hedge else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedge = queue.pop(0)
+                print(f"[OpenRouter] {newest} slow, hedging with {hedge}")
+                llm_router.record_hedge(call_type, newest)
+                task = asyncio.ensure_future(_attempt(messages, call_type, hedge))
+                pending[task] = hedge
+                hedged.add(task)
+                sent += 1
+                continue
+
+            for task in done:
+                winner = pending.pop(task)
+                result, retryable = task.result()
+                if "error" not in result or not retryable:
+                    if "error" not in result and task in hedged:
+                        llm_router.record_hedge(call_type, winner, won=True)
+                    return result
+                last_error = result
+    finally:
+        for task in pending:
+            task.cancel()
 
 # ============================================================
 # AI CHAT & EXPERT CALCULATOR
 # ============================================================
 
-def chat_with_krishi_mitra(user_message: str, language: str = "en", context_data: dict = None) -> str:
-    """Chat with Krishi-Mitra AI using OpenRouter."""
+def _chat_messages(user_message: str, language: str, context_data: dict) -> list:
+    """System prompt (with farm / regional context) and user turn for a chat call."""
 
     system_prompt = f"""You are Krishi-Mitra AI (કૃષિ-મિત્ર), the comprehensive agricultural expert for Gujarat, India.
 Rules:
@@ -125,13 +436,12 @@ Rules:
             system_prompt += reg_str
             system_prompt += "\nCompare user's questions with this regional data. Mention if a disease is 'locally common' or 'spreading in their area' vs 'something new'."
 
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_message}
     ]
 
-    response = _make_api_call(messages)
-    
+def _chat_reply(response: dict) -> str:
     if "error" in response:
         return f"❌ {response['error']}"
     
@@ -140,31 +450,257 @@ Rules:
     except (KeyError, IndexError):
         return "⚠️ Invalid response from AI provider."
 
+async def chat_with_krishi_mitra_async(user_message: str, language: str = "en", context_data: dict = None,
+                                       deadline: float = None) -> str:
+    """
+    Chat with Krishi-Mitra AI using OpenRouter (async, bounded by deadline).
+    Repeated questions are answered from the shared chat response cache.
+    """
+    cached = await asyncio.to_thread(get_cached_reply, user_message, language, context_data)
+    if cached is not None:
+        print("[Chat Cache] Hit")
+        return cached
+    messages = _chat_messages(user_message, language, context_data)
+    response = await _make_api_call_async(messages, deadline=deadline)
+    reply = _chat_reply(response)
+    if "error" not in response and "choices" in response:
+        await asyncio.to_thread(cache_reply, user_message, language, context_data, reply)
+    return reply
+
+def chat_with_krishi_mitra(user_message: str, language: str = "en", context_data: dict = None) -> str:
+    """Chat with Krishi-Mitra AI using OpenRouter."""
+    return run_sync(chat_with_krishi_mitra_async(user_message, language, context_data))
+
+# ============================================================
+# STREAMING CHAT
+# ============================================================
+# OpenRouter streams completions as server-sent events:
+#   data: {"choices": [{"delta": {"content": "..."}}]}
+#   : OPENROUTER PROCESSING      (keep-alive comment)
+#   data: [DONE]
+# Time to first token is what the farmer feels, so it is tracked apart
+# from total time.
+
+_STREAM_STATS = {"streams": 0, "errors": 0, "ttft_ms_total": 0.0, "total_ms_total": 0.0}
+
+def _stream_api_call(messages, model=None, retries=5, call_type="chat"):
+    """
+    Streaming _make_api_call(): yields content deltas as they arrive.
+    Until the stream starts, busy / unreachable backends are failed over
+    in the router's order like _call_with_failover() (no hedging); errors
+    are yielded as a single "❌ ..." chunk.
+    """
+    queue, rounds = llm_router.rank(call_type, pinned=model), 0
+    if not queue:
+        yield "❌ API Key missing. Set OPENROUTER_API_KEY in .env"
+        return
+
+    start = time.perf_counter()
+    response, error = None, "Max retries exceeded. Models are currently too busy."
+    for _ in range(retries):
+        if not queue:
+            rounds += 1
+            time.sleep(2 ** rounds)
+            queue = llm_router.rank(call_type, pinned=model)
+        current = queue.pop(0)
+        url, headers, payload = _request_parts(messages, current)
+        payload["stream"] = True
+        try:
+            response = _post(url, headers=headers, json=payload, stream=True)
+        except Exception as e:
+            print(f"Request to {current} failed: {e}")
+            llm_router.record_result(call_type, current, ok=False)
+            response, error = None, str(e)
+            continue
+        if response.status_code == 200:
+            # Headers-only latency would skew the hedge percentiles; record health only
+            llm_router.record_result(call_type, current, ok=True)
+            break
+        if response.status_code in [429, 502, 503, 504]:
+            print(f"⚠️ Model {current} busy (Status {response.status_code})")
+            llm_router.record_result(call_type, current, ok=False)
+            error = f"Model busy (Status {response.status_code})"
+            response.close()
+            response = None
+            continue
+        error = f"API Error {response.status_code}: {response.text}"
+        response = None
+        break
+
+    if response is None:
+        _record_stream(error=True)
+        yield f"❌ {error}"
+        return
+
+    ttft_ms, chunks = None, 0
+    try:
+        for raw in response.iter_lines():
+            # SSE is UTF-8; requests would guess Latin-1 for text/event-stream
+            line = raw.decode("utf-8", errors="replace")
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            if "error" in event:
+                _record_stream(error=True)
+                yield f"❌ {event['error'].get('message', event['error'])}"
+                return
+            choices = event.get("choices") or [{}]
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                    print(f"[OpenRouter] First token after {ttft_ms:.0f} ms")
+                chunks += 1
+                yield content
+    finally:
+        response.close()
+
+    total_ms = (time.perf_counter() - start) * 1000
+    ttft_ms = total_ms if ttft_ms is None else ttft_ms
+    print(f"[OpenRouter] Stream finished: {chunks} chunks in {total_ms:.0f} ms (first token {ttft_ms:.0f} ms)")
+    _record_stream(ttft_ms=ttft_ms, total_ms=total_ms)
+
+def _record_stream(error: bool = False, ttft_ms: float = 0.0, total_ms: float = 0.0):
+    with _http_lock:
+        if error:
+            _STREAM_STATS["errors"] += 1
+            return
+        _STREAM_STATS["streams"] += 1
+        _STREAM_STATS["ttft_ms_total"] += ttft_ms
+        _STREAM_STATS["total_ms_total"] += total_ms
+
+def stream_chat_with_krishi_mitra(user_message: str, language: str = "en", context_data: dict = None):
+    """
+    Chat with Krishi-Mitra AI, yielding the reply in chunks as it is
+    generated (for st.write_stream and the /api/chat event stream).
+    Cached replies are yielded whole; complete new replies are cached.
+    """
+    cached = get_cached_reply(user_message, language, context_data)
+    if cached is not None:
+        print("[Chat Cache] Hit")
+        yield cached
+        return
+    messages = _chat_messages(user_message, language, context_data)
+    chunks = []
+    key = _request_key("chat", None, messages)
+    for chunk in single_flight.stream("openrouter_stream", key, lambda: _stream_api_call(messages)):
+        chunks.append(chunk)
+        yield chunk
+    # Errors arrive as a "❌ ..." chunk; those replies are not cached
+    if chunks and not any(chunk.startswith("❌") for chunk in chunks):
+        cache_reply(user_message, language, context_data, "".join(chunks))
+
 
 # ============================================================
 # ADVANCED IMAGE ANALYSIS
 # ============================================================
 
-def analyze_crop_image(image_bytes: bytes, language: str = "en", context_data: dict = None) -> dict:
-    """Analyze crop pathology using OpenRouter Vision.
-    Now with automatic image conversion to JPEG for better compatibility."""
+_encode_lock = threading.Lock()
+_ENCODE_STATS = {"calls": 0, "skipped": 0, "bytes_in": 0, "bytes_out": 0, "ms_total": 0.0}
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    output = io.BytesIO()
+    if fmt == "webp":
+        img.save(output, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+def encode_image_for_vision(image_bytes: bytes, max_side: int = None, byte_budget: int = None, fmt: str = None):
+    """
+    Re-encode an upload for the vision model within a byte budget.
+
+    - Small JPEGs (within max_side and byte_budget) are sent untouched.
+    - Otherwise the image is scaled so its longest side is at most
+      max_side and the highest quality that fits byte_budget is found by
+      binary search; if even the lowest quality does not fit, the image
+      is shrunk further.
+
+    Returns (image_bytes, mime_type, info) where info has
+    bytes_in, bytes_out, encode_ms, quality, size and skipped.
+    """
+    max_side = max_side or IMAGE_MAX_SIDE
+    byte_budget = byte_budget or IMAGE_BYTE_BUDGET
+    fmt = fmt or IMAGE_FORMAT
+    if fmt == "webp" and not features.check("webp"):
+        fmt = "jpeg"
+    start = time.perf_counter()
+
+    img = Image.open(io.BytesIO(image_bytes))
+    info = {"bytes_in": len(image_bytes), "skipped": False, "quality": None}
+    if img.format == "JPEG" and len(image_bytes) <= byte_budget and max(img.size) <= max_side:
+        info.update(bytes_out=len(image_bytes), size=img.size, skipped=True,
+                    encode_ms=(time.perf_counter() - start) * 1000)
+        _record_encode(info)
+        return image_bytes, "image/jpeg", info
+
+    if img.format == "JPEG":
+        img.draft("RGB", (max_side, max_side))
+    img = img.convert("RGB")
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    low_q, high_q = IMAGE_QUALITY_RANGE
+    while True:
+        best = None
+        low, high = low_q, high_q
+        while low <= high:
+            quality = (low + high) // 2
+            data = _encode(img, fmt, quality)
+            if len(data) <= byte_budget:
+                best, info["quality"] = data, quality
+                low = quality + 1
+            else:
+                high = quality - 1
+        if best is not None or max(img.size) <= 320:
+            break
+        img = img.resize((int(img.size[0] * 0.75), int(img.size[1] * 0.75)), Image.LANCZOS)
+
+    if best is None:
+        best, info["quality"] = _encode(img, fmt, low_q), low_q
+    info.update(bytes_out=len(best), size=img.size, encode_ms=(time.perf_counter() - start) * 1000)
+    _record_encode(info)
+    return best, f"image/{fmt}", info
+
+def _record_encode(info: dict):
+    with _encode_lock:
+        _ENCODE_STATS["calls"] += 1
+        _ENCODE_STATS["skipped"] += int(info["skipped"])
+        _ENCODE_STATS["bytes_in"] += info["bytes_in"]
+        _ENCODE_STATS["bytes_out"] += info["bytes_out"]
+        _ENCODE_STATS["ms_total"] += info["encode_ms"]
+
+def get_image_encode_stats() -> dict:
+    """Totals for encode_image_for_vision(): calls, bytes in/out and encode time."""
+    with _encode_lock:
+        stats = dict(_ENCODE_STATS)
+    stats["ms_avg"] = stats["ms_total"] / stats["calls"] if stats["calls"] else 0.0
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+    return stats
+
+def _image_messages(image_bytes: bytes, language: str, context_data: dict) -> list:
+    """Vision request: re-encoded image plus the structured-analysis prompt."""
+    # Size-targeted JPEG/WebP for a fast upload on slow links
+    mime_type = "image/jpeg"
     try:
-        # Convert all images to JPEG for maximum API compatibility
-        try:
-            img = Image.open(io.BytesIO(image_bytes))
-            img = img.convert('RGB')  # Ensure RGB mode for JPEG compatibility
-            output = io.BytesIO()
-            img.save(output, format='JPEG', quality=85)
-            image_bytes = output.getvalue()
-            print(f"✅ Converted image to JPEG: {len(image_bytes)} bytes")
-        except Exception as conv_err:
-            print(f"⚠️ Image conversion warning: {conv_err}")
-        
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
-        mime_type = "image/jpeg"  # Always use JPEG after conversion
-        
-        # More robust prompt to avoid false negatives (classifying diseased as healthy)
-        prompt = f"""You are a Master Agri-Scientist in Gujarat. Your task is to meticulously analyze this crop image for any signs of disease, stress, or pests.
+        image_bytes, mime_type, enc = encode_image_for_vision(image_bytes)
+        if enc["skipped"]:
+            print(f"✅ Image already a small JPEG: {enc['bytes_out']} bytes (not re-encoded)")
+        else:
+            print(f"✅ Encoded image {enc['size'][0]}x{enc['size'][1]} q{enc['quality']}: "
+                  f"{enc['bytes_in']} -> {enc['bytes_out']} bytes in {enc['encode_ms']:.0f} ms")
+    except Exception as conv_err:
+        print(f"⚠️ Image conversion warning: {conv_err}")
+    
+    base64_image = base64.b64encode(image_bytes).decode('utf-8')
+    
+    # More robust prompt to avoid false negatives (classifying diseased as healthy)
+    prompt = f"""You are a Master Agri-Scientist in Gujarat. Your task is to meticulously analyze this crop image for any signs of disease, stress, or pests.
 
 **Actionable Analysis Required:**
 If you find a disease, you MUST include in the TREATMENT section:
@@ -187,63 +723,75 @@ PREVENTION:
 
 **Important:** Do not classify as "Healthy" if there is any doubt. Using 💡 and ⚠️ icons is encouraged.
 Respond in: {"Gujarati" if language == "gu" else "English"}."""
-        
-        if context_data:
-             history = context_data.get('crop_history')
-             if history:
-                hist_str = "\n\nFARMER'S CROP HISTORY:\n"
-                for h in history[-3:]:
-                    hist_str += f"- Crop: {h.get('crop')}, Past Disease: {h.get('disease')}, Pesticides: {h.get('pesticide')}, Unusual: {h.get('unusual')}\n"
-                prompt += hist_str
-                
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}}
-                ]
-            }
-        ]
-        
-        # Log the request
-        print(f"📤 Sending image analysis request to Claude... ({len(image_bytes)} bytes as JPEG)")
-        
-        response = _make_api_call(messages, model=MODEL_ID)
-        
-        if "error" in response:
-            return {"disease": f"Error: {response['error']}", "error": True}
+    
+    if context_data:
+         history = context_data.get('crop_history')
+         if history:
+            hist_str = "\n\nFARMER'S CROP HISTORY:\n"
+            for h in history[-3:]:
+                hist_str += f"- Crop: {h.get('crop')}, Past Disease: {h.get('disease')}, Pesticides: {h.get('pesticide')}, Unusual: {h.get('unusual')}\n"
+            prompt += hist_str
+            
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}}
+            ]
+        }
+    ]
+    
+    # Log the request
+    print(f"📤 Sending image analysis request... ({len(image_bytes)} bytes as {mime_type})")
+    return messages
 
-        text = response['choices'][0]['message']['content']
-        result = {"disease": "Unknown", "confidence": "Medium", "severity": "Medium", "chlorophyll": "Optimal", "treatment": [], "prevention": "", "error": False}
-        
-        for line in text.split('\n'):
-            line = line.strip()
-            if line.upper().startswith("DISEASE:"): 
-                result["disease"] = line.split(":", 1)[1].strip()
-            elif line.upper().startswith("CONFIDENCE:") or line.upper().startswith("CONFIDENCE LEVEL:"): 
-                result["confidence"] = line.split(":", 1)[1].strip()
-            elif line.upper().startswith("SEVERITY:"): 
-                result["severity"] = line.split(":", 1)[1].strip()
-            elif line.upper().startswith("CHLOROPHYLL:"): 
-                result["chlorophyll"] = line.split(":", 1)[1].strip()
-            elif line.startswith("- "): 
-                result["treatment"].append(line[2:])
-            elif line.upper().startswith("PREVENTION:"): 
-                result["prevention"] = line.split(":", 1)[1].strip()
-        
-        # If no structured data found, try to parse the whole response
-        if result["disease"] == "Unknown" and len(text) > 10:
-            result["disease"] = text
-            result["treatment"] = ["See full analysis in response"]
-        
-        print(f"✅ Image analysis complete: {result['disease']}")
-        return result
+def _parse_image_analysis(response: dict) -> dict:
+    if "error" in response:
+        return {"disease": f"Error: {response['error']}", "error": True}
+
+    text = response['choices'][0]['message']['content']
+    result = {"disease": "Unknown", "confidence": "Medium", "severity": "Medium", "chlorophyll": "Optimal", "treatment": [], "prevention": "", "error": False}
+    
+    for line in text.split('\n'):
+        line = line.strip()
+        if line.upper().startswith("DISEASE:"): 
+            result["disease"] = line.split(":", 1)[1].strip()
+        elif line.upper().startswith("CONFIDENCE:") or line.upper().startswith("CONFIDENCE LEVEL:"): 
+            result["confidence"] = line.split(":", 1)[1].strip()
+        elif line.upper().startswith("SEVERITY:"): 
+            result["severity"] = line.split(":", 1)[1].strip()
+        elif line.upper().startswith("CHLOROPHYLL:"): 
+            result["chlorophyll"] = line.split(":", 1)[1].strip()
+        elif line.startswith("- "): 
+            result["treatment"].append(line[2:])
+        elif line.upper().startswith("PREVENTION:"): 
+            result["prevention"] = line.split(":", 1)[1].strip()
+    
+    # If no structured data found, try to parse the whole response
+    if result["disease"] == "Unknown" and len(text) > 10:
+        result["disease"] = text
+        result["treatment"] = ["See full analysis in response"]
+    
+    print(f"✅ Image analysis complete: {result['disease']}")
+    return result
 
+async def analyze_crop_image_async(image_bytes: bytes, language: str = "en", context_data: dict = None,
+                                   deadline: float = None) -> dict:
+    """Analyze crop pathology using OpenRouter Vision (async, bounded by deadline).
+    The image is downscaled / re-encoded to fit IMAGE_BYTE_BUDGET first."""
+    try:
+        messages = await asyncio.to_thread(_image_messages, image_bytes, language, context_data)
+        return _parse_image_analysis(await _make_api_call_async(messages, deadline=deadline, call_type="vision"))
     except Exception as e:
         print(f"❌ Image analysis error: {e}")
         return {"disease": f"Error: {str(e)}", "error": True}
 
+def analyze_crop_image(image_bytes: bytes, language: str = "en", context_data: dict = None) -> dict:
+    """Analyze crop pathology using OpenRouter Vision.
+    The image is downscaled / re-encoded to fit IMAGE_BYTE_BUDGET first."""
+    return run_sync(analyze_crop_image_async(image_bytes, language, context_data))
+
 
 # ============================================================
 # AUDIO TRANSCRIPTION
@@ -313,21 +861,70 @@ Title:"""
             {"role": "user", "content": prompt}
         ]
         
-        response = _make_api_call(messages, model=MODEL_ID)
+        response = _make_api_call(messages, call_type="title")
         
         if "error" not in response:
             title = response['choices'][0]['message']['content'].strip()
-            # Clean up the title
-            title = title.replace('"', '').replace("'", '').strip()
-            return title[:50]
-        
+            return _clean_title(title)
+
     except Exception as e:
         print(f"[Gemini] Error generating title: {e}")
-    
+
     # Fallback to first 50 chars
     return message[:50].strip()
 
 
+def _clean_title(title: str) -> str:
+    return str(title).replace('"', '').replace("'", '').strip()[:50]
+
+
+def generate_titles_from_messages(items: list) -> list:
+    """
+    Generate chat titles for several first messages with one AI call.
+
+    Args:
+        items: List of (message, language) tuples
+
+    Returns:
+        list: One title per item, in order; None where no usable title came
+              back (every entry is None if the call failed), so the
+              caller can retry instead of storing a fallback
+    """
+    if not items:
+        return []
+    chats = "\n".join(
+        f'{i}. ({"Gujarati" if language == "gu" else "English"}) "{message[:500]}"'
+        for i, (message, language) in enumerate(items, 1))
+    prompt = f"""Generate a very short, concise title (maximum 5 words) for each chat below, from the message it starts with.
+
+Rules:
+1. Maximum 5 words per title
+2. Capture the main topic/question
+3. No quotes or punctuation
+4. Write each title in the language shown for its chat
+5. Respond with only a JSON array of {len(items)} titles, in the same order
+
+Chats:
+{chats}"""
+
+    try:
+        response = _make_api_call([{"role": "user", "content": prompt}], call_type="title")
+        if "error" in response:
+            print(f"[Gemini] Error generating titles: {response['error']}")
+            return [None] * len(items)
+        text = response['choices'][0]['message']['content']
+        start, end = text.find("["), text.rfind("]")
+        titles = json.loads(text[start:end + 1]) if 0 <= start < end else None
+        if not isinstance(titles, list) or len(titles) != len(items):
+            print(f"[Gemini] Expected {len(items)} titles, got: {text[:200]}")
+            return [None] * len(items)
+        return [(_clean_title(t) or None) if isinstance(t, str) else None for t in titles]
+
+    except Exception as e:
+        print(f"[Gemini] Error generating titles: {e}")
+        return [None] * len(items)
+
+
 def get_ai_fusion_advice(disease: str, weather_data: dict, language: str = "en") -> dict:
     """Combines disease and weather for treatment timing."""
     msg = f"Give advice for {disease}. Current Weather: {weather_data}. Calculate risk based on humidity/temp."
@@ -0,0 +1,311 @@
+"""
+Krishi-Mitra AI - LLM Router
+============================
+Chooses the backend (provider + model) for every LLM call made by
+gemini_engine, per call type (chat, vision, title).
+
+Each backend in a call type's route is scored from exponentially weighted
+moving averages (EWMA) of its latency, error rate and output throughput
+for that call type; calls go to the lowest score among healthy backends
+and fail over / hedge down the ranking. A per-backend circuit breaker
+takes a backend out of every route after repeated failures.
+
+Backends are "provider:model" strings ("openrouter" when the provider is
+omitted). Providers are OpenAI-compatible chat completion endpoints:
+OpenRouter is built in, more can be added with LLM_PROVIDERS, e.g.
+
+    LLM_PROVIDERS='{"groq": {"url": "https://api.groq.com/openai/v1/chat/completions",
+                             "key_env": "GROQ_API_KEY"}}'
+    LLM_ROUTE_TITLE="groq:llama-3.1-8b-instant,google/gemini-2.0-flash-001"
+
+Author: Krishi-Mitra Team
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# ============================================================
+# PROVIDERS & ROUTES
+# ============================================================
+
+PROVIDERS = {
+    "openrouter": {
+        "url": "https://openrouter.ai/api/v1/chat/completions",
+        "key_env": "OPENROUTER_API_KEY",
+        "headers": {"HTTP-Referer": "http://localhost:8501", "X-Title": "Krishi-Mitra"},  # Required by OpenRouter
+    },
+}
+try:
+    PROVIDERS.update(json.loads(os.getenv("LLM_PROVIDERS", "{}")))
+except ValueError as e:
+    print(f"[LLM Router] Ignoring invalid LLM_PROVIDERS: {e}")
+
+# Candidate backends per call type, in preference order (used to break ties
+# until there are measurements). Vision routes only list multimodal models.
+DEFAULT_ROUTES = {
+    "chat": [
+        "google/gemini-2.0-flash-001",
+        "google/gemini-flash-1.5",
+        "anthropic/claude-3-haiku",
+        "openai/gpt-4o-mini",
+        "anthropic/claude-3.5-sonnet",
+    ],
+    "vision": [
+        "google/gemini-2.0-flash-001",
+        "google/gemini-flash-1.5",
+        "anthropic/claude-3-haiku",
+        "openai/gpt-4o-mini",
+        "anthropic/claude-3.5-sonnet",
+    ],
+    "title": [
+        "google/gemini-2.0-flash-001",
+        "anthropic/claude-3-haiku",
+        "openai/gpt-4o-mini",
+        "mistralai/mistral-7b-instruct",
+    ],
+}
+ROUTES = {
+    call_type: [b.strip() for b in os.getenv(f"LLM_ROUTE_{call_type.upper()}", "").split(",") if b.strip()] or backends
+    for call_type, backends in DEFAULT_ROUTES.items()
+}
+
+# Scoring: EWMA weight of the newest sample, latency assumed for backends
+# without measurements (seconds), and how much a 100% error rate
+# multiplies the latency score by (1 + penalty)
+EWMA_ALPHA = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", "0.2"))
+PRIOR_LATENCY = float(os.getenv("LLM_ROUTER_PRIOR_LATENCY", "5"))
+ERROR_PENALTY = float(os.getenv("LLM_ROUTER_ERROR_PENALTY", "4"))
+# Share of calls sent to a random healthy backend so scores stay fresh
+EXPLORE_RATE = float(os.getenv("LLM_ROUTER_EXPLORE", "0.05"))
+
+# Circuit breaker: consecutive failures before a backend is skipped, and
+# for how long (seconds) before it is half-open: one ranking at a time then
+# includes it as a probe, and the probe's result closes or reopens it
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "60"))
+
+# Log every routing decision (also available in get_router_stats())
+ROUTER_DEBUG = os.getenv("LLM_ROUTER_DEBUG", "0") == "1"
+
+_lock = threading.Lock()
+_STATS = {}      # (call_type, backend) -> EWMA record
+_BREAKERS = {}   # backend -> circuit breaker state
+_CHOICES = {}    # call_type -> {backend: times ranked first}
+_OUTPUT_TOKENS = {}  # call_type -> EWMA of completion tokens per call, all backends
+
+
+def parse_backend(backend: str) -> Tuple[str, str]:
+    """'provider:model' -> (provider, model); bare model names are OpenRouter."""
+    provider, sep, model = backend.partition(":")
+    if sep and provider in PROVIDERS:
+        return provider, model
+    return "openrouter", backend
+
+
+def request_target(backend: str) -> Optional[Tuple[str, Dict, str]]:
+    """
+    (url, headers, model) for a backend, or None if its provider has no API key.
+    """
+    provider, model = parse_backend(backend)
+    config = PROVIDERS[provider]
+    api_key = os.getenv(config.get("key_env", ""))
+    if not api_key:
+        return None
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    headers.update(config.get("headers", {}))
+    return config["url"], headers, model
+
+
+# ============================================================
+# MEASUREMENTS
+# ============================================================
+
+def _record(call_type: str, backend: str) -> Dict:
+    """EWMA record of a backend for one call type (caller holds _lock)."""
+    key = (call_type, backend)
+    if key not in _STATS:
+        _STATS[key] = {"calls": 0, "errors": 0, "latency_ewma": None, "error_ewma": 0.0,
+                       "tokens_per_s_ewma": None, "latencies": deque(maxlen=200),
+                       "hedges": 0, "hedge_wins": 0}
+    return _STATS[key]
+
+
+def _breaker(backend: str) -> Dict:
+    if backend not in _BREAKERS:
+        _BREAKERS[backend] = {"consecutive_failures": 0, "open_until": 0.0, "probe_until": 0.0}
+    return _BREAKERS[backend]
+
+
+def _breaker_state(breaker: Dict, now: float) -> str:
+    """closed, open, or half_open (cooldown over, not closed by a success yet)."""
+    if breaker["consecutive_failures"] < BREAKER_FAILURES:
+        return "closed"
+    return "open" if breaker["open_until"] > now else "half_open"
+
+
+def _ewma(old: Optional[float], sample: float) -> float:
+    return sample if old is None else (1 - EWMA_ALPHA) * old + EWMA_ALPHA * sample
+
+
+def record_result(call_type: str, backend: str, ok: bool, latency: float = None, output_tokens: int = None):
+    """
+    Record one finished request.
+
+    Args:
+        call_type: Route the call was made for (chat, vision, title)
+        backend: "provider:model" that served it
+        ok: False for errors, busy responses and timeouts
+        latency: Seconds to the complete response (None if not comparable,
+                 e.g. streamed responses)
+        output_tokens: usage.completion_tokens, for throughput
+    """
+    with _lock:
+        stats = _record(call_type, backend)
+        breaker = _breaker(backend)
+        stats["calls"] += 1
+        stats["error_ewma"] = _ewma(stats["error_ewma"], 0.0 if ok else 1.0)
+        breaker["probe_until"] = 0.0
+        if ok:
+            breaker["consecutive_failures"] = 0
+            breaker["open_until"] = 0.0
+            if latency is not None:
+                stats["latency_ewma"] = _ewma(stats["latency_ewma"], latency)
+                stats["latencies"].append(latency)
+                if output_tokens:
+                    stats["tokens_per_s_ewma"] = _ewma(stats["tokens_per_s_ewma"], output_tokens / max(latency, 1e-3))
+                    _OUTPUT_TOKENS[call_type] = _ewma(_OUTPUT_TOKENS.get(call_type), output_tokens)
+            return
+        stats["errors"] += 1
+        breaker["consecutive_failures"] += 1
+        # A failed half-open probe reopens the circuit straight away
+        if breaker["consecutive_failures"] >= BREAKER_FAILURES:
+            breaker["open_until"] = time.time() + BREAKER_COOLDOWN
+            print(f"[LLM Router] Circuit open for {backend}: skipped for {BREAKER_COOLDOWN:g}s")
+
+
+def record_hedge(call_type: str, backend: str, won: bool = False):
+    """Count a hedge fired because backend was slow, or a hedge that backend won."""
+    with _lock:
+        _record(call_type, backend)["hedge_wins" if won else "hedges"] += 1
+
+
+def _percentile(values, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def latency_percentile(call_type: str, backend: str, pct: float, min_samples: int) -> Optional[float]:
+    """pct-th percentile of recent latencies, or None with fewer than min_samples."""
+    with _lock:
+        latencies = list(_record(call_type, backend)["latencies"])
+    if len(latencies) < min_samples:
+        return None
+    return _percentile(latencies, pct)
+
+
+# ============================================================
+# ROUTING
+# ============================================================
+
+def _score(call_type: str, stats: Dict, position: int) -> float:
+    """
+    Expected seconds per successful call; lower is better (caller holds _lock).
+
+    With throughput measured, latency is the time this backend needs for a
+    typical-length answer of this call type, so a backend is not rewarded
+    for giving shorter answers or penalised for longer ones.
+    """
+    latency = stats["latency_ewma"] if stats["latency_ewma"] is not None else PRIOR_LATENCY
+    if stats["tokens_per_s_ewma"] and _OUTPUT_TOKENS.get(call_type):
+        latency = _OUTPUT_TOKENS[call_type] / stats["tokens_per_s_ewma"]
+    # position keeps configured order among backends without measurements
+    return latency * (1 + ERROR_PENALTY * stats["error_ewma"]) + position * 1e-3
+
+
+def rank(call_type: str, pinned: str = None) -> List[str]:
+    """
+    Configured, healthy backends for a call type, best first.
+
+    pinned (a backend or bare model) goes first regardless of score. A
+    half-open backend is included in one ranking as a probe until its result
+    comes back (or the probe claim lapses after BREAKER_COOLDOWN). If every
+    backend's circuit is open the best one is still returned, so a call is
+    always attempted.
+    """
+    route = list(ROUTES.get(call_type) or ROUTES["chat"])
+    if pinned:
+        route = [pinned] + [b for b in route if parse_backend(b) != parse_backend(pinned)]
+    route = [b for b in route if request_target(b) is not None]
+    if not route:
+        return []
+
+    now = time.time()
+    with _lock:
+        scored = []
+        for i, b in enumerate(route):
+            breaker = _breaker(b)
+            state = _breaker_state(breaker, now)
+            if state == "half_open":
+                if breaker["probe_until"] > now:
+                    state = "open"  # another call is already probing it
+                else:
+                    breaker["probe_until"] = now + BREAKER_COOLDOWN
+            scored.append((_score(call_type, _record(call_type, b), i), b, state == "open"))
+    healthy = sorted((s, b) for s, b, is_open in scored if not is_open)
+    ranked = [b for _, b in healthy] or [min(scored)[1]]
+
+    if pinned and pinned in ranked:
+        ranked.remove(pinned)
+        ranked.insert(0, pinned)
+    elif len(ranked) > 1 and random.random() < EXPLORE_RATE:
+        ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+
+    with _lock:
+        choices = _CHOICES.setdefault(call_type, {})
+        choices[ranked[0]] = choices.get(ranked[0], 0) + 1
+    if ROUTER_DEBUG:
+        print(f"[LLM Router] {call_type} -> {ranked[0]} (then {', '.join(ranked[1:3]) or 'none'})")
+    return ranked
+
+
+def get_router_stats() -> Dict:
+    """
+    Per call type: every routed backend with its score, EWMA latency /
+    error rate / throughput, circuit state (closed / open / half_open) and
+    how often it was chosen.
+    """
+    now = time.time()
+    report = {}
+    with _lock:
+        for call_type, route in ROUTES.items():
+            rows = []
+            for i, backend in enumerate(route):
+                stats = _record(call_type, backend)
+                breaker = _breaker(backend)
+                rows.append({
+                    "backend": backend,
+                    "configured": request_target(backend) is not None,
+                    "score": round(_score(call_type, stats, i), 3),
+                    "latency_ewma_s": stats["latency_ewma"],
+                    "latency_p95_s": _percentile(list(stats["latencies"]), 95),
+                    "error_rate_ewma": round(stats["error_ewma"], 3),
+                    "tokens_per_s_ewma": stats["tokens_per_s_ewma"],
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "hedges": stats["hedges"],
+                    "hedge_wins": stats["hedge_wins"],
+                    "circuit": _breaker_state(breaker, now),
+                    "circuit_open": breaker["open_until"] > now,
+                    "open_for_s": max(0.0, breaker["open_until"] - now),
+                    "chosen": _CHOICES.get(call_type, {}).get(backend, 0),
+                })
+            rows.sort(key=lambda r: (r["circuit_open"], not r["configured"], r["score"]))
+            report[call_type] = rows
+    return report
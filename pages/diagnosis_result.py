@@ -10,24 +10,59 @@ def show():
 
     with col_img:
         st.markdown("### 🖼️ AI Analysis Preview", unsafe_allow_html=True)
-        st.markdown("""
-            <div class="agri-card" style="height: 480px; position: relative; background: #000; overflow: hidden; display: flex; align-items: center; justify-content: center;">
-                <div style="width: 100%; height: 100%; position: absolute; opacity: 0.3;">
-                    <!-- Simple SVG Leaf Placeholder -->
-                    <svg viewBox="0 0 200 200" xmlns="http://www.w3.org/2000/svg" style="width: 100%; height: 100%;">
-                        <path fill="#2ecc71" d="M100 20C60 20 20 80 20 120C20 160 100 180 180 120C180 80 140 20 100 20Z" />
-                        <path fill="#27ae60" d="M100 20L100 180M100 60L140 80M100 100L160 120M100 140L140 160M100 60L60 80M100 100L40 120M100 140L60 160" stroke="#fff" stroke-width="2"/>
-                    </svg>
+        localization = st.session_state.get('localization')
+        uploaded = st.session_state.get('uploaded_image')
+        if localization and localization.get("boxes") and uploaded is not None:
+            # Real lesion boxes from ai_engine.localize_disease (original pixel coords)
+            import base64
+            uploaded.seek(0)
+            img_bytes = uploaded.read()
+            uploaded.seek(0)
+            b64_img = base64.b64encode(img_bytes).decode()
+            mime = getattr(uploaded, "type", None)
+            if not mime:
+                import io
+                from PIL import Image
+                mime = Image.MIME.get(Image.open(io.BytesIO(img_bytes)).format, "image/jpeg")
+            img_w, img_h = localization["image_size"]
+            boxes_html = ""
+            for b in localization["boxes"]:
+                x0, y0, x1, y1 = b["box"]
+                label = b["disease"].replace("___", " - ").replace("_", " ").upper()
+                boxes_html += f"""
+                <div style="position: absolute; border: 3px solid #f39c12; border-radius: 4px; left: {x0 / img_w * 100:.1f}%; top: {y0 / img_h * 100:.1f}%; width: {(x1 - x0) / img_w * 100:.1f}%; height: {(y1 - y0) / img_h * 100:.1f}%; box-shadow: 0 0 10px #f39c12;">
+                    <div style="background: #f39c12; color: black; font-size: 0.7rem; font-weight: bold; position: absolute; top: -20px; left: -3px; padding: 2px 8px; border-radius: 2px; white-space: nowrap;">
+                        {label} ({b["score"] * 100:.1f}%)
+                    </div>
+                </div>"""
+            st.markdown(f"""
+                <div class="agri-card" style="position: relative; background: #000; overflow: hidden; padding: 0;">
+                    <div style="position: relative;">
+                        <img src="data:{mime};base64,{b64_img}" style="width: 100%; display: block;">
+                        {boxes_html}
+                    </div>
                 </div>
-                <!-- Bounding Box -->
-                <div style="position: absolute; border: 3px solid #f39c12; border-radius: 4px; width: 60%; height: 40%; top: 30%; left: 20%; box-shadow: 0 0 10px #f39c12;">
-                    <div style="background: #f39c12; color: black; font-size: 0.7rem; font-weight: bold; position: absolute; top: -20px; left: -3px; padding: 2px 8px; border-radius: 2px;">
-                        HEAT STRESS DETECTED (94.2%)
+                <p style="color: var(--text-secondary); font-size: 0.8rem; margin-top: 1rem; text-align: center;">Uploaded Crop Image - {len(localization["boxes"])} suspected lesion area(s) from {localization["tiles"]} tiles in {localization["elapsed_ms"]:.0f} ms</p>
+            """, unsafe_allow_html=True)
+        else:
+            st.markdown("""
+                <div class="agri-card" style="height: 480px; position: relative; background: #000; overflow: hidden; display: flex; align-items: center; justify-content: center;">
+                    <div style="width: 100%; height: 100%; position: absolute; opacity: 0.3;">
+                        <!-- Simple SVG Leaf Placeholder -->
+                        <svg viewBox="0 0 200 200" xmlns="http://www.w3.org/2000/svg" style="width: 100%; height: 100%;">
+                            <path fill="#2ecc71" d="M100 20C60 20 20 80 20 120C20 160 100 180 180 120C180 80 140 20 100 20Z" />
+                            <path fill="#27ae60" d="M100 20L100 180M100 60L140 80M100 100L160 120M100 140L140 160M100 60L60 80M100 100L40 120M100 140L60 160" stroke="#fff" stroke-width="2"/>
+                        </svg>
+                    </div>
+                    <!-- Bounding Box -->
+                    <div style="position: absolute; border: 3px solid #f39c12; border-radius: 4px; width: 60%; height: 40%; top: 30%; left: 20%; box-shadow: 0 0 10px #f39c12;">
+                        <div style="background: #f39c12; color: black; font-size: 0.7rem; font-weight: bold; position: absolute; top: -20px; left: -3px; padding: 2px 8px; border-radius: 2px;">
+                            HEAT STRESS DETECTED (94.2%)
+                        </div>
                     </div>
                 </div>
-            </div>
-            <p style="color: var(--text-secondary); font-size: 0.8rem; margin-top: 1rem; text-align: center;">Uploaded Crop Image - Detected Leaf Stress Area</p>
-        """, unsafe_allow_html=True)
+                <p style="color: var(--text-secondary); font-size: 0.8rem; margin-top: 1rem; text-align: center;">Uploaded Crop Image - Detected Leaf Stress Area</p>
+            """, unsafe_allow_html=True)
         
         # Bottom Stats in Diagnosis
         st.markdown('<br>', unsafe_allow_html=True)
@@ -6,10 +6,11 @@ Connects the React frontend with Python backend services.
 Run with: python server.py
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 import os
 import sys
+import json
 
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(__file__))
@@ -17,14 +18,22 @@ sys.path.insert(0, os.path.dirname(__file__))
 # Import backend modules
 from data_utils import (
     fetch_weather_soil, calculate_arbitrage, get_mandi_trends,
-    get_gps_from_city, get_all_cities, get_all_crops, get_crops_by_category
+    get_gps_from_city, get_all_cities, get_all_crops
 )
-from gemini_engine import chat_with_krishi_mitra, analyze_crop_image, transcribe_audio
-from ai_engine import predict_disease, get_fusion_advice
+from gemini_engine import chat_with_krishi_mitra, stream_chat_with_krishi_mitra, get_image_encode_stats, get_http_stats
+from llm_router import get_router_stats
+from utils.chat_cache import get_chat_cache_stats
+from utils.single_flight import get_single_flight_stats
+from utils.chat_db import get_title_queue_stats
+from ai_engine import warm_up_model, get_engine_stats
+from diagnosis_engine import diagnose_crop_image, diagnose_crop_video, get_diagnosis_stats
 
 app = Flask(__name__, static_folder='dist', static_url_path='')
 CORS(app)
 
+# Load the disease model once at startup; request threads share the pool
+warm_up_model()
+
 # ============================================================
 # HEALTH CHECK
 # ============================================================
@@ -37,6 +46,14 @@ def health_check():
         "version": "1.0.0"
     })
 
+@app.route('/api/stats', methods=['GET'])
+def engine_stats():
+    """Model load / inference timings and interpreter pool state."""
+    return jsonify({"ai_engine": get_engine_stats(), "diagnosis": get_diagnosis_stats(),
+                    "vision_encode": get_image_encode_stats(), "openrouter_http": get_http_stats(),
+                    "llm_router": get_router_stats(), "chat_cache": get_chat_cache_stats(),
+                    "single_flight": get_single_flight_stats(), "chat_titles": get_title_queue_stats()})
+
 # ============================================================
 # WEATHER ENDPOINTS
 # ============================================================
@@ -101,13 +118,7 @@ def diagnose():
     try:
         # Decode base64 image
         image_data = base64.b64decode(image_b64)
-        image = Image.open(BytesIO(image_data))
-        
-        # Run AI diagnosis using Cloud Engine (Gemini)
-        # Convert PIL image back to bytes for the function
-        img_byte_arr = BytesIO()
-        image.save(img_byte_arr, format='JPEG')
-        diagnosis = analyze_crop_image(img_byte_arr.getvalue())
+        Image.open(BytesIO(image_data)).verify()
         
         # Get weather context for fusion
         weather_data = {
@@ -116,6 +127,20 @@ def diagnose():
             "description": "Clear"
         }
         
+        # Run AI diagnosis: on-device model first, Gemini Vision only on low confidence
+        diagnosis = diagnose_crop_image(image_data, context.get("language", "en"), None, weather_data,
+                                        crop=context.get("crop"))
+        is_local = diagnosis.get("source") == "local"
+        
+        # Photo failed the quality gate: ask the client for a retake
+        if diagnosis.get("retake"):
+            return jsonify({
+                "error": "Retake photo",
+                "retake": True,
+                "reasons": diagnosis.get("retake_reasons", []),
+                "messages": diagnosis.get("retake_messages", [])
+            }), 422
+        
         # Get fusion advice if diagnosis was successful
         if not diagnosis.get("error"):
             return jsonify({
@@ -124,7 +149,8 @@ def diagnose():
                 "severity": diagnosis.get("severity", "Medium"),
                 "treatment": diagnosis.get("treatment", []),
                 "prevention": diagnosis.get("prevention", "Monitor crops regularly."),
-                "fusionFactor": "Analyzed via Gemini Vision Cloud Engine"
+                "fusionFactor": "Analyzed via on-device TFLite model" if is_local else "Analyzed via Gemini Vision Cloud Engine",
+                "source": diagnosis.get("source")
             })
         else:
             raise Exception(diagnosis.get("disease", "AI Error"))
@@ -140,18 +166,71 @@ def diagnose():
             "fusionFactor": f"Error: {str(e)}"
         }), 500
 
+@app.route('/api/diagnose/video', methods=['POST'])
+def diagnose_video():
+    """Diagnose plant disease from a short field video (multipart 'video' file)."""
+    video = request.files.get('video')
+    if video is None:
+        return jsonify({"error": "No video uploaded"}), 400
+    
+    weather_data = {
+        "temp": request.form.get("temp", 30),
+        "humidity": request.form.get("humidity", 60),
+        "description": "Clear"
+    }
+    try:
+        diagnosis = diagnose_crop_video(video.read(), request.form.get("language", "en"), None, weather_data,
+                                        crop=request.form.get("crop"))
+    except Exception as e:
+        return jsonify({"error": str(e), "disease": "Analysis Failed"}), 500
+    
+    if diagnosis.get("error"):
+        # Missing ffmpeg is a server problem; a bad or shaky clip is the client's
+        status = {"ffmpeg_missing": 503, "unreadable_video": 422, "no_sharp_frames": 422}.get(diagnosis.get("error_code"), 500)
+        return jsonify({
+            "error": diagnosis.get("disease", "AI Error"),
+            "errorCode": diagnosis.get("error_code"),
+            "disease": "Analysis Failed",
+            "framesSampled": diagnosis.get("frames_sampled", 0),
+            "framesUsed": diagnosis.get("frames_used", 0)
+        }), status
+    
+    return jsonify({
+        "disease": diagnosis.get("disease", "Unknown"),
+        "confidence": diagnosis.get("confidence", "Medium"),
+        "severity": diagnosis.get("severity", "Medium"),
+        "treatment": diagnosis.get("treatment", []),
+        "prevention": diagnosis.get("prevention", "Monitor crops regularly."),
+        "source": diagnosis.get("source"),
+        "framesSampled": diagnosis.get("frames_sampled", 0),
+        "framesUsed": diagnosis.get("frames_used", 0),
+        "frameAgreement": diagnosis.get("frame_agreement")
+    })
+
 # ============================================================
 # AI CHAT ENDPOINTS
 # ============================================================
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    """Chat with Krishi-Mitra AI assistant."""
+    """
+    Chat with Krishi-Mitra AI assistant.
+    With {"stream": true} or "Accept: text/event-stream" the reply is sent
+    as server-sent events: data: {"delta": "..."} per chunk, then data: [DONE].
+    """
     data = request.json
     message = data.get('message', '')
     language = data.get('language', 'en')
     context = data.get('context', {})
     
+    if data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+        def events():
+            for chunk in stream_chat_with_krishi_mitra(message, language, context):
+                yield f"data: {json.dumps({'delta': chunk}, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        return Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     response = chat_with_krishi_mitra(message, language, context)
     return jsonify({"response": response})
 
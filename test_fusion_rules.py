@@ -0,0 +1,54 @@
+"""
+Regression test: missing weather readings ("--" from the weather API or an
+empty forecast) must not be treated as weather that favours the disease.
+
+Run with `python -m pytest test_fusion_rules.py` or `python test_fusion_rules.py`.
+"""
+
+import numpy as np
+
+import ai_engine
+
+
+def test_missing_readings_are_not_favourable():
+    advice = ai_engine.get_fusion_advice(
+        {"disease": "Tomato___Late_blight", "confidence": 80},
+        {"temp": "--", "humidity": "--"},
+    )
+    assert advice["urgency"] == "Medium"
+    assert advice["enhanced_confidence"] == 80
+    assert advice["fusion_factor"] == "Current weather (--°C, --%) slows fungal spread"
+
+    # Threshold rules fall back to their unfavourable branch too
+    advice = ai_engine.get_fusion_advice(
+        {"disease": "Fungal Infection", "confidence": 80},
+        {"temp": 25, "humidity": "--"},
+    )
+    assert advice["urgency"] == "Medium"
+    assert advice["fusion_factor"] == "Standard Analysis"
+
+
+def test_empty_forecast_is_not_favourable():
+    class_id = ai_engine.fusion_class_id("Tomato___Late_blight")
+    scores = ai_engine.evaluate_fusion_rules([class_id], [80], np.empty((0, 2)))
+    assert not scores["favourable"][0, 0]
+    assert ai_engine.URGENCY_LEVELS[int(scores["peak_urgency"][0])] == "Medium"
+
+    # A usable current reading is still scored when the forecast is empty
+    scores = ai_engine.evaluate_fusion_rules([class_id], [80], np.empty((0, 2)), current=(18, 95))
+    assert scores["favourable"][0, 0]
+    assert ai_engine.URGENCY_LEVELS[int(scores["peak_urgency"][0])] == "High"
+
+
+def test_absent_readings_use_defaults():
+    # No temp/humidity keys at all: computed and shown with the same defaults
+    advice = ai_engine.get_fusion_advice({"disease": "Heat Stress", "confidence": 70}, {})
+    assert advice["urgency"] == "Medium"
+    assert "30°C" in advice["fusion_factor"]
+
+
+if __name__ == "__main__":
+    test_missing_readings_are_not_favourable()
+    test_empty_forecast_is_not_favourable()
+    test_absent_readings_use_defaults()
+    print("✅ Missing weather readings are not treated as favourable")
@@ -0,0 +1,58 @@
+"""
+Regression test: callers waiting on a full interpreter pool must be woken
+when the model load fails, instead of blocking forever.
+
+Run with `python -m pytest test_interpreter_pool.py` or `python test_interpreter_pool.py`.
+"""
+
+import threading
+import time
+
+import ai_engine
+
+
+def test_failed_load_wakes_waiters():
+    load_started = threading.Event()
+    finish_load = threading.Event()
+
+    def failing_load(model_path, num_threads=None, backend=None, model_content=None):
+        load_started.set()
+        finish_load.wait(5)
+        return None
+
+    original = ai_engine.load_tflite_model
+    ai_engine.load_tflite_model = failing_load
+    try:
+        pool = ai_engine._InterpreterPool("missing.tflite", size=1)
+        results = {}
+
+        def worker(name):
+            results[name] = pool.acquire(timeout=10)
+
+        loader = threading.Thread(target=worker, args=("loader",), daemon=True)
+        loader.start()
+        assert load_started.wait(5)
+
+        # Pool is full (one load in progress), so this caller has to wait
+        waiter = threading.Thread(target=worker, args=("waiter",), daemon=True)
+        waiter.start()
+        time.sleep(0.2)
+        assert waiter.is_alive()
+
+        start = time.time()
+        finish_load.set()
+        loader.join(5)
+        waiter.join(5)
+
+        assert not waiter.is_alive(), "waiter still blocked after the load failed"
+        assert time.time() - start < 2
+        assert results == {"loader": None, "waiter": None}
+        assert pool.load_failures == 1
+        assert not pool.available
+    finally:
+        ai_engine.load_tflite_model = original
+
+
+if __name__ == "__main__":
+    test_failed_load_wakes_waiters()
+    print("✅ Failed model load wakes waiting callers")
@@ -1,6 +1,7 @@
 import os
 import requests
 from dotenv import load_dotenv
+from utils.single_flight import coalesce
 
 load_dotenv()
 
@@ -11,6 +12,7 @@ OPENROUTE_KEY = os.getenv("OPENROUTE_API_KEY")
 OIL_KEY = os.getenv("OIL_PRICES_API_KEY")
 GEO_KEY = os.getenv("POSITIONSTACK_API_KEY")
 
+@coalesce("openweather")
 def get_weather(city="Rajkot"):
     """Fetch real-time weather using OpenWeatherMap"""
     try:
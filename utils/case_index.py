@@ -0,0 +1,279 @@
+"""
+Krishi-Mitra AI - Similar Case Index
+====================================
+Embedding index of confirmed diagnoses (AI diagnoses saved to the crop
+history) used to show farmers the most similar past cases in their region.
+
+Storage, one directory per model embedding space (data/case_index/<space>/):
+- vectors.f16: append-only (N, dim) float16 rows, L2-normalized, memory-mapped
+- cases.db:    SQLite row metadata (crop, disease, date, lat/lon, user)
+
+Features:
+- Embeddings wider than CASE_INDEX_DIM are reduced with a fixed random
+  orthogonal projection (cosine similarity is approximately preserved)
+- Region queries: vectorized lat/lon filter, then exact cosine scores of
+  the matching rows read from the memory map
+- Whole-index queries: a small in-memory float32 sketch of every vector
+  picks candidates with one matmul, which are re-ranked exactly
+  (converting hundreds of thousands of float16 rows per query is too slow)
+- Incremental appends without rewriting the index
+
+Author: Krishi-Mitra Team
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Index location
+INDEX_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "case_index")
+
+# Stored dimension (override via environment)
+INDEX_DIM = int(os.getenv("CASE_INDEX_DIM", "256"))
+# Width of the in-memory sketch used to shortlist whole-index queries
+SKETCH_DIM = int(os.getenv("CASE_INDEX_SKETCH_DIM", "64"))
+# Shortlist size per requested result for exact re-ranking
+RERANK_FACTOR = 64
+# Rows converted per chunk while building the sketch
+LOAD_CHUNK_ROWS = 65536
+# Default search radius for "cases in your region"
+DEFAULT_RADIUS_KM = float(os.getenv("CASE_INDEX_RADIUS_KM", "50"))
+
+_KM_PER_DEGREE = 111.0
+_PROJECTION_SEED = 20240601
+
+_projections = {}
+
+
+def _projection(in_dim: int, out_dim: int, seed: int = _PROJECTION_SEED) -> Optional[np.ndarray]:
+    """Fixed (in_dim, out_dim) orthonormal projection, or None if no reduction is needed."""
+    if in_dim <= out_dim:
+        return None
+    key = (in_dim, out_dim, seed)
+    if key not in _projections:
+        rng = np.random.default_rng(seed)
+        q, _ = np.linalg.qr(rng.standard_normal((in_dim, out_dim)).astype(np.float32))
+        _projections[key] = q.astype(np.float32)
+    return _projections[key]
+
+
+def reduce_embedding(embedding: np.ndarray, dim: int = None) -> np.ndarray:
+    """Project a model embedding to the index dimension and re-normalize."""
+    dim = dim or INDEX_DIM
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    projection = _projection(vector.shape[0], dim)
+    if projection is not None:
+        vector = vector @ projection
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class CaseIndex:
+    """
+    Append-only float16 vector store for one embedding space.
+
+    Vectors live in a raw file that is memory-mapped for search; the
+    lat/lon and a SKETCH_DIM-wide sketch of every row are kept in memory.
+    Appends write the vector first and the metadata row second, so a crash
+    in between leaves a trailing vector that is trimmed on the next open.
+    """
+
+    def __init__(self, directory: str, dim: int):
+        self.directory = directory
+        self.dim = dim
+        self.vectors_path = os.path.join(directory, "vectors.f16")
+        self.db_path = os.path.join(directory, "cases.db")
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._sketch_projection = _projection(dim, SKETCH_DIM, seed=_PROJECTION_SEED + 1)
+        os.makedirs(directory, exist_ok=True)
+        self._init_db()
+        self._load()
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cases (
+                row INTEGER PRIMARY KEY,
+                user_id INTEGER,
+                crop TEXT,
+                disease TEXT,
+                record_date TEXT,
+                lat REAL,
+                lon REAL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def _load(self):
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute('SELECT row, lat, lon FROM cases ORDER BY row').fetchall()
+        conn.close()
+
+        row_bytes = self.dim * 2
+        file_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        count = min(len(rows), file_rows)
+        if file_rows > count or (os.path.exists(self.vectors_path)
+                                 and os.path.getsize(self.vectors_path) != count * row_bytes):
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(count * row_bytes)
+
+        self._count = count
+        capacity = max(count, 1024)
+        self._coords = np.full((capacity, 2), np.nan, dtype=np.float32)
+        self._sketch = np.zeros((capacity, self._sketch_width()), dtype=np.float32)
+        if count:
+            self._coords[:count] = np.array([(r[1], r[2]) for r in rows[:count]], dtype=np.float64)
+            vectors = self._mapped()
+            for start in range(0, count, LOAD_CHUNK_ROWS):
+                chunk = vectors[start:start + LOAD_CHUNK_ROWS].astype(np.float32)
+                self._sketch[start:start + chunk.shape[0]] = self._sketch_of(chunk)
+
+    def _sketch_width(self) -> int:
+        return self.dim if self._sketch_projection is None else SKETCH_DIM
+
+    def _sketch_of(self, vectors: np.ndarray) -> np.ndarray:
+        if self._sketch_projection is None:
+            return vectors
+        return vectors @ self._sketch_projection
+
+    def _grow(self, capacity: int):
+        coords = np.full((capacity, 2), np.nan, dtype=np.float32)
+        coords[:self._count] = self._coords[:self._count]
+        sketch = np.zeros((capacity, self._sketch.shape[1]), dtype=np.float32)
+        sketch[:self._count] = self._sketch[:self._count]
+        self._coords, self._sketch = coords, sketch
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _mapped(self) -> Optional[np.ndarray]:
+        """Memory map covering every appended row (remapped after appends)."""
+        if self._count == 0:
+            return None
+        if self._vectors is None or self._vectors.shape[0] != self._count:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode="r",
+                                      shape=(self._count, self.dim))
+        return self._vectors
+
+    def add(self, vector: np.ndarray, record: Dict) -> int:
+        """Append one normalized (dim,) vector with its case record; returns its row."""
+        vector = np.asarray(vector, dtype=np.float16).reshape(self.dim)
+        lat, lon = record.get("lat"), record.get("lon")
+        with self._lock:
+            row = self._count
+            with open(self.vectors_path, "ab") as f:
+                f.write(vector.tobytes())
+            conn = sqlite3.connect(self.db_path)
+            conn.execute('''
+                INSERT INTO cases (row, user_id, crop, disease, record_date, lat, lon, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (row, record.get("user_id"), record.get("crop"), record.get("disease"),
+                  record.get("date"), lat, lon, time.time()))
+            conn.commit()
+            conn.close()
+
+            if row >= self._coords.shape[0]:
+                self._grow(self._coords.shape[0] * 2)
+            self._coords[row] = (np.nan if lat is None else lat, np.nan if lon is None else lon)
+            self._sketch[row] = self._sketch_of(vector.astype(np.float32)[None, :])[0]
+            self._count = row + 1
+        return row
+
+    def _region_rows(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        coords = self._coords[:self._count]
+        dlat = (coords[:, 0] - lat) * _KM_PER_DEGREE
+        dlon = (coords[:, 1] - lon) * _KM_PER_DEGREE * np.cos(np.radians(lat))
+        # NaN (no location) compares False, so unlocated cases drop out
+        return np.flatnonzero(dlat * dlat + dlon * dlon <= radius_km * radius_km)
+
+    def search(self, vector: np.ndarray, k: int = 5, lat: float = None, lon: float = None,
+               radius_km: float = None) -> List[Dict]:
+        """
+        Top-k most similar cases by cosine similarity, optionally only those
+        within radius_km of (lat, lon).
+        """
+        vector = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            vectors = self._mapped()
+            count = self._count
+            if vectors is None or k <= 0:
+                return []
+            if lat is not None and lon is not None:
+                rows = self._region_rows(lat, lon, radius_km or DEFAULT_RADIUS_KM)
+            else:
+                # Shortlist with the in-memory sketch, re-rank exactly below
+                sketch_scores = self._sketch[:count] @ self._sketch_of(vector[None, :])[0]
+                rows = np.sort(_top(sketch_scores, k * RERANK_FACTOR))
+        if rows.size == 0:
+            return []
+
+        scores = vectors[rows].astype(np.float32) @ vector
+        best = _top(scores, k)
+        return self._records(rows[best], scores[best])
+
+    def _records(self, rows: np.ndarray, scores: np.ndarray) -> List[Dict]:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        placeholders = ",".join("?" * len(rows))
+        found = {r["row"]: dict(r) for r in conn.execute(
+            f'SELECT * FROM cases WHERE row IN ({placeholders})', [int(r) for r in rows])}
+        conn.close()
+        results = []
+        for row, score in zip(rows, scores):
+            record = found.get(int(row))
+            if record is not None:
+                record["similarity"] = float(score)
+                results.append(record)
+        return results
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first."""
+    k = min(k, scores.shape[0])
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(-scores[top])]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_case_index(space: str, dim: int = None) -> CaseIndex:
+    """Open (once per process) the index for a model embedding space."""
+    dim = dim or INDEX_DIM
+    with _indexes_lock:
+        if space not in _indexes:
+            _indexes[space] = CaseIndex(os.path.join(INDEX_DIR, f"{space}_{dim}"), dim)
+        return _indexes[space]
+
+
+def add_case(space: str, embedding: np.ndarray, record: Dict) -> Optional[int]:
+    """
+    Add a confirmed case.
+
+    Args:
+        space: ai_engine.get_embedding_space() when the embedding was taken
+        embedding: ai_engine.extract_embeddings() row for the leaf photo
+        record: {user_id, crop, disease, date, lat, lon}
+    """
+    try:
+        return get_case_index(space).add(reduce_embedding(embedding), record)
+    except Exception as e:
+        print(f"[Case Index] Error adding case: {e}")
+        return None
+
+
+def find_similar_cases(space: str, embedding: np.ndarray, k: int = 3, lat: float = None,
+                       lon: float = None, radius_km: float = None) -> List[Dict]:
+    """Most similar confirmed cases (near lat/lon when given), best first."""
+    try:
+        return get_case_index(space).search(reduce_embedding(embedding), k, lat, lon, radius_km)
+    except Exception as e:
+        print(f"[Case Index] Error searching cases: {e}")
+        return []
@@ -0,0 +1,260 @@
+"""
+Krishi-Mitra AI - Chat Response Cache
+======================================
+SQLite-backed cache of Krishi-Mitra chat replies, keyed by the normalized
+question, response language and coarse context (city, crop). Farmers in
+a district ask the same questions again and again ("groundnut price",
+"pink bollworm spray"), so repeats are answered without an LLM call.
+
+Features:
+- Question classes with their own TTL (prices and weather go stale fast,
+  disease / treatment advice does not)
+- Size-bounded LRU eviction
+- Hit / miss counters per class, stored in the database so they cover
+  every Streamlit session and Flask worker sharing the file
+- WAL mode so concurrent processes can read while one writes
+
+Replies built from a farmer's own history or regional disease reports are
+personal and are not cached.
+
+Author: Krishi-Mitra Team
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from typing import Dict, Optional
+
+# Database path
+DB_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "chat_cache.db")
+os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+
+# Cache tuning (override via environment)
+CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "5000"))
+
+# Question classes, checked in order; the first whose keywords appear wins
+QUESTION_CLASSES = {
+    "weather": ("weather", "rain", "forecast", "temperature", "humidity", "monsoon",
+                "હવામાન", "વરસાદ", "તાપમાન", "ભેજ"),
+    "price": ("price", "rate", "mandi", "market", "bhav", "sell", "₹",
+              "ભાવ", "બજાર", "મંડી", "વેચ"),
+    "disease": ("disease", "pest", "spray", "bollworm", "fungus", "insect", "dose", "dosage",
+                "pesticide", "fungicide", "treatment", "blight", "wilt",
+                "રોગ", "જીવાત", "દવા", "છંટકાવ", "ઇયળ"),
+}
+# Seconds a reply stays valid, per class
+CLASS_TTL_SECONDS = {
+    "weather": int(os.getenv("CHAT_CACHE_TTL_WEATHER", str(3600))),
+    "price": int(os.getenv("CHAT_CACHE_TTL_PRICE", str(6 * 3600))),
+    "disease": int(os.getenv("CHAT_CACHE_TTL_DISEASE", str(7 * 24 * 3600))),
+    "general": int(os.getenv("CHAT_CACHE_TTL_GENERAL", str(3 * 24 * 3600))),
+}
+
+_WHITESPACE = re.compile(r"\s+")
+# English keywords match at the start of a word ("prices", not "irrigate");
+# Gujarati ones anywhere, since case endings attach to the word (ભાવમાં)
+_CLASS_PATTERNS = {
+    question_class: re.compile("|".join(
+        (r"\b" + re.escape(k)) if k.isascii() and k.isalpha() else re.escape(k) for k in keywords))
+    for question_class, keywords in QUESTION_CLASSES.items()
+}
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=5)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def init_chat_cache_db():
+    """Initialize the chat cache and counter tables."""
+    conn = _connect()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_cache (
+            key TEXT PRIMARY KEY,
+            question_class TEXT NOT NULL,
+            language TEXT NOT NULL,
+            question TEXT NOT NULL,
+            reply TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            hits INTEGER DEFAULT 0
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_cache_access
+        ON chat_cache(last_access)
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_cache_stats (
+            question_class TEXT PRIMARY KEY,
+            hits INTEGER DEFAULT 0,
+            misses INTEGER DEFAULT 0,
+            stores INTEGER DEFAULT 0,
+            evictions INTEGER DEFAULT 0
+        )
+    ''')
+
+    conn.commit()
+    conn.close()
+
+
+def normalize_message(message: str) -> str:
+    """Case-, punctuation- and whitespace-insensitive form of a question."""
+    text = unicodedata.normalize("NFKC", message or "").lower()
+    # Drop punctuation and symbols by Unicode category; \W would also strip
+    # Gujarati vowel signs, which are combining marks
+    text = "".join(" " if unicodedata.category(c)[0] in "PS" and c != "₹" else c for c in text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def classify_message(normalized: str) -> str:
+    """Question class (weather, price, disease or general) that sets the TTL."""
+    for question_class, pattern in _CLASS_PATTERNS.items():
+        if pattern.search(normalized):
+            return question_class
+    return "general"
+
+
+def is_cacheable(context_data: Optional[Dict]) -> bool:
+    """Replies that used the farmer's own history or regional reports are personal."""
+    context_data = context_data or {}
+    return not (context_data.get("full_history") or context_data.get("regional_stats"))
+
+
+def _cache_key(normalized: str, language: str, context_data: Optional[Dict]) -> str:
+    context_data = context_data or {}
+    parts = [normalized, language or "en",
+             str(context_data.get("city") or "").strip().lower(),
+             str(context_data.get("crop") or "").strip().lower()]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _count(cursor, question_class: str, column: str, n: int = 1):
+    cursor.execute(f'''
+        INSERT INTO chat_cache_stats (question_class, {column}) VALUES (?, ?)
+        ON CONFLICT(question_class) DO UPDATE SET {column} = {column} + excluded.{column}
+    ''', (question_class, n))
+
+
+def get_cached_reply(message: str, language: str, context_data: Dict = None) -> Optional[str]:
+    """
+    Return the cached reply for this question and context, else None.
+
+    Args:
+        message: The farmer's question as typed / transcribed
+        language: Response language ('en' or 'gu')
+        context_data: chat_with_krishi_mitra() context (city and crop are used)
+    """
+    if not is_cacheable(context_data):
+        return None
+    normalized = normalize_message(message)
+    if not normalized:
+        return None
+    question_class = classify_message(normalized)
+    key = _cache_key(normalized, language, context_data)
+    try:
+        now = time.time()
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT reply FROM chat_cache WHERE key = ? AND expires_at > ?', (key, now))
+        row = cursor.fetchone()
+        if row is None:
+            _count(cursor, question_class, "misses")
+        else:
+            cursor.execute('UPDATE chat_cache SET last_access = ?, hits = hits + 1 WHERE key = ?', (now, key))
+            _count(cursor, question_class, "hits")
+        conn.commit()
+        conn.close()
+        return row[0] if row else None
+
+    except Exception as e:
+        print(f"[Chat Cache] Error reading cache: {e}")
+        return None
+
+
+def cache_reply(message: str, language: str, context_data: Dict, reply: str) -> bool:
+    """Store a reply, then drop expired and least-recently-used rows."""
+    if not is_cacheable(context_data) or not reply:
+        return False
+    normalized = normalize_message(message)
+    if not normalized:
+        return False
+    question_class = classify_message(normalized)
+    try:
+        now = time.time()
+        conn = _connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT OR REPLACE INTO chat_cache
+                (key, question_class, language, question, reply, created_at, expires_at, last_access, hits)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+        ''', (_cache_key(normalized, language, context_data), question_class, language, normalized,
+              reply, now, now + CLASS_TTL_SECONDS[question_class], now))
+        _count(cursor, question_class, "stores")
+
+        stale = '''
+            SELECT key FROM chat_cache WHERE expires_at <= ?
+            UNION
+            SELECT key FROM (
+                SELECT key FROM chat_cache
+                ORDER BY last_access DESC
+                LIMIT -1 OFFSET ?
+            )
+        '''
+        params = (now, CACHE_MAX_ENTRIES)
+        cursor.execute(f'''
+            SELECT question_class, COUNT(*) FROM chat_cache
+            WHERE key IN ({stale}) GROUP BY question_class
+        ''', params)
+        for evicted_class, evicted in cursor.fetchall():
+            _count(cursor, evicted_class, "evictions", evicted)
+        cursor.execute(f'DELETE FROM chat_cache WHERE key IN ({stale})', params)
+
+        conn.commit()
+        conn.close()
+        return True
+
+    except Exception as e:
+        print(f"[Chat Cache] Error writing cache: {e}")
+        return False
+
+
+def get_chat_cache_stats() -> Dict:
+    """Hit / miss counters per question class (all processes) plus entry counts."""
+    try:
+        conn = _connect()
+        conn.row_factory = sqlite3.Row
+        classes = {r["question_class"]: dict(r) for r in conn.execute('SELECT * FROM chat_cache_stats')}
+        entries = dict(conn.execute('SELECT question_class, COUNT(*) FROM chat_cache GROUP BY question_class').fetchall())
+        conn.close()
+    except Exception as e:
+        print(f"[Chat Cache] Error reading stats: {e}")
+        return {}
+
+    totals = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+    for question_class, stats in classes.items():
+        stats.pop("question_class")
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = entries.get(question_class, 0)
+        stats["ttl_seconds"] = CLASS_TTL_SECONDS.get(question_class)
+        for name in totals:
+            totals[name] += stats[name]
+    lookups = totals["hits"] + totals["misses"]
+    totals["hit_rate"] = totals["hits"] / lookups if lookups else 0.0
+    totals["entries"] = sum(entries.values())
+    return {"total": totals, "classes": classes}
+
+
+# Initialize database on module import
+init_chat_cache_db()
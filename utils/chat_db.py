@@ -6,7 +6,8 @@ SQLite-based chat session and message management system
 Features:
 - Chat Session Management
 - Message Storage and Retrieval
-- AI-Powered Auto-Title Generation
+- AI-Powered Auto-Title Generation (background, batched; sessions start
+  with a provisional title so the first reply is not delayed)
 - Date-based Organization
 - User-specific Chat History
 
@@ -15,6 +16,9 @@ Author: Krishi-Mitra Team
 
 import sqlite3
 import os
+import queue
+import threading
+import time
 from datetime import datetime, timedelta
 from typing import List, Dict, Tuple, Optional
 
@@ -22,6 +26,14 @@ from typing import List, Dict, Tuple, Optional
 DB_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "chat_history.db")
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
+# Background titles: most sessions per AI call, how long (seconds) the
+# worker waits to fill a batch, attempts per session and the first retry
+# delay (seconds, doubled on each retry)
+TITLE_BATCH_SIZE = int(os.getenv("CHAT_TITLE_BATCH_SIZE", "8"))
+TITLE_BATCH_WAIT = float(os.getenv("CHAT_TITLE_BATCH_WAIT", "0.5"))
+TITLE_MAX_ATTEMPTS = int(os.getenv("CHAT_TITLE_MAX_ATTEMPTS", "3"))
+TITLE_RETRY_DELAY = float(os.getenv("CHAT_TITLE_RETRY_DELAY", "5"))
+
 
 def init_chat_db():
     """Initialize the chat history database with required tables."""
@@ -68,6 +80,18 @@ def init_chat_db():
     conn.close()
 
 
+def provisional_chat_title(first_message: str) -> str:
+    """
+    Title a session gets until its AI title is ready: the first 50
+    characters of the message.
+    """
+    fallback_title = first_message[:50].strip()
+    if len(first_message) > 50:
+        fallback_title += "..."
+
+    return fallback_title if fallback_title else "New Chat"
+
+
 def generate_chat_title(first_message: str, language: str = "en") -> str:
     """
     Generate a meaningful chat title from the first user message using AI.
@@ -93,16 +117,13 @@ def generate_chat_title(first_message: str, language: str = "en") -> str:
         print(f"[Chat DB] Error generating AI title: {e}")
     
     # Fallback: Use first 50 chars of message
-    fallback_title = first_message[:50].strip()
-    if len(first_message) > 50:
-        fallback_title += "..."
-    
-    return fallback_title if fallback_title else "New Chat"
+    return provisional_chat_title(first_message)
 
 
 def create_chat_session(user_email: str, first_message: str, language: str = "en", user_id: Optional[int] = None) -> int:
     """
-    Create a new chat session with AI-generated title.
+    Create a new chat session with a provisional title; the AI-generated
+    title is written later by the background title worker.
     
     Args:
         user_email: User's email (or 'guest' for non-authenticated users)
@@ -114,8 +135,8 @@ def create_chat_session(user_email: str, first_message: str, language: str = "en
         int: New session ID
     """
     try:
-        # Generate title from first message
-        title = generate_chat_title(first_message, language)
+        # Provisional title now, AI title in the background
+        title = provisional_chat_title(first_message)
         
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
@@ -130,6 +151,7 @@ def create_chat_session(user_email: str, first_message: str, language: str = "en
         conn.close()
         
         print(f"[Chat DB] Created session {session_id} with title: {title}")
+        queue_chat_title(session_id, first_message, language, title)
         return session_id
         
     except Exception as e:
@@ -404,5 +426,108 @@ def cleanup_old_sessions(days: int = 90, user_email: Optional[str] = None) -> in
         return 0
 
 
+# ============================================================
+# BACKGROUND TITLE GENERATION
+# ============================================================
+# A daemon thread collects new sessions into batches and titles each batch
+# with one AI call. Failed titles are retried with backoff; a session keeps
+# its provisional title if every attempt fails, and one the user renamed
+# meanwhile is left alone. Pending titles are lost on restart (the
+# provisional title stays).
+
+_title_queue = queue.Queue()
+_title_worker = None
+_title_lock = threading.Lock()
+_TITLE_STATS = {"queued": 0, "batches": 0, "renamed": 0, "retries": 0, "failed": 0, "skipped": 0}
+
+
+def _count_title(name: str, n: int = 1):
+    with _title_lock:
+        _TITLE_STATS[name] += n
+
+
+def queue_chat_title(session_id: int, first_message: str, language: str = "en", provisional_title: str = None):
+    """
+    Queue a session for an AI title, replacing its provisional title.
+    
+    Args:
+        session_id: Chat session ID
+        first_message: First user message to generate title from
+        language: Language code for title generation
+        provisional_title: Current title; the AI title is only written if
+                           the session still has it
+    """
+    global _title_worker
+    job = {"session_id": session_id, "message": first_message, "language": language,
+           "provisional": provisional_title or provisional_chat_title(first_message), "attempt": 1}
+    with _title_lock:
+        _TITLE_STATS["queued"] += 1
+        if _title_worker is None or not _title_worker.is_alive():
+            _title_worker = threading.Thread(target=_title_loop, name="chat-title-worker", daemon=True)
+            _title_worker.start()
+    _title_queue.put(job)
+
+
+def _title_loop():
+    while True:
+        batch = [_title_queue.get()]
+        batch_deadline = time.time() + TITLE_BATCH_WAIT
+        while len(batch) < TITLE_BATCH_SIZE:
+            remaining = batch_deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_title_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            _title_batch(batch)
+        except Exception as e:
+            print(f"[Chat DB] Title worker error: {e}")
+
+
+def _title_batch(batch: List[Dict]):
+    """Title one batch with a single AI call; retry the sessions that got none."""
+    from gemini_engine import generate_titles_from_messages
+
+    _count_title("batches")
+    titles = generate_titles_from_messages([(job["message"], job["language"]) for job in batch])
+    print(f"[Chat DB] Titled {sum(1 for t in titles if t)}/{len(batch)} session(s) in one call")
+
+    for job, title in zip(batch, titles):
+        if title:
+            _apply_title(job, title)
+        elif job["attempt"] < TITLE_MAX_ATTEMPTS:
+            delay = TITLE_RETRY_DELAY * 2 ** (job["attempt"] - 1)
+            job["attempt"] += 1
+            _count_title("retries")
+            timer = threading.Timer(delay, _title_queue.put, args=(job,))
+            timer.daemon = True
+            timer.start()
+        else:
+            _count_title("failed")
+            print(f"[Chat DB] Keeping provisional title for session {job['session_id']}")
+
+
+def _apply_title(job: Dict, title: str):
+    """Rename the session unless it was deleted or renamed since it was queued."""
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute('SELECT title FROM chat_sessions WHERE id = ?', (job["session_id"],)).fetchone()
+    conn.close()
+    if row is None or row[0] != job["provisional"]:
+        _count_title("skipped")
+        return
+    if rename_chat_session(job["session_id"], title):
+        _count_title("renamed")
+
+
+def get_title_queue_stats() -> Dict:
+    """Background title counters plus the number of sessions waiting."""
+    with _title_lock:
+        stats = dict(_TITLE_STATS)
+    stats["pending"] = _title_queue.qsize()
+    return stats
+
+
 # Initialize database on module import
 init_chat_db()
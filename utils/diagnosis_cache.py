@@ -0,0 +1,228 @@
+"""
+Krishi-Mitra AI - Diagnosis Cache
+==================================
+SQLite-backed cache of diagnosis results keyed by a perceptual hash of the
+leaf photo plus the response language.
+
+Features:
+- 64-bit DCT perceptual hash (pHash), robust to re-compression and resizing
+- Near-duplicate lookup by Hamming distance (vectorized with NumPy)
+- TTL expiry and size-bounded LRU eviction
+- Hit / miss counters
+
+Author: Krishi-Mitra Team
+"""
+
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+# Database path
+DB_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "diagnosis_cache.db")
+os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+
+# Cache tuning (override via environment)
+CACHE_TTL_SECONDS = int(os.getenv("DIAGNOSIS_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("DIAGNOSIS_CACHE_MAX_ENTRIES", "5000"))
+# Max differing hash bits for two photos to count as the same leaf
+CACHE_MAX_DISTANCE = int(os.getenv("DIAGNOSIS_CACHE_MAX_DISTANCE", "6"))
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+
+_stats_lock = threading.Lock()
+_CACHE_STATS = {"hits": 0, "near_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def init_cache_db():
+    """Initialize the diagnosis cache table."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diagnosis_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phash INTEGER NOT NULL,
+            language TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_cache_lang_hash
+        ON diagnosis_cache(language, phash)
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_cache_access
+        ON diagnosis_cache(last_access)
+    ''')
+
+    conn.commit()
+    conn.close()
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so a 2D DCT is C @ X @ C.T."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """
+    64-bit DCT perceptual hash of an image.
+    Near-identical photos (re-saved, resized, slightly re-framed) differ in
+    only a few bits, so Hamming distance measures visual similarity.
+    """
+    if image.format == "JPEG":
+        image.draft("L", (_DCT_SIZE * 4, _DCT_SIZE * 4))
+    gray = image.convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.float32)
+    low = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE].ravel()
+    # Skip the DC term when picking the threshold so overall brightness does not dominate
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _to_sqlite(phash: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return int(np.array(phash, dtype=np.uint64).view(np.int64))
+
+
+def _record(kind: str, n: int = 1):
+    with _stats_lock:
+        _CACHE_STATS[kind] += n
+
+
+def get_cached_diagnosis(phash: int, language: str, max_distance: int = None) -> Optional[Dict]:
+    """
+    Return the cached result for this photo (or a near-duplicate), else None.
+
+    Args:
+        phash: perceptual_hash() of the photo
+        language: Response language the result was produced in
+        max_distance: Hamming threshold (defaults to CACHE_MAX_DISTANCE)
+    """
+    max_distance = CACHE_MAX_DISTANCE if max_distance is None else max_distance
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        cutoff = time.time() - CACHE_TTL_SECONDS
+
+        cursor.execute('''
+            SELECT id, result FROM diagnosis_cache
+            WHERE language = ? AND phash = ? AND created_at >= ?
+            ORDER BY last_access DESC LIMIT 1
+        ''', (language, _to_sqlite(phash), cutoff))
+        row = cursor.fetchone()
+        kind = "hits"
+
+        if row is None and max_distance > 0:
+            cursor.execute('''
+                SELECT id, phash FROM diagnosis_cache
+                WHERE language = ? AND created_at >= ?
+            ''', (language, cutoff))
+            rows = cursor.fetchall()
+            if rows:
+                ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+                hashes = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows)).view(np.uint64)
+                distances = np.bitwise_count(hashes ^ np.uint64(phash))
+                best = int(np.argmin(distances))
+                if distances[best] <= max_distance:
+                    cursor.execute('SELECT id, result FROM diagnosis_cache WHERE id = ?', (int(ids[best]),))
+                    row = cursor.fetchone()
+                    kind = "near_hits"
+
+        if row is None:
+            conn.close()
+            _record("misses")
+            return None
+
+        cursor.execute('UPDATE diagnosis_cache SET last_access = ? WHERE id = ?', (time.time(), row[0]))
+        conn.commit()
+        conn.close()
+        _record(kind)
+        return json.loads(row[1])
+
+    except Exception as e:
+        print(f"[Diagnosis Cache] Error reading cache: {e}")
+        _record("misses")
+        return None
+
+
+def cache_diagnosis(phash: int, language: str, result: Dict) -> bool:
+    """Store a diagnosis result, then drop expired and least-recently-used rows."""
+    try:
+        now = time.time()
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT INTO diagnosis_cache (phash, language, result, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (_to_sqlite(phash), language, json.dumps(result), now, now))
+
+        cursor.execute('DELETE FROM diagnosis_cache WHERE created_at < ?', (now - CACHE_TTL_SECONDS,))
+        evicted = cursor.rowcount
+        cursor.execute('''
+            DELETE FROM diagnosis_cache WHERE id IN (
+                SELECT id FROM diagnosis_cache
+                ORDER BY last_access DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (CACHE_MAX_ENTRIES,))
+        evicted += cursor.rowcount
+
+        conn.commit()
+        conn.close()
+        _record("stores")
+        if evicted:
+            _record("evictions", evicted)
+        return True
+
+    except Exception as e:
+        print(f"[Diagnosis Cache] Error writing cache: {e}")
+        return False
+
+
+def hash_image_bytes(image_bytes: bytes) -> Optional[int]:
+    """perceptual_hash() for raw upload bytes; None if the image cannot be read."""
+    try:
+        return perceptual_hash(Image.open(io.BytesIO(image_bytes)))
+    except Exception as e:
+        print(f"[Diagnosis Cache] Could not hash image: {e}")
+        return None
+
+
+def get_cache_stats() -> Dict:
+    """Hit / miss counters for this process plus the current entry count."""
+    with _stats_lock:
+        stats = dict(_CACHE_STATS)
+    lookups = stats["hits"] + stats["near_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["hits"] + stats["near_hits"]) / lookups if lookups else 0.0
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        stats["entries"] = conn.execute('SELECT COUNT(*) FROM diagnosis_cache').fetchone()[0]
+        conn.close()
+    except Exception:
+        stats["entries"] = None
+    return stats
+
+
+# Initialize database on module import
+init_cache_db()
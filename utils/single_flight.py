@@ -0,0 +1,241 @@
+"""
+Krishi-Mitra AI - Single-Flight Request Coalescing
+===================================================
+When an alert goes out, many farmers in one area send the same question
+or open the same city at the same moment. Identical requests that are
+already in flight share one outbound call and its result instead of each
+hitting OpenRouter, Open-Meteo or data.gov.in.
+
+Three flavours, all keyed by (namespace, key):
+- do() / @coalesce: threads (Streamlit sessions, Flask request threads);
+  followers block until the leader's call returns, then get the same
+  result or exception
+- do_async(): coroutines on one event loop; the shared call is cancelled
+  only when every waiter has gone away
+- stream(): generators; a background thread reads the upstream stream
+  into a buffer that every concurrent reader replays from the start
+
+Only in-flight requests are shared; nothing is kept once the call
+finishes (caching is the caches' job). Followers get a deep copy of the
+leader's result, so a caller that mutates its dict (adding "source",
+cache stamps) does not change anyone else's.
+
+Author: Krishi-Mitra Team
+"""
+
+import asyncio
+import copy
+import functools
+import threading
+from typing import Callable, Dict, Hashable, Iterator
+
+_lock = threading.Lock()
+_STATS = {}  # namespace -> counters
+
+
+def _copy(value):
+    """A follower's own copy of a shared result (as is if it cannot be copied)."""
+    try:
+        return copy.deepcopy(value)
+    except Exception:
+        return value
+
+
+def _count(namespace: str, leader: bool):
+    """Record one request (caller holds _lock)."""
+    stats = _STATS.setdefault(namespace, {"requests": 0, "upstream_calls": 0})
+    stats["requests"] += 1
+    if leader:
+        stats["upstream_calls"] += 1
+
+
+# ============================================================
+# THREADS
+# ============================================================
+
+class _Call:
+    """One in-flight call shared by a leader thread and its followers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_calls: Dict[tuple, _Call] = {}
+
+
+def do(namespace: str, key: Hashable, fn: Callable, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) once for every concurrent caller with the same
+    (namespace, key); all of them get its return value (followers a copy)
+    or exception.
+    """
+    flight = (namespace, key)
+    with _lock:
+        call = _calls.get(flight)
+        leader = call is None
+        if leader:
+            call = _calls[flight] = _Call()
+        _count(namespace, leader)
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return _copy(call.result)
+
+    try:
+        call.result = fn(*args, **kwargs)
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            del _calls[flight]
+        call.done.set()
+
+
+def coalesce(namespace: str):
+    """Decorator: concurrent calls with equal arguments share one execution."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return do(namespace, (args, tuple(sorted(kwargs.items()))), fn, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ============================================================
+# ASYNCIO
+# ============================================================
+
+_tasks: Dict[tuple, list] = {}  # (namespace, key, loop) -> [task, waiters]
+
+
+async def do_async(namespace: str, key: Hashable, coro_factory: Callable):
+    """
+    Await coro_factory() once for every concurrent awaiter with the same
+    (namespace, key); followers get a copy of the result. An awaiter that
+    is cancelled (e.g. by its own deadline) leaves the shared call running
+    for the others; the call is cancelled when its last awaiter leaves.
+    """
+    # Tasks belong to one event loop, so flights are per loop
+    flight = (namespace, key, asyncio.get_running_loop())
+    with _lock:
+        entry = _tasks.get(flight)
+        leader = entry is None
+        if leader:
+            task = asyncio.ensure_future(coro_factory())
+            entry = _tasks[flight] = [task, 0]
+            task.add_done_callback(lambda _, flight=flight, entry=entry: _forget(flight, entry))
+        entry[1] += 1
+        _count(namespace, leader)
+
+    try:
+        result = await asyncio.shield(entry[0])
+        return result if leader else _copy(result)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and not entry[0].done():
+            entry[0].cancel()
+
+
+def _forget(flight: tuple, entry: list):
+    with _lock:
+        if _tasks.get(flight) is entry:
+            del _tasks[flight]
+
+
+# ============================================================
+# STREAMS
+# ============================================================
+
+class _SharedStream:
+    """Chunks of one upstream generator, filled by a background thread."""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.cond = threading.Condition()
+
+
+_streams: Dict[tuple, _SharedStream] = {}
+
+
+def _pump(flight: tuple, shared: _SharedStream, gen_factory: Callable):
+    try:
+        for chunk in gen_factory():
+            with shared.cond:
+                shared.chunks.append(chunk)
+                shared.cond.notify_all()
+    except Exception as e:
+        shared.error = e
+    finally:
+        with _lock:
+            del _streams[flight]
+        with shared.cond:
+            shared.finished = True
+            shared.cond.notify_all()
+
+
+def stream(namespace: str, key: Hashable, gen_factory: Callable[[], Iterator]) -> Iterator:
+    """
+    Iterate gen_factory() once for every concurrent reader with the same
+    (namespace, key). Readers that join late still receive every chunk
+    from the beginning; a reader that stops early does not stop the others.
+    """
+    flight = (namespace, key)
+    with _lock:
+        shared = _streams.get(flight)
+        leader = shared is None
+        if leader:
+            shared = _streams[flight] = _SharedStream()
+            threading.Thread(target=_pump, args=(flight, shared, gen_factory),
+                             name=f"single-flight-{namespace}", daemon=True).start()
+        _count(namespace, leader)
+
+    position = 0
+    while True:
+        with shared.cond:
+            while position >= len(shared.chunks) and not shared.finished:
+                shared.cond.wait()
+            pending = shared.chunks[position:]
+            finished = shared.finished
+        for chunk in pending:
+            yield chunk
+        position += len(pending)
+        if finished and position >= len(shared.chunks):
+            if shared.error is not None:
+                raise shared.error
+            return
+
+
+# ============================================================
+# STATS
+# ============================================================
+
+def get_single_flight_stats() -> Dict:
+    """
+    Per namespace: requests made, upstream calls actually sent, requests
+    served by another caller's call, and the coalescing ratio
+    (coalesced / requests).
+    """
+    with _lock:
+        stats = {namespace: dict(counters) for namespace, counters in _STATS.items()}
+        in_flight = {}
+        for flight in list(_calls) + list(_tasks) + list(_streams):
+            in_flight[flight[0]] = in_flight.get(flight[0], 0) + 1
+
+    total = {"requests": 0, "upstream_calls": 0}
+    for namespace, counters in stats.items():
+        counters["coalesced"] = counters["requests"] - counters["upstream_calls"]
+        counters["coalescing_ratio"] = counters["coalesced"] / counters["requests"] if counters["requests"] else 0.0
+        counters["in_flight"] = in_flight.get(namespace, 0)
+        total["requests"] += counters["requests"]
+        total["upstream_calls"] += counters["upstream_calls"]
+    total["coalesced"] = total["requests"] - total["upstream_calls"]
+    total["coalescing_ratio"] = total["coalesced"] / total["requests"] if total["requests"] else 0.0
+    return {"total": total, "namespaces": stats}